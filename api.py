@@ -2,24 +2,43 @@ import streamlit as st # Usado APENAS para type hint UploadFile
 import os
 import uuid
 import shutil # Para manipulação de arquivos (copiar/mover/remover)
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
+import json
+import asyncio
+import time
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 import uvicorn # Para rodar o servidor (embora não seja chamado diretamente no código)
 from typing import Dict, Any, Optional
+from datetime import date
+import openai
 
 # --- MUDANÇA AQUI: Importação adicionada ---
 from langchain_core.messages import HumanMessage
 # --- FIM DA MUDANÇA ---
+from langgraph.errors import GraphRecursionError
 
 # Importa o CÉREBRO do nosso agente LangGraph
-from workflows.graph import app as langgraph_app
+from workflows.graph import app as langgraph_app, montar_estado_inicial, montar_config
 # Importa o "molde" de dados Pydantic
 from tools.extracao import DadosNotaFiscal
+from tools.prazos import PRAZO_TOTAL_SEGUNDOS
+from tools.armazenamento import armazenamento_notas, CONSULTA_LIMITE_MAX, PERIODOS
+from tools.exportacao import FORMATOS_EXPORTACAO, gerar_exportacao, nome_arquivo_exportacao
+from workers.fila import fila_tarefas, FilaCheia, FILA_UPLOADS_DIR, remover_upload
+from workflows.perfilador import motivo_perfil, sessao_perfil
 
 # --- Diretórios ---
 API_UPLOAD_DIR = "api_uploads"
 os.makedirs(API_UPLOAD_DIR, exist_ok=True)
 
+# --- Streaming (SSE) ---
+# Intervalo do "ping" para proxies (ex: Render) não derrubarem a conexão ociosa
+SSE_INTERVALO_PING_SEGUNDOS = float(os.getenv("NF_SSE_INTERVALO_PING_SEGUNDOS", "10"))
+
+# --- Prazos ---
+# Tolerância além do prazo total antes de abandonar o grafo (o cancelamento nas etapas é cooperativo)
+PRAZO_FOLGA_SEGUNDOS = float(os.getenv("NF_PRAZO_FOLGA_SEGUNDOS", "10"))
+
 # --- Inicializa o aplicativo FastAPI ---
 api = FastAPI(
     title="Meta Singularity NF Extractor API",
@@ -27,6 +46,66 @@ api = FastAPI(
     version="1.0.0"
 )
 
+# --- Funções Auxiliares ---
+def _validar_modo(mode: str) -> None:
+    if mode not in ["single", "accumulated"]:
+        raise HTTPException(status_code=400, detail="Modo inválido. Use 'single' ou 'accumulated'.")
+
+async def _salvar_upload_temporario(file: UploadFile, pasta: str = API_UPLOAD_DIR) -> str:
+    """Salva o upload em 'pasta' (padrão: API_UPLOAD_DIR) e retorna o caminho."""
+    os.makedirs(pasta, exist_ok=True)
+    temp_file_path = os.path.join(pasta, f"{uuid.uuid4()}_{file.filename}")
+    try:
+        with open(temp_file_path, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
+        print(f"Arquivo salvo temporariamente em: {temp_file_path}")
+        return temp_file_path
+    except Exception as e:
+        print(f"Erro ao salvar arquivo temporário: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro ao salvar arquivo: {e}")
+    finally:
+        await file.close()
+
+def _remover_arquivo_temporario(temp_file_path: str) -> None:
+    try:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+            print(f"Arquivo temporário removido: {temp_file_path}")
+    except OSError as e:
+        print(f"Erro ao remover arquivo temporário {temp_file_path}: {e}")
+
+def _prazo_da_requisicao(prazo_segundos: Optional[float]) -> float:
+    """O cliente pode pedir um prazo menor que o configurado, nunca maior."""
+    if prazo_segundos is None or prazo_segundos <= 0:
+        return PRAZO_TOTAL_SEGUNDOS
+    return min(prazo_segundos, PRAZO_TOTAL_SEGUNDOS)
+
+def _erro_do_provedor(e: Exception) -> Optional[HTTPException]:
+    """Traduz erros do provedor LLM (já esgotadas as novas tentativas) em 429/503."""
+    if isinstance(e, openai.RateLimitError):
+        return HTTPException(status_code=429, detail="Limite de requisições ao modelo atingido. Tente novamente em instantes.",
+                             headers={"Retry-After": "30"})
+    if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)):
+        return HTTPException(status_code=503, detail="Serviço do modelo temporariamente indisponível. Tente novamente em instantes.",
+                             headers={"Retry-After": "30"})
+    return None
+
+def _evento_sse(tipo: str, dados: Dict[str, Any]) -> str:
+    return f"event: {tipo}\ndata: {json.dumps(dados, ensure_ascii=False, default=str)}\n\n"
+
+def _resumir_atualizacao(no: str, atualizacao: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Resumo leve do que um nó produziu (sem o texto bruto do OCR)."""
+    resumo = {"no": no}
+    if not atualizacao:
+        return resumo
+    mensagens = atualizacao.get("messages") or []
+    ferramentas = [tc["name"] for msg in mensagens for tc in (getattr(msg, "tool_calls", None) or [])]
+    if ferramentas:
+        resumo["ferramentas_chamadas"] = ferramentas
+    if atualizacao.get("excel_file_path"):
+        resumo["excel_file_path"] = atualizacao["excel_file_path"]
+    return resumo
+
 # --- Endpoint de Teste (Raiz) ---
 @api.get("/")
 async def read_root():
@@ -39,74 +118,300 @@ async def read_root():
           response_description="JSON contendo os dados extraídos da nota fiscal")
 async def processar_nota_fiscal(
     file: UploadFile = File(..., description="Arquivo da Nota Fiscal (.pdf, .xml, .html, .png, .jpg)"),
-    mode: str = Form(..., description="Modo de operação: 'single' ou 'accumulated'")
+    mode: str = Form(..., description="Modo de operação: 'single' ou 'accumulated'"),
+    prazo_segundos: Optional[float] = Form(None, description="Prazo máximo do documento em segundos (limitado ao configurado no servidor)"),
+    x_perfil: Optional[str] = Header(None, description="'1' grava um perfil (flame graph) desta requisição")
 ) -> JSONResponse:
     """
     Recebe um arquivo de nota fiscal e o modo de operação,
     processa usando o agente LangGraph e retorna os dados extraídos em JSON.
+    Se o prazo esgotar, retorna o que já foi extraído com 'X-Status-Processamento: parcial'.
+    Com 'X-Perfil: 1', a resposta traz em 'X-Perfil' o nome do perfil gravado.
     """
     print(f"Recebida requisição para processar '{file.filename}' no modo '{mode}'")
 
-    if mode not in ["single", "accumulated"]:
-        raise HTTPException(status_code=400, detail="Modo inválido. Use 'single' ou 'accumulated'.")
+    _validar_modo(mode)
 
     # --- Salvar Arquivo Temporariamente ---
-    temp_file_path = os.path.join(API_UPLOAD_DIR, f"{uuid.uuid4()}_{file.filename}")
-    try:
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        print(f"Arquivo salvo temporariamente em: {temp_file_path}")
-    except Exception as e:
-        print(f"Erro ao salvar arquivo temporário: {e}")
-        raise HTTPException(status_code=500, detail=f"Erro ao salvar arquivo: {e}")
-    finally:
-        await file.close()
+    temp_file_path = await _salvar_upload_temporario(file)
 
     # --- Preparar e Chamar o Agente LangGraph ---
     thread_id = str(uuid.uuid4())
-    config = {"configurable": {"thread_id": thread_id}}
-    prompt_tecnico = f"Processar via API: {temp_file_path}"
+    prazo = _prazo_da_requisicao(prazo_segundos)
+    config = montar_config(thread_id, prazo)
+    estado_inicial = montar_estado_inicial(temp_file_path, mode)
 
-    estado_inicial = {
-        "messages": [HumanMessage(content=prompt_tecnico)], # Agora HumanMessage está definido
-        "file_path": temp_file_path,
-        "excel_file_path": None,
-        "app_mode": mode,
-        "extracted_data": None
-    }
+    # Perfil por amostragem (cabeçalho, sorteio ou requisições lentas); gravado ao sair do bloco
+    with sessao_perfil(file.filename, motivo_perfil(x_perfil), temp_file_path) as sessao:
+        try:
+            print(f"Invocando agente LangGraph (Thread ID: {thread_id}, prazo: {prazo:.0f}s)...")
+            try:
+                final_state = await asyncio.wait_for(langgraph_app.ainvoke(estado_inicial, config=config),
+                                                     timeout=prazo + PRAZO_FOLGA_SEGUNDOS)
+                status_processamento = final_state.get("status_processamento") or "completo"
+                print("Agente LangGraph concluiu.")
+            except (asyncio.TimeoutError, GraphRecursionError) as e:
+                # Usa o último estado salvo pelo checkpointer (ex: dados já gravados antes do loop/atraso)
+                print(f"Agente interrompido ({type(e).__name__}), retornando o resultado parcial.")
+                final_state = (await langgraph_app.aget_state(config)).values
+                status_processamento = "parcial"
 
-    try:
-        print(f"Invocando agente LangGraph (Thread ID: {thread_id})...")
-        final_state = langgraph_app.invoke(estado_inicial, config=config)
-        print("Agente LangGraph concluiu.")
-
-        dados_extraidos = final_state.get("extracted_data")
-        excel_path = final_state.get("excel_file_path")
-
-        if dados_extraidos:
-             print(f"Dados extraídos com sucesso. Excel salvo em: {excel_path}")
-             return JSONResponse(content=dados_extraidos, status_code=200)
-        else:
-             last_message = final_state.get("messages", [])[-1]
-             error_detail = f"Agente concluiu, mas não retornou dados extraídos. Última mensagem: {getattr(last_message, 'content', 'N/A')}"
-             print(error_detail)
-             raise HTTPException(status_code=500, detail=error_detail)
+            dados_extraidos = final_state.get("extracted_data")
+            excel_path = final_state.get("excel_file_path")
+            campos_invalidos = final_state.get("campos_invalidos")
+            headers = {"X-Status-Processamento": status_processamento}
+            if sessao is not None and sessao.motivo == "cabecalho":
+                headers["X-Perfil"] = sessao.nome_base
+            duplicata = final_state.get("duplicata_de")
+            if duplicata: # Imagem quase idêntica a uma já processada (id no índice de imagens)
+                headers["X-Duplicata-De"] = str(duplicata["id"])
+                headers["X-Duplicata-Reutilizada"] = "1" if duplicata["reutilizada"] else "0"
 
-    except Exception as e:
-        print(f"Erro durante a execução do agente LangGraph: {e}")
-        raise HTTPException(status_code=500, detail=f"Erro interno do servidor ao processar a nota: {e}")
+            if dados_extraidos:
+                 print(f"Dados extraídos ({status_processamento}). Excel salvo em: {excel_path}")
+                 # Campos que continuaram reprovados na validação (mesmo após a re-extração direcionada)
+                 if campos_invalidos:
+                     headers["X-Campos-Invalidos"] = ",".join(sorted(campos_invalidos))
+                 return JSONResponse(content=dados_extraidos, status_code=200, headers=headers)
+            elif status_processamento == "parcial":
+                 raise HTTPException(status_code=504, detail="Prazo de processamento esgotado antes de extrair os dados da nota.",
+                                     headers=headers)
+            else:
+                 last_message = (final_state.get("messages") or [None])[-1]
+                 error_detail = f"Agente concluiu, mas não retornou dados extraídos. Última mensagem: {getattr(last_message, 'content', 'N/A')}"
+                 print(error_detail)
+                 raise HTTPException(status_code=500, detail=error_detail, headers=headers)
 
-    finally:
-        # --- Limpeza do Arquivo Temporário ---
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Erro durante a execução do agente LangGraph: {e}")
+            # O cliente LLM já tentou de novo com backoff; se o provedor continua limitando, vira 429/503
+            erro_provedor = _erro_do_provedor(e)
+            if erro_provedor is not None:
+                raise erro_provedor
+            raise HTTPException(status_code=500, detail=f"Erro interno do servidor ao processar a nota: {e}")
+
+        finally:
+            # --- Limpeza do Arquivo Temporário ---
+            _remover_arquivo_temporario(temp_file_path)
+
+# --- Endpoint de Processamento com Streaming (SSE) ---
+@api.post("/processar_nf/stream",
+          summary="Processa um arquivo de Nota Fiscal enviando o progresso via Server-Sent Events",
+          response_description="Fluxo text/event-stream com os eventos do agente")
+async def processar_nota_fiscal_stream(
+    file: UploadFile = File(..., description="Arquivo da Nota Fiscal (.pdf, .xml, .html, .png, .jpg)"),
+    mode: str = Form(..., description="Modo de operação: 'single' ou 'accumulated'"),
+    prazo_segundos: Optional[float] = Form(None, description="Prazo máximo do documento em segundos (limitado ao configurado no servidor)")
+) -> StreamingResponse:
+    """
+    Igual ao /processar_nf/, mas responde imediatamente com um fluxo SSE:
+    - 'inicio': requisição aceita;
+    - 'no_iniciado' / 'no_concluido': etapas do agente (agent/action);
+    - 'pagina_ocr': página k de N lida pelo OCR;
+    - 'reextracao': campos reprovados na validação sendo relidos do texto bruto;
+    - 'dados_extraidos': campos da nota assim que forem salvos;
+    - 'concluido' ou 'erro': fim do fluxo ('status_processamento': 'completo' ou 'parcial').
+    """
+    print(f"Recebida requisição (stream) para processar '{file.filename}' no modo '{mode}'")
+    _validar_modo(mode)
+    temp_file_path = await _salvar_upload_temporario(file)
+
+    thread_id = str(uuid.uuid4())
+    prazo = _prazo_da_requisicao(prazo_segundos)
+    config = montar_config(thread_id, prazo)
+    estado_inicial = montar_estado_inicial(temp_file_path, mode)
+
+    async def gerar_eventos():
+        yield _evento_sse("inicio", {"thread_id": thread_id, "arquivo": file.filename, "modo": mode, "prazo_segundos": prazo})
+        fluxo = langgraph_app.astream(estado_inicial, config=config, stream_mode=["updates", "custom"]).__aiter__()
+        proximo = None
+        dados_extraidos, excel_path, campos_invalidos, duplicata_de = None, None, None, None
+        status_processamento = "completo"
+        limite = time.monotonic() + prazo + PRAZO_FOLGA_SEGUNDOS
         try:
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
-                print(f"Arquivo temporário removido: {temp_file_path}")
-        except OSError as e:
-            print(f"Erro ao remover arquivo temporário {temp_file_path}: {e}")
+            while True:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    print("Prazo do stream esgotado, encerrando com o resultado parcial.")
+                    status_processamento = "parcial"
+                    break # O finally cancela a etapa pendente
+                if proximo is None:
+                    proximo = asyncio.ensure_future(fluxo.__anext__())
+                concluidos, _ = await asyncio.wait({proximo}, timeout=min(SSE_INTERVALO_PING_SEGUNDOS, restante))
+                if not concluidos:
+                    yield ": ping\n\n" # Comentário SSE: mantém a conexão viva
+                    continue
+                try:
+                    modo_stream, pedaco = proximo.result()
+                except StopAsyncIteration:
+                    break
+                except GraphRecursionError:
+                    print("Limite de passos do grafo atingido, encerrando com o resultado parcial.")
+                    status_processamento = "parcial"
+                    break
+                finally:
+                    proximo = None
+
+                if modo_stream == "custom":
+                    evento = dict(pedaco)
+                    yield _evento_sse(evento.pop("evento", "progresso"), evento)
+                    continue
+
+                for no, atualizacao in pedaco.items():
+                    yield _evento_sse("no_concluido", _resumir_atualizacao(no, atualizacao))
+                    if atualizacao and atualizacao.get("excel_file_path"):
+                        excel_path = atualizacao["excel_file_path"]
+                    if atualizacao and "campos_invalidos" in atualizacao:
+                        campos_invalidos = atualizacao["campos_invalidos"]
+                    if atualizacao and atualizacao.get("duplicata_de"):
+                        duplicata_de = atualizacao["duplicata_de"]
+                    if atualizacao and atualizacao.get("status_processamento"):
+                        status_processamento = atualizacao["status_processamento"]
+                    if atualizacao and atualizacao.get("extracted_data") and atualizacao["extracted_data"] != dados_extraidos:
+                        dados_extraidos = atualizacao["extracted_data"]
+                        yield _evento_sse("dados_extraidos", dados_extraidos)
+
+            if dados_extraidos:
+                yield _evento_sse("concluido", {"status_code": 200, "excel_file_path": excel_path, "dados": dados_extraidos,
+                                                "campos_invalidos": campos_invalidos or {}, "status_processamento": status_processamento,
+                                                "duplicata_de": duplicata_de})
+            elif status_processamento == "parcial":
+                yield _evento_sse("erro", {"status_code": 504, "detail": "Prazo de processamento esgotado antes de extrair os dados da nota.",
+                                           "status_processamento": status_processamento})
+            else:
+                estado = await langgraph_app.aget_state(config)
+                last_message = (estado.values.get("messages") or [None])[-1]
+                yield _evento_sse("erro", {"status_code": 500, "detail": f"Agente concluiu, mas não retornou dados extraídos. Última mensagem: {getattr(last_message, 'content', 'N/A')}"})
+
+        except Exception as e:
+            print(f"Erro durante o stream do agente LangGraph: {e}")
+            erro_provedor = _erro_do_provedor(e)
+            if erro_provedor is not None:
+                yield _evento_sse("erro", {"status_code": erro_provedor.status_code, "detail": erro_provedor.detail})
+            else:
+                yield _evento_sse("erro", {"status_code": 500, "detail": f"Erro interno do servidor ao processar a nota: {e}"})
+
+        finally:
+            if proximo is not None: # Cliente desconectou no meio do processamento
+                proximo.cancel()
+            _remover_arquivo_temporario(temp_file_path)
+
+    return StreamingResponse(
+        gerar_eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Evita buffer em proxies (nginx/Render)
+    )
+
+# --- Processamento Assíncrono (fila durável + workers) ---
+@api.post("/tarefas",
+          status_code=202,
+          summary="Enfileira um arquivo de Nota Fiscal para os workers de extração",
+          response_description="Id da tarefa para consultar o resultado em /tarefas/{tarefa_id}")
+async def enfileirar_nota_fiscal(
+    file: UploadFile = File(..., description="Arquivo da Nota Fiscal (.pdf, .xml, .html, .png, .jpg)"),
+    mode: str = Form(..., description="Modo de operação: 'single' ou 'accumulated'"),
+    prazo_segundos: Optional[float] = Form(None, description="Prazo máximo do documento em segundos (limitado ao configurado no servidor)")
+) -> JSONResponse:
+    """
+    Não processa na API: grava o arquivo e cria a tarefa na fila. O OCR/LLM roda
+    nos workers ('python -m workers.extract'), que escalam separados da API.
+    Fila cheia: 503 com Retry-After.
+    """
+    print(f"Recebida requisição (fila) para processar '{file.filename}' no modo '{mode}'")
+    _validar_modo(mode)
+    arquivo = await _salvar_upload_temporario(file, FILA_UPLOADS_DIR)
+    try:
+        tarefa_id = await asyncio.to_thread(fila_tarefas.enfileirar, arquivo, mode, file.filename,
+                                            _prazo_da_requisicao(prazo_segundos))
+    except FilaCheia as e:
+        remover_upload(arquivo)
+        raise HTTPException(status_code=503, detail=f"{e} Tente novamente em instantes.", headers={"Retry-After": "30"})
+    url = f"/tarefas/{tarefa_id}"
+    return JSONResponse(content={"tarefa_id": tarefa_id, "estado": "pendente", "url": url},
+                        status_code=202, headers={"Location": url})
+
+@api.get("/tarefas",
+         summary="Quantidade de tarefas na fila por estado")
+def contar_tarefas() -> Dict[str, Any]:
+    return {"capacidade": fila_tarefas.capacidade, "estados": fila_tarefas.contar()}
+
+@api.get("/tarefas/{tarefa_id}",
+         summary="Estado e resultado de uma tarefa enfileirada",
+         response_description="'estado': pendente, processando, concluida ou falhou; 'resultado' no formato do evento 'concluido'")
+def consultar_tarefa(tarefa_id: str) -> Dict[str, Any]:
+    tarefa = fila_tarefas.obter(tarefa_id)
+    if tarefa is None:
+        raise HTTPException(status_code=404, detail="Tarefa não encontrada.")
+    campos = ("id", "estado", "nome_original", "modo", "tentativas", "criada_em", "atualizada_em", "resultado", "erro")
+    return {campo: tarefa[campo] for campo in campos}
+
+# --- Consultas sobre as Notas Salvas (armazenamento indexado) ---
+# Funções síncronas: o FastAPI as executa no pool de threads, sem travar o loop do stream
+@api.get("/notas",
+         summary="Lista as notas salvas, com filtros e paginação",
+         response_description="Página de notas (mais recentes primeiro) e o cursor da próxima página")
+def listar_notas(
+    cnpj_emitente: Optional[str] = Query(None, description="CNPJ/CPF do emitente (com ou sem pontuação)"),
+    cnpj_cpf_destinatario: Optional[str] = Query(None, description="CNPJ/CPF do destinatário"),
+    chave_acesso: Optional[str] = Query(None, description="Chave de acesso ou código de verificação"),
+    data_inicio: Optional[date] = Query(None, description="Data de emissão inicial (AAAA-MM-DD)"),
+    data_fim: Optional[date] = Query(None, description="Data de emissão final, inclusiva (AAAA-MM-DD)"),
+    limite: int = Query(50, ge=1, le=CONSULTA_LIMITE_MAX, description="Notas por página"),
+    cursor: Optional[str] = Query(None, description="'proximo_cursor' da página anterior")
+) -> Dict[str, Any]:
+    try:
+        itens, proximo_cursor = armazenamento_notas.consultar(
+            cnpj_emitente=cnpj_emitente, cnpj_cpf_destinatario=cnpj_cpf_destinatario, chave_acesso=chave_acesso,
+            data_inicio=data_inicio, data_fim=data_fim, limite=limite, cursor=cursor
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+    return {"itens": itens, "quantidade": len(itens), "proximo_cursor": proximo_cursor}
+
+@api.get("/notas/agregados",
+         summary="Totais das notas salvas por período e/ou emitente",
+         response_description="Quantidade e somas de valor_total, valor_iss e valor_icms por grupo")
+def agregar_notas(
+    periodo: str = Query("mes", description=f"Agrupamento por data de emissão: {', '.join(PERIODOS)}"),
+    por_emitente: bool = Query(False, description="Agrupa também por CNPJ do emitente"),
+    cnpj_emitente: Optional[str] = Query(None, description="Restringe a um emitente"),
+    data_inicio: Optional[date] = Query(None, description="Data de emissão inicial (AAAA-MM-DD)"),
+    data_fim: Optional[date] = Query(None, description="Data de emissão final, inclusiva (AAAA-MM-DD)")
+) -> Dict[str, Any]:
+    try:
+        grupos = armazenamento_notas.agregar(periodo=periodo, por_emitente=por_emitente, cnpj_emitente=cnpj_emitente,
+                                             data_inicio=data_inicio, data_fim=data_fim)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"periodo": periodo, "grupos": grupos}
+
+@api.get("/exportar",
+         summary="Exporta as notas salvas em CSV, XLSX ou Parquet (download em blocos)",
+         response_description="Arquivo para download")
+def exportar_notas(
+    formato: str = Query("xlsx", description=f"Formato do arquivo: {', '.join(FORMATOS_EXPORTACAO)}"),
+    cnpj_emitente: Optional[str] = Query(None, description="CNPJ/CPF do emitente"),
+    cnpj_cpf_destinatario: Optional[str] = Query(None, description="CNPJ/CPF do destinatário"),
+    data_inicio: Optional[date] = Query(None, description="Data de emissão inicial (AAAA-MM-DD)"),
+    data_fim: Optional[date] = Query(None, description="Data de emissão final, inclusiva (AAAA-MM-DD)")
+) -> StreamingResponse:
+    """As notas são lidas e escritas em lotes: a memória não cresce com o número de notas."""
+    try:
+        blocos = gerar_exportacao(formato, cnpj_emitente=cnpj_emitente, cnpj_cpf_destinatario=cnpj_cpf_destinatario,
+                                  data_inicio=data_inicio, data_fim=data_fim)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Iterador síncrono: o Starlette o consome no pool de threads, sem travar o loop
+    return StreamingResponse(
+        blocos,
+        media_type=FORMATOS_EXPORTACAO[formato],
+        headers={"Content-Disposition": f'attachment; filename="{nome_arquivo_exportacao(formato)}"'}
+    )
 
 # --- Instrução para Rodar (não faz parte do código da API em si) ---
 if __name__ == "__main__":
     print("\n--- Para rodar a API localmente, use o comando no terminal: ---")
     print("uvicorn api:api --reload")
-    print("---------------------------------------------------------------\n")
\ No newline at end of file
+    print("---------------------------------------------------------------\n")
@@ -1,18 +1,19 @@
 import streamlit as st
 import os
 import uuid
-from workflows.graph import app as langgraph_app # Renomeado para clareza
+from workflows.graph import app as langgraph_app, montar_config # Renomeado para clareza
+from tools.prazos import PRAZO_TOTAL_SEGUNDOS
+from langgraph.errors import GraphRecursionError
 from langchain_core.messages import HumanMessage
 import time
+from tools.exportacao import FORMATOS_EXPORTACAO, exportar_para_arquivo, formatos_disponiveis, nome_arquivo_exportacao
 
 # --- Novas Importações para RAG ---
-from langchain_community.document_loaders import UnstructuredMarkdownLoader
-from langchain_community.vectorstores import FAISS
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from rag.indice import obter_indice, calcular_hash_docs
+from rag.cache_respostas import CacheRespostasRAG
+from rag.assistente import AssistenteRAG
 # Para a pipeline RAG
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.output_parsers import StrOutputParser
 from langchain.prompts import ChatPromptTemplate
 
 # --- CSS Personalizado (Sem mudanças) ---
@@ -73,6 +74,8 @@ st.set_page_config( page_title="Meta Singularity - Agente NF", page_icon="assets
 # --- Diretórios (Sem mudanças) ---
 UPLOAD_DIR = "dados_upload"; OUTPUT_DIR = "dados_saida"
 os.makedirs(UPLOAD_DIR, exist_ok=True); os.makedirs(OUTPUT_DIR, exist_ok=True)
+HISTORICO_MAX = int(os.getenv("NF_HISTORICO_MAX", "50")) # Mensagens desenhadas por vez no chat
+DOWNLOADS_CACHE_MAX = int(os.getenv("NF_DOWNLOADS_CACHE_MAX", "16")) # Versões de arquivos guardadas para download
 
 # --- Gerenciamento de Estado Principal (Sem mudanças) ---
 if "app_mode" not in st.session_state: st.session_state.app_mode = None
@@ -88,6 +91,16 @@ def reset_to_main_menu():
     st.session_state.app_mode = None; st.session_state.compiled_upload_method = None
     st.session_state.messages = []; st.session_state.rag_messages = []
     st.session_state.file_just_processed = False
+    st.session_state.pop("limite_historico_agent", None); st.session_state.pop("limite_historico_rag", None)
+
+def invocar_agente(estado_inicial):
+    """Roda o grafo com o limite de passos (montar_config); ao atingi-lo, usa o último estado salvo, como a API."""
+    if "thread_config" not in st.session_state: st.session_state.thread_config = montar_config(str(uuid.uuid4()), PRAZO_TOTAL_SEGUNDOS)
+    try:
+        return langgraph_app.invoke(estado_inicial, config=st.session_state.thread_config)
+    except GraphRecursionError:
+        print("Limite de passos do grafo atingido, usando o resultado parcial.")
+        return langgraph_app.get_state(st.session_state.thread_config).values
 
 # --- Funções RAG (Sem mudanças na lógica interna) ---
 @st.cache_resource
@@ -98,37 +111,73 @@ def initialize_rag_pipeline():
              os.makedirs("docs", exist_ok=True)
              with open(doc_path, "w", encoding="utf-8") as f:
                  f.write("# Guia API Meta Singularity NF Extract\n\nEndpoint: `/processar_nf/` (POST)\n\n...") # Conteúdo básico
-        loader = UnstructuredMarkdownLoader(doc_path)
-        docs = loader.load()
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=700, chunk_overlap=50)
-        splits = text_splitter.split_documents(docs)
+        # Índice persistido em disco: só gera embeddings de novo se os docs mudarem
         embeddings = OpenAIEmbeddings()
-        vectorstore = FAISS.from_documents(documents=splits, embedding=embeddings)
-        retriever = vectorstore.as_retriever()
+        vectorstore = obter_indice(embeddings)
         template = "Contexto: {context}\n\nPergunta: {question}\n\nUse APENAS o contexto para responder."
         prompt = ChatPromptTemplate.from_template(template)
         llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0)
-        rag_chain = ({"context": retriever, "question": RunnablePassthrough()} | prompt | llm | StrOutputParser())
+        # Perguntas repetidas/parecidas respondem do cache (invalidado quando os docs mudam)
+        cache_respostas = CacheRespostasRAG(hash_indice=calcular_hash_docs(embeddings))
+        rag_chain = AssistenteRAG(vectorstore, embeddings, prompt, llm, cache_respostas)
         st.session_state.rag_initialized = True
         return rag_chain
     except Exception as e:
         st.error(f"Erro RAG Init: {e}"); st.session_state.rag_initialized = False; return None
 
+# --- Downloads (sem reler arquivos a cada rerun) ---
+@st.cache_data(max_entries=DOWNLOADS_CACHE_MAX, show_spinner=False)
+def _ler_arquivo_download(caminho, mtime_ns, tamanho):
+    # mtime/tamanho só entram na chave do cache: o arquivo mudou, a leitura é refeita
+    with open(caminho, "rb") as f: return f.read()
+
+def render_download(rotulo, caminho, mime, key):
+    """Botão de download que só lê o arquivo no clique (e uma vez por versão do arquivo). False se não existir."""
+    try: info = os.stat(caminho)
+    except OSError: return False
+    st.download_button(rotulo, lambda: _ler_arquivo_download(caminho, info.st_mtime_ns, info.st_size), os.path.basename(caminho), mime, key=key, on_click="ignore")
+    return True
+
 # --- Funções de Renderização (Sem mudanças na lógica interna) ---
 def render_chat_history(chat_type="agent"):
     messages_key = "messages" if chat_type == "agent" else "rag_messages"
     if messages_key not in st.session_state: st.session_state[messages_key] = []
-    for i, message in enumerate(st.session_state[messages_key]):
+    messages = st.session_state[messages_key]
+    # Lotes grandes: só as últimas mensagens são desenhadas; as antigas carregam sob demanda
+    limite_key = f"limite_historico_{chat_type}"
+    limite = st.session_state.get(limite_key, HISTORICO_MAX)
+    inicio = max(0, len(messages) - limite)
+    if inicio:
+        col_info, col_botao = st.columns([3, 1])
+        col_info.caption(f"{inicio} mensagens anteriores ocultas.")
+        if col_botao.button("Mostrar anteriores", key=f"mais_historico_{chat_type}"):
+            st.session_state[limite_key] = limite + HISTORICO_MAX; st.rerun()
+    # No acumulado todas as respostas apontam para o mesmo COMPILADO_MESTRE.xlsx: um botão só, na mais recente
+    ultima_mensagem_por_arquivo = {message.get("excel_path"): i for i, message in enumerate(messages) if message.get("excel_path")}
+    for i in range(inicio, len(messages)):
+        message = messages[i]
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
             if chat_type == "agent" and message["role"] == "assistant" and "excel_path" in message:
                 excel_path = message["excel_path"]
-                if excel_path and isinstance(excel_path, str) and os.path.exists(excel_path):
-                    try:
-                        with open(excel_path, "rb") as f:
-                            st.download_button(f"Download {os.path.basename(excel_path)}", f, os.path.basename(excel_path), "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", key=f"hist_{chat_type}_{i}")
-                    except Exception as e: st.error(f"Erro ao ler download: {e}")
-                elif excel_path: st.caption(f"Arquivo '{os.path.basename(excel_path)}' não encontrado.")
+                if not excel_path or not isinstance(excel_path, str) or ultima_mensagem_por_arquivo.get(excel_path) != i: continue
+                if not render_download(f"Download {os.path.basename(excel_path)}", excel_path, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", key=f"hist_{chat_type}_{i}"):
+                    st.caption(f"Arquivo '{os.path.basename(excel_path)}' não encontrado.")
+
+def render_exportacao():
+    """Exporta todas as notas salvas (armazenamento indexado) em lotes, direto para um arquivo em disco."""
+    st.markdown("**Exportar notas salvas**")
+    formato = st.selectbox("Formato", formatos_disponiveis(), key="formato_exportacao", label_visibility="collapsed")
+    if st.button("Gerar exportação", key="btn_gerar_exportacao"):
+        caminho = os.path.join(OUTPUT_DIR, "exportacoes", nome_arquivo_exportacao(formato))
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with st.spinner("Exportando..."):
+            total = exportar_para_arquivo(formato, caminho)
+        st.session_state.arquivo_exportacao = (caminho, formato, total)
+    if st.session_state.get("arquivo_exportacao"):
+        caminho, formato, total = st.session_state.arquivo_exportacao
+        render_download(f"Download ({total} notas)", caminho, FORMATOS_EXPORTACAO[formato], key="btn_download_exportacao")
+    st.markdown("---")
 
 def render_sidebar():
     with st.sidebar:
@@ -138,6 +187,7 @@ def render_sidebar():
         if st.session_state.app_mode not in [None, "rag_chatbot"]:
             modo = "Único" if st.session_state.app_mode == "single" else "Compilado"; st.markdown(f"**Modo:** `{modo}`")
             if st.session_state.compiled_upload_method: sub = "Individual" if st.session_state.compiled_upload_method == 'single' else "Múltiplos"; st.markdown(f"**Upload:** `{sub}`")
+        if st.session_state.app_mode == "accumulated": render_exportacao()
         if st.session_state.app_mode is not None:
             if st.button("Voltar ao Menu Principal"): reset_to_main_menu(); st.rerun()
         st.markdown("---"); st.caption("Repo: [GitHub](https://github.com/BruAmaralTec/projeto_nf_agent)") # Atualize
@@ -180,8 +230,7 @@ elif st.session_state.app_mode == "single":
             with st.chat_message("assistant"):
                 with st.spinner("Agente pensando... 🧠"):
                     estado_inicial = {"messages": [HumanMessage(content=prompt_tecnico)], "file_path": temp_file_path, "excel_file_path": None, "app_mode": "single"}
-                    if "thread_config" not in st.session_state: st.session_state.thread_config = {"configurable": {"thread_id": str(uuid.uuid4())}}
-                    final_state = langgraph_app.invoke(estado_inicial, config=st.session_state.thread_config)
+                    final_state = invocar_agente(estado_inicial)
                     response_message = final_state["messages"][-1]; response_content = response_message.content; excel_path_final = final_state.get("excel_file_path")
                     st.markdown(response_content)
                     st.session_state.messages.append({"role": "assistant", "content": response_content, "excel_path": excel_path_final})
@@ -219,8 +268,7 @@ elif st.session_state.app_mode == "accumulated":
                 with st.chat_message("assistant"):
                     with st.spinner("Agente acumulando... 🧠"):
                         estado_inicial = {"messages": [HumanMessage(content=prompt_tecnico)], "file_path": temp_file_path, "excel_file_path": None, "app_mode": "accumulated"}
-                        if "thread_config" not in st.session_state: st.session_state.thread_config = {"configurable": {"thread_id": str(uuid.uuid4())}}
-                        final_state = langgraph_app.invoke(estado_inicial, config=st.session_state.thread_config)
+                        final_state = invocar_agente(estado_inicial)
                         response_message = final_state["messages"][-1]; response_content = response_message.content; excel_path_final = final_state.get("excel_file_path")
                         st.markdown(response_content)
                         st.session_state.messages.append({"role": "assistant", "content": response_content, "excel_path": excel_path_final})
@@ -239,7 +287,6 @@ elif st.session_state.app_mode == "accumulated":
                 total_files = len(uploaded_files_widget); st.info(f"Processando {total_files} arquivos...")
                 progress_bar = st.progress(0, text="Iniciando...")
                 last_excel_path = None
-                if "thread_config" not in st.session_state: st.session_state.thread_config = {"configurable": {"thread_id": str(uuid.uuid4())}}
                 for i, uploaded_file in enumerate(uploaded_files_widget):
                     file_name = uploaded_file.name; progress_text = f"Processando {i+1}/{total_files}: {file_name}"
                     progress_bar.progress((i + 1) / total_files, text=progress_text)
@@ -252,7 +299,7 @@ elif st.session_state.app_mode == "accumulated":
                         with st.spinner(f"Analisando {file_name}..."):
                              prompt_tecnico = f"Processar: {temp_file_path}"
                              estado_inicial = {"messages": [HumanMessage(content=prompt_tecnico)], "file_path": temp_file_path, "excel_file_path": None, "app_mode": "accumulated"}
-                             final_state = langgraph_app.invoke(estado_inicial, config=st.session_state.thread_config)
+                             final_state = invocar_agente(estado_inicial)
                              response_message = final_state["messages"][-1]; response_content = response_message.content; excel_path_final = final_state.get("excel_file_path")
                              last_excel_path = excel_path_final
                              st.markdown(response_content)
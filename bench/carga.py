@@ -0,0 +1,297 @@
+"""
+TESTE DE CARGA da API (FastAPI) com o LLM simulado pelo mock local.
+
+Sobe o mock da OpenAI em modo roteiro (bench/mock_openai.py) e a API num
+processo uvicorn separado apontando para ele (OPENAI_BASE_URL), numa pasta
+temporária (uploads, Excel e caches não sujam o projeto). Depois envia os
+arquivos de 'dados_teste/' com N requisições simultâneas e relata:
+- vazão (notas/min), latência p50/p95/p99 (geral e por tipo de arquivo);
+- taxa de erros por código HTTP;
+- memória (RSS) do processo da API ao longo do teste.
+
+O OCR/PDF/XML/HTML rodam de verdade; só o LLM é simulado.
+
+Uso:
+    python -m bench.carga --concorrencia 8 --duracao 60 --latencia-llm 0.8
+    python -m bench.carga --concorrencia 4 --total 100 --tipos xml,html --json resultado.json
+    python -m bench.carga --url http://127.0.0.1:8000 ...   # API já rodando (sem subir processo)
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import shutil
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from bench.mock_openai import iniciar_servidor_mock, FERRAMENTA_POR_EXTENSAO
+
+RAIZ_PROJETO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASTA_DADOS_TESTE = os.path.join(RAIZ_PROJETO, "dados_teste")
+TEMPO_SUBIDA_API_SEGUNDOS = 120 # Importar o grafo/LangChain demora em máquinas pequenas
+
+
+# --- Memória ---
+def rss_mb(pid: int) -> Optional[float]:
+    """RSS do processo (e filhos, ex: uvicorn --workers) em MB. None se não der para medir."""
+    try:
+        import psutil
+        processo = psutil.Process(pid)
+        return sum(p.memory_info().rss for p in [processo, *processo.children(recursive=True)]) / 1024 ** 2
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try: # Linux sem psutil: só o processo principal
+        with open(f"/proc/{pid}/status") as f:
+            for linha in f:
+                if linha.startswith("VmRSS:"):
+                    return int(linha.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+class AmostradorRSS(threading.Thread):
+    def __init__(self, pid: int, intervalo_segundos: float):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.intervalo_segundos = intervalo_segundos
+        self.amostras: List[Tuple[float, float]] = [] # (segundos desde o início, MB)
+        self._fim = threading.Event()
+        self._inicio = time.monotonic()
+
+    def run(self) -> None:
+        while True:
+            valor = rss_mb(self.pid)
+            if valor is not None:
+                self.amostras.append((round(time.monotonic() - self._inicio, 1), round(valor, 1)))
+            if self._fim.wait(self.intervalo_segundos):
+                return
+
+    def parar(self) -> None:
+        self._fim.set()
+        self.join()
+
+
+# --- API ---
+def _porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def subir_api(base_url_llm: str, pasta_trabalho: str, processos: int, env_extra: Dict[str, str]) -> Tuple[subprocess.Popen, str]:
+    """Sobe 'uvicorn api:api' com o LLM apontando para o mock. Retorna (processo, url)."""
+    porta = _porta_livre()
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join([RAIZ_PROJETO, os.environ.get("PYTHONPATH", "")]),
+        "OPENAI_BASE_URL": base_url_llm,
+        "OPENAI_API_KEY": "sk-carga",
+        "NF_CACHE_LLM_ATIVO": "0", # Cada requisição paga o LLM (simulado), como em produção com notas diferentes
+        **env_extra,
+    }
+    log = open(os.path.join(pasta_trabalho, "api.log"), "w")
+    processo = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:api", "--host", "127.0.0.1", "--port", str(porta), "--workers", str(processos),
+         "--log-level", "warning"],
+        cwd=pasta_trabalho, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    url = f"http://127.0.0.1:{porta}"
+    limite = time.monotonic() + TEMPO_SUBIDA_API_SEGUNDOS
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f"A API encerrou ao subir (veja {log.name}).")
+        try:
+            if httpx.get(url + "/", timeout=1).status_code == 200:
+                return processo, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    processo.terminate()
+    raise RuntimeError(f"A API não respondeu em {TEMPO_SUBIDA_API_SEGUNDOS}s (veja {log.name}).")
+
+
+# --- Carga ---
+def listar_arquivos(tipos: Optional[List[str]]) -> List[str]:
+    arquivos = sorted(
+        os.path.join(PASTA_DADOS_TESTE, nome) for nome in os.listdir(PASTA_DADOS_TESTE)
+        if os.path.isfile(os.path.join(PASTA_DADOS_TESTE, nome)) and os.path.splitext(nome)[1].lower() in FERRAMENTA_POR_EXTENSAO
+    )
+    if tipos:
+        arquivos = [a for a in arquivos if os.path.splitext(a)[1].lower().lstrip(".") in tipos]
+    if not arquivos:
+        raise SystemExit(f"Nenhum arquivo de teste em '{PASTA_DADOS_TESTE}' para os tipos {tipos}.")
+    return arquivos
+
+async def _cliente(cliente: httpx.AsyncClient, url: str, endpoint: str, modo: str, conteudos: Dict[str, bytes],
+                   sorteio: random.Random, limite: float, restantes: List[int], resultados: List[Dict[str, Any]]) -> None:
+    while time.monotonic() < limite:
+        if restantes[0] is not None:
+            if restantes[0] <= 0:
+                return
+            restantes[0] -= 1
+        caminho = sorteio.choice(list(conteudos))
+        nome = os.path.basename(caminho)
+        inicio = time.monotonic()
+        try:
+            resposta = await cliente.post(url + endpoint, files={"file": (nome, conteudos[caminho])}, data={"mode": modo})
+            status, processamento = resposta.status_code, resposta.headers.get("X-Status-Processamento")
+        except httpx.HTTPError as e:
+            status, processamento = type(e).__name__, None
+        resultados.append({
+            "tipo": os.path.splitext(nome)[1].lower().lstrip("."), "status": status, "processamento": processamento,
+            "latencia": time.monotonic() - inicio, "fim": time.monotonic(),
+        })
+
+async def gerar_carga(url: str, arquivos: List[str], concorrencia: int, duracao: Optional[float], total: Optional[int],
+                      endpoint: str, modo: str, semente: int, timeout: float) -> Tuple[List[Dict[str, Any]], float]:
+    conteudos = {}
+    for caminho in arquivos:
+        with open(caminho, "rb") as f:
+            conteudos[caminho] = f.read()
+    sorteio = random.Random(semente)
+    resultados: List[Dict[str, Any]] = []
+    restantes = [total]
+    limite = time.monotonic() + (duracao if duracao else float("inf"))
+    limites = httpx.Limits(max_connections=concorrencia, max_keepalive_connections=concorrencia)
+    inicio = time.monotonic()
+    async with httpx.AsyncClient(timeout=timeout, limits=limites) as cliente:
+        await asyncio.gather(*[
+            _cliente(cliente, url, endpoint, modo, conteudos, sorteio, limite, restantes, resultados) for _ in range(concorrencia)
+        ])
+    return resultados, time.monotonic() - inicio
+
+
+# --- Relatório ---
+def percentil(valores: List[float], p: float) -> Optional[float]:
+    """Percentil pelo posto mais próximo (p entre 0 e 100)."""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[indice]
+
+def _resumo_latencias(valores: List[float]) -> Dict[str, Optional[float]]:
+    return {f"p{p}": (round(percentil(valores, p), 3) if valores else None) for p in (50, 95, 99)}
+
+def montar_relatorio(resultados: List[Dict[str, Any]], duracao: float, amostras_rss: List[Tuple[float, float]],
+                     estatisticas_llm: Any, parametros: Dict[str, Any]) -> Dict[str, Any]:
+    sucesso = [r for r in resultados if r["status"] == 200]
+    erros = defaultdict(int)
+    for r in resultados:
+        if r["status"] != 200:
+            erros[str(r["status"])] += 1
+    por_tipo = {}
+    for tipo in sorted({r["tipo"] for r in resultados}):
+        do_tipo = [r for r in resultados if r["tipo"] == tipo]
+        por_tipo[tipo] = {"requisicoes": len(do_tipo), "erros": sum(1 for r in do_tipo if r["status"] != 200),
+                          **_resumo_latencias([r["latencia"] for r in do_tipo if r["status"] == 200])}
+    valores_rss = [mb for _, mb in amostras_rss]
+    return {
+        "parametros": parametros,
+        "duracao_segundos": round(duracao, 1),
+        "requisicoes": len(resultados),
+        "sucesso": len(sucesso),
+        "parciais": sum(1 for r in sucesso if r["processamento"] == "parcial"),
+        "notas_por_minuto": round(len(sucesso) / duracao * 60, 1) if duracao else 0.0,
+        "latencia_segundos": _resumo_latencias([r["latencia"] for r in sucesso]),
+        "taxa_erros": round(1 - len(sucesso) / len(resultados), 4) if resultados else 0.0,
+        "erros_por_status": dict(erros),
+        "por_tipo": por_tipo,
+        "chamadas_llm": estatisticas_llm.aceitas if estatisticas_llm else None,
+        "rss_mb": {"inicio": valores_rss[0] if valores_rss else None, "max": max(valores_rss) if valores_rss else None,
+                   "fim": valores_rss[-1] if valores_rss else None, "amostras": amostras_rss},
+    }
+
+def imprimir_relatorio(relatorio: Dict[str, Any]) -> None:
+    latencias = relatorio["latencia_segundos"]
+    print("\n=== Resultado do teste de carga ===")
+    print(f"Requisições: {relatorio['requisicoes']} em {relatorio['duracao_segundos']}s "
+          f"(concorrência {relatorio['parametros']['concorrencia']})")
+    print(f"Vazão: {relatorio['notas_por_minuto']} notas/min ({relatorio['sucesso']} com sucesso, {relatorio['parciais']} parciais)")
+    print(f"Latência: p50 {latencias['p50']}s | p95 {latencias['p95']}s | p99 {latencias['p99']}s")
+    print(f"Erros: {relatorio['taxa_erros']:.2%} {relatorio['erros_por_status'] or ''}")
+    for tipo, dados in relatorio["por_tipo"].items():
+        print(f"  {tipo:>5}: {dados['requisicoes']} req, {dados['erros']} erros, p50 {dados['p50']}s, p95 {dados['p95']}s, p99 {dados['p99']}s")
+    rss = relatorio["rss_mb"]
+    if rss["amostras"]:
+        print(f"RSS da API: início {rss['inicio']} MB | máx {rss['max']} MB | fim {rss['fim']} MB")
+        passo = max(1, len(rss["amostras"]) // 10)
+        print("  " + "  ".join(f"{t:.0f}s:{mb:.0f}MB" for t, mb in rss["amostras"][::passo]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Teste de carga da API com LLM simulado.")
+    parser.add_argument("--concorrencia", type=int, default=4, help="Requisições simultâneas")
+    parser.add_argument("--duracao", type=float, default=None, help="Duração do teste em segundos (padrão: 60 se --total não for dado)")
+    parser.add_argument("--total", type=int, default=None, help="Número total de requisições")
+    parser.add_argument("--tipos", default=None, help="Tipos de arquivo de dados_teste/, ex: xml,html,pdf,png (padrão: todos)")
+    parser.add_argument("--endpoint", default="/processar_nf/")
+    parser.add_argument("--modo", default="single", choices=["single", "accumulated"])
+    parser.add_argument("--latencia-llm", type=float, default=0.8, help="Latência de cada chamada ao LLM simulado (segundos)")
+    parser.add_argument("--variacao-llm", type=float, default=0.4, help="Latência extra sorteada do LLM simulado (segundos)")
+    parser.add_argument("--rpm-llm", type=float, default=None, help="Limite do provedor simulado (acima disso, 429)")
+    parser.add_argument("--processos-api", type=int, default=1, help="Workers do uvicorn (1 = um contêiner com um processo)")
+    parser.add_argument("--url", default=None, help="API já rodando (o mock e a API não são iniciados)")
+    parser.add_argument("--intervalo-rss", type=float, default=1.0, help="Intervalo das amostras de memória (segundos)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Timeout de cada requisição (segundos)")
+    parser.add_argument("--semente", type=int, default=42, help="Semente do sorteio dos arquivos")
+    parser.add_argument("--env", action="append", default=[], help="Variável extra para a API, ex: --env NF_OCR_MODO=adaptativo")
+    parser.add_argument("--json", default=None, help="Salva o relatório completo neste arquivo")
+    parser.add_argument("--manter-saida", action="store_true", help="Não apaga a pasta temporária da API (log, Excel, uploads)")
+    args = parser.parse_args()
+
+    duracao = args.duracao if args.duracao or args.total else 60.0
+    tipos = [t.strip().lower() for t in args.tipos.split(",")] if args.tipos else None
+    arquivos = listar_arquivos(tipos)
+    env_extra = dict(item.split("=", 1) for item in args.env)
+    parametros = {"concorrencia": args.concorrencia, "duracao": duracao, "total": args.total, "endpoint": args.endpoint,
+                  "modo": args.modo, "arquivos": [os.path.basename(a) for a in arquivos], "latencia_llm": args.latencia_llm,
+                  "variacao_llm": args.variacao_llm, "processos_api": args.processos_api, "env": env_extra}
+
+    servidor_mock, estatisticas_llm, processo_api, amostrador = None, None, None, None
+    pasta_trabalho = tempfile.mkdtemp(prefix="carga_nf_")
+    try:
+        if args.url:
+            url = args.url.rstrip("/")
+        else:
+            servidor_mock, base_url_llm, estatisticas_llm = iniciar_servidor_mock(
+                rpm=args.rpm_llm, latencia_segundos=args.latencia_llm, variacao_segundos=args.variacao_llm, roteiro=True)
+            print(f"Mock do LLM em {base_url_llm}. Subindo a API em {pasta_trabalho}...")
+            processo_api, url = subir_api(base_url_llm, pasta_trabalho, args.processos_api, env_extra)
+            amostrador = AmostradorRSS(processo_api.pid, args.intervalo_rss)
+            amostrador.start()
+        print(f"API em {url}. Enviando {len(arquivos)} arquivo(s) com concorrência {args.concorrencia}...")
+        resultados, duracao_real = asyncio.run(gerar_carga(url, arquivos, args.concorrencia, duracao, args.total,
+                                                           args.endpoint, args.modo, args.semente, args.timeout))
+        if amostrador: amostrador.parar()
+        relatorio = montar_relatorio(resultados, duracao_real, amostrador.amostras if amostrador else [],
+                                     estatisticas_llm, parametros)
+        imprimir_relatorio(relatorio)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(relatorio, f, ensure_ascii=False, indent=2)
+            print(f"Relatório salvo em {args.json}")
+    finally:
+        if amostrador and amostrador.is_alive(): amostrador.parar()
+        if processo_api is not None:
+            processo_api.terminate()
+            try:
+                processo_api.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                processo_api.kill()
+        if servidor_mock is not None:
+            servidor_mock.shutdown()
+        if args.manter_saida:
+            print(f"Saída da API mantida em {pasta_trabalho}")
+        else:
+            shutil.rmtree(pasta_trabalho, ignore_errors=True)
@@ -0,0 +1,188 @@
+"""
+Servidor LOCAL que imita a API de chat da OpenAI (/v1/chat/completions).
+Serve para testar o cliente LLM (limites, 429, novas tentativas) sem gastar tokens.
+
+Com '--roteiro', responde como o agente real: pede a ferramenta de extração
+certa para o arquivo, depois 'salvar_dados_nota' com uma nota fixa (válida) e
+por fim uma mensagem de texto. Assim a API roda o grafo inteiro (OCR/XML/HTML
+de verdade) sem a OpenAI, para testes de carga (bench/carga.py).
+
+Uso direto:  python -m bench.mock_openai --porta 8899 --rpm 300
+             python -m bench.mock_openai --porta 8899 --roteiro --latencia 0.8 --variacao 0.3
+"""
+import os
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from workflows.cliente_llm import BaldeDeTokens
+
+
+class EstatisticasMock:
+    def __init__(self):
+        self.trava = threading.Lock()
+        self.aceitas = 0
+        self.rejeitadas_429 = 0
+
+    def registrar(self, aceita: bool) -> None:
+        with self.trava:
+            if aceita: self.aceitas += 1
+            else: self.rejeitadas_429 += 1
+
+
+def _resposta_chat(modelo: str, conteudo: Optional[str], chamada: Optional[Tuple[str, Dict[str, Any]]] = None) -> dict:
+    mensagem = {"role": "assistant", "content": conteudo}
+    if chamada is not None: # (nome da ferramenta, argumentos)
+        mensagem["tool_calls"] = [{
+            "id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+            "function": {"name": chamada[0], "arguments": json.dumps(chamada[1], ensure_ascii=False)},
+        }]
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": modelo,
+        "choices": [{
+            "index": 0,
+            "message": mensagem,
+            "finish_reason": "tool_calls" if chamada is not None else "stop",
+        }],
+        "usage": {"prompt_tokens": 50, "completion_tokens": 10, "total_tokens": 60},
+    }
+
+
+# --- Roteiro do agente (respostas com chamadas de ferramenta) ---
+FERRAMENTA_POR_EXTENSAO = {
+    ".xml": "extrair_dados_xml", ".pdf": "extrair_texto_pdf", ".html": "extrair_texto_html", ".htm": "extrair_texto_html",
+    ".png": "extrair_texto_imagem", ".jpg": "extrair_texto_imagem", ".jpeg": "extrair_texto_imagem",
+}
+# Documentos com dígitos verificadores válidos e ISS de 5%: passa no validador sem re-extração
+NOTA_ROTEIRO = {
+    "chave_acesso": "AB1C-2D3E", "data_emissao": "20/09/2025 19:51:09",
+    "cnpj_emitente": "11.222.333/0001-81", "nome_emitente": "EMPRESA MOCK LTDA",
+    "municipio_emitente": "São Paulo UF: SP", "cnpj_cpf_destinatario": "529.982.247-25",
+    "nome_destinatario": "CLIENTE MOCK", "valor_total": 238.36, "base_calculo": 238.36, "valor_iss": 11.92,
+    "discriminacao_servicos": "Serviço simulado pelo mock",
+}
+
+def _primeiro_parametro(ferramentas: List[dict], nome: str) -> str:
+    for ferramenta in ferramentas:
+        funcao = ferramenta.get("function", {})
+        if funcao.get("name") == nome:
+            return next(iter(funcao.get("parameters", {}).get("properties", {})), "caminho")
+    return "caminho"
+
+def _resposta_roteiro(pedido: dict, numeros: "itertools.count") -> Tuple[Optional[str], Optional[Tuple[str, Dict[str, Any]]]]:
+    """Decide a próxima resposta do 'agente' a partir do histórico do pedido."""
+    mensagens = pedido.get("messages") or []
+    ferramentas = pedido.get("tools") or []
+    escolha = pedido.get("tool_choice")
+    if isinstance(escolha, dict): # Ferramenta forçada (ex: re-extração): nada a corrigir
+        return None, (escolha["function"]["name"], {})
+    ultima = mensagens[-1] if mensagens else {}
+    if ultima.get("role") == "user":
+        texto = ultima.get("content") if isinstance(ultima.get("content"), str) else json.dumps(ultima.get("content"))
+        caminho = re.search(r"Processar: (.+)$", texto.strip())
+        caminho = caminho.group(1).strip() if caminho else ""
+        nome = FERRAMENTA_POR_EXTENSAO.get(os.path.splitext(caminho)[1].lower())
+        if nome is None:
+            return "Formato de arquivo não suportado.", None
+        return None, (nome, {_primeiro_parametro(ferramentas, nome): caminho})
+    if ultima.get("role") == "tool":
+        anteriores = [m for m in mensagens if m.get("role") == "assistant" and m.get("tool_calls")]
+        nome_anterior = anteriores[-1]["tool_calls"][0]["function"]["name"] if anteriores else ""
+        if nome_anterior != "salvar_dados_nota":
+            return None, ("salvar_dados_nota", {"dados_nota": {**NOTA_ROTEIRO, "numero_nf": str(next(numeros))}})
+    return "Dados da nota fiscal extraídos e salvos.", None
+
+
+def _criar_handler(servidor_config: dict):
+    class HandlerMock(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Mantém conexões keep-alive, como a OpenAI
+
+        def log_message(self, *args):  # Silencia o log de cada requisição
+            pass
+
+        def _enviar_json(self, status: int, corpo: dict, cabecalhos: Optional[dict] = None) -> None:
+            dados = json.dumps(corpo).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(dados)))
+            for chave, valor in (cabecalhos or {}).items():
+                self.send_header(chave, valor)
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def do_POST(self):
+            tamanho = int(self.headers.get("Content-Length", 0))
+            pedido = json.loads(self.rfile.read(tamanho) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._enviar_json(404, {"error": {"message": "Rota não encontrada", "type": "invalid_request_error"}})
+                return
+
+            balde = servidor_config["balde"]
+            if balde is not None and not balde.tentar_adquirir(1):
+                servidor_config["estatisticas"].registrar(False)
+                self._enviar_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}},
+                                  {"retry-after-ms": str(int(1000 / balde.taxa_por_segundo))})
+                return
+
+            latencia = servidor_config["latencia_segundos"] + random.uniform(0, servidor_config["variacao_segundos"])
+            if latencia:
+                time.sleep(latencia)
+            servidor_config["estatisticas"].registrar(True)
+            if servidor_config["roteiro"]:
+                conteudo, chamada = _resposta_roteiro(pedido, servidor_config["numeros"])
+                self._enviar_json(200, _resposta_chat(pedido.get("model", "mock"), conteudo, chamada))
+            else:
+                self._enviar_json(200, _resposta_chat(pedido.get("model", "mock"), "ok"))
+
+    return HandlerMock
+
+
+def iniciar_servidor_mock(porta: int = 0, rpm: Optional[float] = None, latencia_segundos: float = 0.0,
+                          variacao_segundos: float = 0.0, roteiro: bool = False) -> Tuple[ThreadingHTTPServer, str, EstatisticasMock]:
+    """
+    Sobe o mock em uma thread (porta 0 = porta livre qualquer).
+    Latência de cada chamada: 'latencia_segundos' + sorteio entre 0 e 'variacao_segundos'.
+    'roteiro=True' responde com as chamadas de ferramenta do agente (ver _resposta_roteiro).
+    Retorna (servidor, base_url para o ChatOpenAI, estatísticas).
+    """
+    estatisticas = EstatisticasMock()
+    config = {
+        # rajada de 1s: o mock limita como a OpenAI, em janelas curtas
+        "balde": BaldeDeTokens(rpm, rajada_segundos=1.0) if rpm else None,
+        "latencia_segundos": latencia_segundos,
+        "variacao_segundos": variacao_segundos,
+        "roteiro": roteiro,
+        "numeros": itertools.count(1), # numero_nf das notas do roteiro
+        "estatisticas": estatisticas,
+    }
+    servidor = ThreadingHTTPServer(("127.0.0.1", porta), _criar_handler(config))
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{servidor.server_address[1]}/v1"
+    return servidor, base_url, estatisticas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock local da API de chat da OpenAI")
+    parser.add_argument("--porta", type=int, default=8899)
+    parser.add_argument("--rpm", type=float, default=None, help="Limite de requisições/min (acima disso responde 429)")
+    parser.add_argument("--latencia", type=float, default=0.0, help="Latência simulada por chamada (segundos)")
+    parser.add_argument("--variacao", type=float, default=0.0, help="Latência extra sorteada entre 0 e este valor (segundos)")
+    parser.add_argument("--roteiro", action="store_true", help="Responde com as chamadas de ferramenta do agente")
+    args = parser.parse_args()
+    servidor, base_url, _ = iniciar_servidor_mock(args.porta, args.rpm, args.latencia, args.variacao, args.roteiro)
+    print(f"Mock OpenAI rodando em {base_url} (Ctrl+C para parar)")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.shutdown()
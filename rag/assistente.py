@@ -0,0 +1,47 @@
+from typing import Any
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_community.vectorstores import FAISS
+
+from rag.cache_respostas import CacheRespostasRAG
+
+
+class AssistenteRAG:
+    """
+    Pipeline do Guia Interativo com atalhos pelo cache:
+    pergunta repetida -> resposta do cache (sem embedding, sem LLM);
+    pergunta parecida -> resposta do cache (só o embedding da pergunta);
+    pergunta nova -> busca no índice (reaproveitando o mesmo embedding) + LLM.
+    Mantém o método invoke(pergunta) da chain anterior.
+    """
+
+    def __init__(self, vectorstore: FAISS, embeddings: Embeddings, prompt: ChatPromptTemplate, llm: Any,
+                 cache: CacheRespostasRAG, k: int = 4):
+        self.vectorstore = vectorstore
+        self.embeddings = embeddings
+        self.cache = cache
+        self.k = k
+        self.chain = prompt | llm | StrOutputParser()
+
+    def invoke(self, pergunta: str) -> str:
+        resposta = self.cache.buscar_exata(pergunta)
+        if resposta is not None:
+            print("Cache RAG: pergunta repetida, resposta reutilizada.")
+            return resposta
+
+        vetor = self.embeddings.embed_query(pergunta)
+        similar = self.cache.buscar_similar(vetor, pergunta)
+        if similar is not None:
+            resposta, similaridade = similar
+            print(f"Cache RAG: pergunta parecida (similaridade {similaridade:.3f}), resposta reutilizada.")
+            self.cache.salvar(pergunta, vetor, resposta) # Próxima vez acerta direto pela forma exata
+            return resposta
+
+        documentos = self.vectorstore.similarity_search_by_vector(vetor, k=self.k)
+        contexto = "\n\n".join(doc.page_content for doc in documentos)
+        resposta = self.chain.invoke({"context": contexto, "question": pergunta})
+        if resposta:
+            self.cache.salvar(pergunta, vetor, resposta)
+        return resposta
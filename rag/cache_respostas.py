@@ -0,0 +1,125 @@
+"""
+Cache de respostas do Guia Interativo (RAG).
+
+Duas formas de acerto, ambas sem chamar o LLM:
+1. Pergunta igual após normalização (caixa, acentos, pontuação, espaços);
+2. Pergunta "vizinha": embedding com similaridade de cosseno acima do limiar e
+   os mesmos números (os embeddings quase não separam "nota 123" de "nota 456").
+
+As entradas pertencem a uma versão do índice (hash dos docs): quando os
+documentos mudam, as respostas antigas são descartadas.
+"""
+import os
+import re
+import time
+import sqlite3
+import threading
+import unicodedata
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# --- Configuração (via .env) ---
+CACHE_RAG_CAMINHO = os.getenv("NF_RAG_CACHE_CAMINHO", os.path.join("cache", "rag_respostas.sqlite"))
+CACHE_RAG_MAX_ENTRADAS = int(os.getenv("NF_RAG_CACHE_MAX_ENTRADAS", "1000"))
+# As similaridades do ada-002 ficam altas mesmo entre perguntas diferentes: limiar bem perto de 1
+CACHE_RAG_LIMIAR_SIMILARIDADE = float(os.getenv("NF_RAG_CACHE_LIMIAR", "0.98"))
+
+
+def normalizar_pergunta(pergunta: str) -> str:
+    """'Qual o formato da resposta?' e 'qual o FORMATO da resposta' viram a mesma chave."""
+    texto = unicodedata.normalize("NFKD", pergunta.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return re.sub(r"\s+", " ", texto).strip()
+
+
+def numeros_da_pergunta(pergunta_normalizada: str) -> List[str]:
+    """Números da pergunta, em ordem ('CNPJ 11.222.333/0001-81' -> ['11', '222', '333', '0001', '81'])."""
+    return re.findall(r"\d+", pergunta_normalizada)
+
+
+class CacheRespostasRAG:
+    def __init__(self, hash_indice: str, caminho: str = CACHE_RAG_CAMINHO,
+                 max_entradas: int = CACHE_RAG_MAX_ENTRADAS, limiar: float = CACHE_RAG_LIMIAR_SIMILARIDADE):
+        self.hash_indice = hash_indice
+        self.max_entradas = max_entradas
+        self.limiar = limiar
+        self._trava = threading.Lock()
+        pasta = os.path.dirname(caminho)
+        if pasta: os.makedirs(pasta, exist_ok=True)
+        # O Streamlit executa cada rerun em uma thread diferente
+        self._conexao = sqlite3.connect(caminho, timeout=30, check_same_thread=False)
+        self._conexao.execute(
+            "CREATE TABLE IF NOT EXISTS respostas ("
+            " pergunta_normalizada TEXT PRIMARY KEY, resposta TEXT NOT NULL, vetor BLOB,"
+            " hash_indice TEXT NOT NULL, ultimo_acesso REAL NOT NULL)"
+        )
+        self._conexao.execute("CREATE INDEX IF NOT EXISTS idx_rag_acesso ON respostas (ultimo_acesso)")
+        # Invalidação: respostas geradas com outra versão dos documentos
+        removidas = self._conexao.execute("DELETE FROM respostas WHERE hash_indice != ?", (hash_indice,)).rowcount
+        self._conexao.commit()
+        if removidas:
+            print(f"Cache RAG: {removidas} respostas descartadas (documentos mudaram).")
+        self._matriz: Optional[np.ndarray] = None # Vetores normalizados, carregados sob demanda
+        self._chaves: List[str] = []
+
+    def _carregar_vetores(self) -> None:
+        linhas = self._conexao.execute("SELECT pergunta_normalizada, vetor FROM respostas WHERE vetor IS NOT NULL").fetchall()
+        self._chaves = [linha[0] for linha in linhas]
+        if linhas:
+            self._matriz = np.vstack([np.frombuffer(linha[1], dtype=np.float32) for linha in linhas])
+        else:
+            self._matriz = np.empty((0, 0), dtype=np.float32)
+
+    def _tocar(self, chave: str) -> str:
+        self._conexao.execute("UPDATE respostas SET ultimo_acesso = ? WHERE pergunta_normalizada = ?", (time.time(), chave))
+        self._conexao.commit()
+        return self._conexao.execute("SELECT resposta FROM respostas WHERE pergunta_normalizada = ?", (chave,)).fetchone()[0]
+
+    def buscar_exata(self, pergunta: str) -> Optional[str]:
+        chave = normalizar_pergunta(pergunta)
+        with self._trava:
+            existe = self._conexao.execute("SELECT 1 FROM respostas WHERE pergunta_normalizada = ?", (chave,)).fetchone()
+            return self._tocar(chave) if existe else None
+
+    def buscar_similar(self, vetor: List[float], pergunta: Optional[str] = None) -> Optional[Tuple[str, float]]:
+        """
+        Retorna (resposta, similaridade) da pergunta mais próxima, se passar do limiar.
+        Com 'pergunta', só valem as vizinhas com os mesmos números (outra nota, outro CNPJ = outra resposta).
+        """
+        consulta = np.asarray(vetor, dtype=np.float32)
+        consulta = consulta / (np.linalg.norm(consulta) or 1.0)
+        numeros = numeros_da_pergunta(normalizar_pergunta(pergunta)) if pergunta is not None else None
+        with self._trava:
+            if self._matriz is None:
+                self._carregar_vetores()
+            if not self._chaves or self._matriz.shape[1] != consulta.shape[0]:
+                return None
+            similaridades = self._matriz @ consulta
+            for indice in np.argsort(-similaridades):
+                if similaridades[indice] < self.limiar:
+                    return None
+                chave = self._chaves[int(indice)]
+                if numeros is None or numeros_da_pergunta(chave) == numeros:
+                    return self._tocar(chave), float(similaridades[indice])
+            return None
+
+    def salvar(self, pergunta: str, vetor: Optional[List[float]], resposta: str) -> None:
+        blob = None
+        if vetor is not None:
+            normalizado = np.asarray(vetor, dtype=np.float32)
+            blob = (normalizado / (np.linalg.norm(normalizado) or 1.0)).tobytes()
+        with self._trava:
+            self._conexao.execute(
+                "INSERT OR REPLACE INTO respostas VALUES (?, ?, ?, ?, ?)",
+                (normalizar_pergunta(pergunta), resposta, blob, self.hash_indice, time.time())
+            )
+            excedente = self._conexao.execute("SELECT COUNT(*) FROM respostas").fetchone()[0] - self.max_entradas
+            if excedente > 0:
+                self._conexao.execute(
+                    "DELETE FROM respostas WHERE pergunta_normalizada IN"
+                    " (SELECT pergunta_normalizada FROM respostas ORDER BY ultimo_acesso LIMIT ?)", (excedente,)
+                )
+            self._conexao.commit()
+            self._matriz = None # Recarrega os vetores na próxima busca
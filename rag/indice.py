@@ -0,0 +1,131 @@
+"""
+Índice FAISS PERSISTIDO para o Guia Interativo (RAG).
+
+O índice é construído uma vez (offline ou no primeiro uso), salvo em disco com
+o hash dos documentos e, nas próximas inicializações, apenas carregado
+(memory-mapped). Só é reconstruído quando os documentos mudam.
+
+Construir/atualizar manualmente:  python -m rag.indice [--forcar]
+"""
+import os
+import json
+import time
+import pickle
+import hashlib
+import argparse
+from typing import List, Optional
+
+import faiss
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.vectorstores import FAISS
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# --- Configuração ---
+DOCS_RAG = ["docs/api_guide.md", "docs/system_guide.md"]
+INDICE_DIR = os.getenv("NF_RAG_INDICE_DIR", "indice_rag")
+CHUNK_SIZE = 700
+CHUNK_OVERLAP = 50
+
+ARQUIVO_MANIFESTO = "manifesto.json"
+# 'IFC' mapeia também os vetores do IndexFlat (faiss >= 1.8); senão usa o mmap simples
+_FLAGS_MMAP = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def _nome_modelo_embeddings(embeddings: Embeddings) -> str:
+    return str(getattr(embeddings, "model", None) or type(embeddings).__name__)
+
+
+def calcular_hash_docs(embeddings: Embeddings, caminhos: List[str] = DOCS_RAG) -> str:
+    """Hash do conteúdo dos documentos + parâmetros que mudam o índice (chunking, modelo de embeddings)."""
+    sha = hashlib.sha256()
+    sha.update(f"{CHUNK_SIZE}:{CHUNK_OVERLAP}:{_nome_modelo_embeddings(embeddings)}".encode("utf-8"))
+    for caminho in caminhos:
+        sha.update(caminho.encode("utf-8"))
+        if os.path.exists(caminho):
+            with open(caminho, "rb") as f: sha.update(f.read())
+    return sha.hexdigest()
+
+
+def _carregar_documentos(caminhos: List[str]) -> List[Document]:
+    """Lê os .md como texto puro (o Markdown é legível para o LLM; dispensa o 'unstructured')."""
+    documentos = []
+    for caminho in caminhos:
+        if not os.path.exists(caminho):
+            print(f"RAG: documento não encontrado, ignorando: {caminho}")
+            continue
+        with open(caminho, "r", encoding="utf-8") as f:
+            documentos.append(Document(page_content=f.read(), metadata={"source": caminho}))
+    return documentos
+
+
+def construir_indice(embeddings: Embeddings, caminhos: List[str] = DOCS_RAG, pasta: str = INDICE_DIR) -> FAISS:
+    """Divide os documentos, gera os embeddings (chamada paga) e salva o índice + manifesto."""
+    print(f"RAG: construindo índice a partir de {caminhos}...")
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    splits = text_splitter.split_documents(_carregar_documentos(caminhos))
+    vectorstore = FAISS.from_documents(documents=splits, embedding=embeddings)
+
+    os.makedirs(pasta, exist_ok=True)
+    vectorstore.save_local(pasta)
+    manifesto = {
+        "hash": calcular_hash_docs(embeddings, caminhos),
+        "documentos": caminhos,
+        "modelo_embeddings": _nome_modelo_embeddings(embeddings),
+        "total_trechos": len(splits),
+        "criado_em": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(os.path.join(pasta, ARQUIVO_MANIFESTO), "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    print(f"RAG: índice salvo em '{pasta}' ({len(splits)} trechos).")
+    return vectorstore
+
+
+def ler_manifesto(pasta: str = INDICE_DIR) -> Optional[dict]:
+    caminho = os.path.join(pasta, ARQUIVO_MANIFESTO)
+    if not os.path.exists(caminho):
+        return None
+    with open(caminho, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def carregar_indice(embeddings: Embeddings, caminhos: List[str] = DOCS_RAG, pasta: str = INDICE_DIR) -> Optional[FAISS]:
+    """Carrega o índice salvo se ele corresponder aos documentos atuais; senão retorna None."""
+    manifesto = ler_manifesto(pasta)
+    if manifesto is None or manifesto.get("hash") != calcular_hash_docs(embeddings, caminhos):
+        return None
+    caminho_faiss = os.path.join(pasta, "index.faiss")
+    try:
+        index = faiss.read_index(caminho_faiss, _FLAGS_MMAP)
+    except RuntimeError as e: # Tipo de índice sem suporte a mmap
+        print(f"RAG: mmap indisponível ({e}), lendo o índice para a memória.")
+        index = faiss.read_index(caminho_faiss)
+    # Arquivo gerado por nós mesmos em construir_indice (formato do FAISS.save_local)
+    with open(os.path.join(pasta, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    print(f"RAG: índice carregado de '{pasta}' (criado em {manifesto.get('criado_em')}).")
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def obter_indice(embeddings: Embeddings, caminhos: List[str] = DOCS_RAG, pasta: str = INDICE_DIR) -> FAISS:
+    """Carrega o índice do disco ou, se os documentos mudaram, reconstrói e salva."""
+    vectorstore = carregar_indice(embeddings, caminhos, pasta)
+    if vectorstore is None:
+        vectorstore = construir_indice(embeddings, caminhos, pasta)
+    return vectorstore
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from langchain_openai import OpenAIEmbeddings
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Constrói o índice FAISS do Guia Interativo")
+    parser.add_argument("--forcar", action="store_true", help="Reconstrói mesmo se os documentos não mudaram")
+    args = parser.parse_args()
+
+    embeddings = OpenAIEmbeddings()
+    if not args.forcar and carregar_indice(embeddings) is not None:
+        print("RAG: índice já está atualizado. Use --forcar para reconstruir.")
+    else:
+        construir_indice(embeddings)
@@ -0,0 +1,47 @@
+# Testa o modo compilado com salvamentos simultâneos: nenhuma linha do COMPILADO_MESTRE.xlsx se perde
+import os
+import sys
+import tempfile
+import threading
+import multiprocessing
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from tools.extracao import DadosNotaFiscal, acumular_dados_em_excel
+
+os.chdir(tempfile.mkdtemp()) # O modo compilado grava em ./dados_saida
+CAMINHO_MESTRE = os.path.join("dados_saida", "COMPILADO_MESTRE.xlsx")
+TOTAL_NOTAS = 16
+
+def salvar(i: int) -> None:
+    caminho, dados = acumular_dados_em_excel(DadosNotaFiscal(numero_nf=str(i), valor_total=float(i)))
+    assert caminho == CAMINHO_MESTRE, caminho
+
+print(f"--- Testando {TOTAL_NOTAS} salvamentos simultâneos (threads) ---")
+threads = [threading.Thread(target=salvar, args=(i,)) for i in range(1, TOTAL_NOTAS + 1)]
+for thread in threads: thread.start()
+for thread in threads: thread.join()
+df = pd.read_excel(CAMINHO_MESTRE, dtype={"numero_nf": str})
+assert len(df) == TOTAL_NOTAS, len(df)
+assert sorted(df["numero_nf"], key=int) == [str(i) for i in range(1, TOTAL_NOTAS + 1)]
+assert list(df.columns) == list(DadosNotaFiscal.__fields__) # Ordem das colunas preservada
+assert not [nome for nome in os.listdir("dados_saida") if nome.startswith(".")] # Nenhum temporário sobrando
+print("OK.")
+
+print("--- Testando salvamentos simultâneos em processos (como os workers da fila) ---")
+def processo_salvador(inicio: int) -> None:
+    for i in range(inicio, inicio + 4):
+        salvar(i)
+
+# 'fork': os filhos herdam a pasta temporária. Entre processos o threading.Lock não vale, só a trava do arquivo
+processos = [multiprocessing.get_context("fork").Process(target=processo_salvador, args=(TOTAL_NOTAS + 1 + 4 * p,)) for p in range(4)]
+for processo in processos: processo.start()
+for processo in processos: processo.join()
+assert all(processo.exitcode == 0 for processo in processos)
+df = pd.read_excel(CAMINHO_MESTRE, dtype={"numero_nf": str})
+assert len(df) == TOTAL_NOTAS + 16, len(df)
+assert len(set(df["numero_nf"])) == TOTAL_NOTAS + 16
+print("OK.")
+
+print("\n--- SUCESSO! ---")
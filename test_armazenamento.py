@@ -0,0 +1,74 @@
+# Testa o armazenamento indexado: filtros, paginação por cursor, agregados e nota reprocessada
+import os
+import tempfile
+from datetime import date
+
+import pandas as pd
+
+from tools.armazenamento import ArmazenamentoNotas, importar_excel
+
+caminho = os.path.join(tempfile.mkdtemp(), "notas_teste.sqlite")
+armazenamento = ArmazenamentoNotas(caminho)
+
+EMITENTE_A, EMITENTE_B = "11.222.333/0001-81", "79.379.491/0138-38"
+notas = []
+for i in range(1, 31):
+    notas.append({
+        "chave_acesso": f"CHAVE-{i:03d}", "numero_nf": str(i),
+        "data_emissao": f"{i:02d}/09/2025 10:00:00" if i <= 20 else f"{i - 20:02d}/10/2025 10:00:00",
+        "cnpj_emitente": EMITENTE_A if i % 2 else EMITENTE_B,
+        "cnpj_cpf_destinatario": "529.982.247-25", "valor_total": 100.0, "valor_iss": 5.0,
+    })
+armazenamento.salvar_varias(notas, modo="accumulated")
+
+print("--- Testando filtros ---")
+itens, _ = armazenamento.consultar(cnpj_emitente="11222333000181", data_inicio=date(2025, 9, 1), data_fim=date(2025, 9, 30))
+assert len(itens) == 10 and all(n["cnpj_emitente"] == EMITENTE_A for n in itens), len(itens)
+assert armazenamento.consultar(chave_acesso="CHAVE-007")[0][0]["numero_nf"] == "7"
+assert len(armazenamento.consultar(cnpj_cpf_destinatario="52998224725", limite=500)[0]) == 30
+print("OK.")
+
+print("--- Testando paginação por cursor ---")
+vistos, cursor = [], None
+while True:
+    itens, cursor = armazenamento.consultar(limite=7, cursor=cursor)
+    vistos += [n["numero_nf"] for n in itens]
+    if cursor is None: break
+assert vistos == [str(i) for i in range(30, 0, -1)], vistos
+print("OK.")
+
+print("--- Testando agregados ---")
+por_mes = {g["periodo"]: g for g in armazenamento.agregar("mes")}
+assert por_mes["2025-09"]["quantidade"] == 20 and por_mes["2025-09"]["soma_valor_total"] == 2000.0
+assert por_mes["2025-10"]["soma_valor_iss"] == 50.0
+por_emitente = armazenamento.agregar("mes", por_emitente=True, data_inicio=date(2025, 9, 1), data_fim=date(2025, 9, 30))
+assert {(g["cnpj_emitente"], g["quantidade"]) for g in por_emitente} == {("11222333000181", 10), ("79379491013838", 10)}
+parcial = armazenamento.agregar("mes", cnpj_emitente=EMITENTE_A, data_inicio=date(2025, 9, 5), data_fim=date(2025, 9, 9))
+assert parcial[0]["quantidade"] == 3, parcial # Dias 5, 7 e 9 (intervalo fora do mês inteiro usa o resumo diário)
+print("OK.")
+
+print("--- Testando nota reprocessada (sem duplicar nos totais) ---")
+armazenamento.salvar({**notas[0], "valor_total": 300.0}, modo="single")
+assert len(armazenamento.consultar(chave_acesso="CHAVE-001")[0]) == 1
+por_mes = {g["periodo"]: g for g in armazenamento.agregar("mes")}
+assert por_mes["2025-09"]["quantidade"] == 20 and por_mes["2025-09"]["soma_valor_total"] == 2200.0
+print("OK.")
+
+armazenamento.fechar()
+
+print("--- Testando importação dos Excel (valores com vírgula, célula ruim, nota repetida sem chave) ---")
+pasta_excel = tempfile.mkdtemp()
+nota_1 = {"numero_nf": "1", "data_emissao": "20/09/2025 19:51:09", "cnpj_emitente": EMITENTE_A, "valor_total": "138,95"}
+nota_2 = {"numero_nf": "2", "data_emissao": "21/09/2025 10:00:00", "cnpj_emitente": EMITENTE_A, "valor_total": "1.234,56", "valor_iss": "n/d"}
+pd.DataFrame([nota_1, nota_2]).to_excel(os.path.join(pasta_excel, "COMPILADO_MESTRE.xlsx"), index=False)
+pd.DataFrame([{**nota_1, "valor_total": 138.95}]).to_excel(os.path.join(pasta_excel, "NotaFiscal_1.xlsx"), index=False)
+importado = ArmazenamentoNotas(os.path.join(pasta_excel, "notas.sqlite"))
+importar_excel(pasta_excel, importado)
+itens, _ = importado.consultar(limite=500)
+assert sorted(n["numero_nf"] for n in itens) == ["1", "2"], itens # A nota 1 está nos dois arquivos
+assert {n["numero_nf"]: n["valor_total"] for n in itens} == {"1": 138.95, "2": 1234.56}
+assert importado.agregar("mes")[0]["quantidade"] == 2
+importado.fechar()
+print("OK.")
+
+print("\n--- SUCESSO! ---")
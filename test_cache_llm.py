@@ -0,0 +1,91 @@
+# Testa o cache de respostas do LLM usando um modelo FALSO (sem chamar a OpenAI)
+import os
+import time
+import tempfile
+import threading
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from tools.prazos import PrazoEsgotado, prazo_etapa
+from workflows.cache_llm import CacheLLM
+
+pasta_temporaria = tempfile.mkdtemp()
+cache = CacheLLM(caminho=os.path.join(pasta_temporaria, "teste_cache.sqlite"), max_entradas=2)
+modelo_falso = FakeListChatModel(responses=["resposta fixa"])
+
+chamadas = {"total": 0}
+def chamar_lento(mensagens):
+    chamadas["total"] += 1
+    time.sleep(0.5) # Simula a latência do provedor
+    return modelo_falso.invoke(mensagens)
+
+print("Iniciando teste do cache do LLM...\n")
+
+try:
+    # 1. Mesma mensagem (com UUID e espaços diferentes) => uma única chamada
+    msg_a = [HumanMessage(content="Processar: api_uploads/5d1253b9-3e19-41df-9077-890922dbbefa_nota.pdf")]
+    msg_b = [HumanMessage(content="Processar:   api_uploads/0a1b2c3d-3e19-41df-9077-890922dbbefa_nota.pdf ")]
+    r1 = cache.invocar(modelo_falso, msg_a, chamar=chamar_lento)
+    r2 = cache.invocar(modelo_falso, msg_b, chamar=chamar_lento)
+    assert r1.content == r2.content == "resposta fixa"
+    assert chamadas["total"] == 1, f"Esperava 1 chamada, houve {chamadas['total']}"
+    print("OK: mensagens normalizadas iguais reutilizaram a resposta.")
+
+    # 2. Chamadas simultâneas idênticas => coalescidas em uma
+    msg_c = [HumanMessage(content="Texto OCR de outra nota")]
+    threads = [threading.Thread(target=cache.invocar, args=(modelo_falso, msg_c), kwargs={"chamar": chamar_lento}) for _ in range(5)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert chamadas["total"] == 2, f"Esperava 2 chamadas, houve {chamadas['total']}"
+    print("OK: 5 chamadas simultâneas viraram 1 chamada ao provedor.")
+
+    # 3. Remoção: max_entradas=2, a terceira entrada expulsa a menos usada
+    cache.invocar(modelo_falso, [HumanMessage(content="terceira nota")], chamar=chamar_lento)
+    total_entradas = cache._conectar().execute("SELECT COUNT(*) FROM respostas").fetchone()[0]
+    assert total_entradas == 2, f"Esperava 2 entradas, há {total_entradas}"
+    print("OK: cache respeita o limite de entradas.")
+
+    # 4. Resposta com tool calls: cada reaproveitamento recebe IDs novos
+    resposta_ferramenta = AIMessage(
+        content="",
+        tool_calls=[{"name": "extrair_texto_pdf", "args": {"caminho_do_arquivo_pdf": "nota.pdf"}, "id": "call_original"}],
+        additional_kwargs={"tool_calls": [{"id": "call_original", "type": "function",
+                                           "function": {"name": "extrair_texto_pdf", "arguments": "{}"}}]},
+    )
+    msg_d = [HumanMessage(content="Processar: nota.pdf")]
+    respostas = [cache.invocar(modelo_falso, msg_d, chamar=lambda msgs: resposta_ferramenta) for _ in range(3)]
+    ids = [r.tool_calls[0]["id"] for r in respostas]
+    assert ids[0] == "call_original", ids
+    assert len(set(ids)) == 3, f"IDs repetidos entre execuções: {ids}"
+    for r in respostas:
+        assert r.additional_kwargs["tool_calls"][0]["id"] == r.tool_calls[0]["id"]
+        assert r.tool_calls[0]["args"] == {"caminho_do_arquivo_pdf": "nota.pdf"}
+    print("OK: respostas do cache recebem IDs de tool call novos.")
+
+    # 5. Chamada líder travada: quem espera não passa do prazo nem da espera máxima
+    cache_espera = CacheLLM(caminho=os.path.join(pasta_temporaria, "teste_espera.sqlite"), espera_max_segundos=0.3)
+    liberar = threading.Event()
+    def chamar_travado(mensagens):
+        liberar.wait(10)
+        return modelo_falso.invoke(mensagens)
+    msg_e = [HumanMessage(content="nota com provedor travado")]
+    lider = threading.Thread(target=cache_espera.invocar, args=(modelo_falso, msg_e), kwargs={"chamar": chamar_travado})
+    lider.start()
+    time.sleep(0.1)
+    inicio = time.time()
+    try:
+        with prazo_etapa(0.2):
+            cache_espera.invocar(modelo_falso, msg_e, chamar=chamar_lento)
+        raise AssertionError("Deveria ter levantado PrazoEsgotado")
+    except PrazoEsgotado:
+        assert time.time() - inicio < 0.5, time.time() - inicio
+    total_antes = chamadas["total"]
+    inicio = time.time()
+    resposta = cache_espera.invocar(modelo_falso, msg_e, chamar=chamar_lento) # Sem prazo: espera 0.3s e chama sozinho
+    assert resposta.content == "resposta fixa" and chamadas["total"] == total_antes + 1
+    assert time.time() - inicio < 1.5, time.time() - inicio
+    liberar.set(); lider.join()
+    print("OK: espera por chamada idêntica limitada pelo prazo e pela espera máxima.")
+
+    print("\n--- SUCESSO! ---")
+except AssertionError as e:
+    print(f"\n--- ERRO! ---\n{e}")
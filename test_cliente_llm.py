@@ -0,0 +1,47 @@
+# Testa o cliente LLM (limites, 429, AIMD) contra o MOCK local da OpenAI
+import time
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import HumanMessage
+from bench.mock_openai import iniciar_servidor_mock
+from workflows.cliente_llm import ClienteLLM
+
+RPM_PROVEDOR = 600 # O mock aceita 10 requisições/s
+TOTAL_CHAMADAS = 60
+
+print(f"Iniciando teste do cliente LLM contra o mock ({RPM_PROVEDOR} RPM)...\n")
+
+def rodar_lote(rpm_cliente: float):
+    servidor, base_url, estatisticas = iniciar_servidor_mock(rpm=RPM_PROVEDOR, latencia_segundos=0.3)
+    cliente = ClienteLLM(rpm=rpm_cliente, tpm=10_000_000, concorrencia_inicial=4, concorrencia_max=16)
+    modelo = cliente.criar_modelo(model="gpt-4o-mini", temperature=0, base_url=base_url, api_key="sk-teste")
+    inicio = time.monotonic()
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        respostas = list(executor.map(lambda i: cliente.invocar(modelo, [HumanMessage(content=f"nota {i}")]), range(TOTAL_CHAMADAS)))
+    duracao = time.monotonic() - inicio
+    servidor.shutdown()
+    vazao = TOTAL_CHAMADAS / duracao * 60
+    print(f"  cliente a {rpm_cliente:.0f} RPM: {len(respostas)} respostas em {duracao:.1f}s "
+          f"({vazao:.0f}/min), 429 recebidos: {estatisticas.rejeitadas_429}")
+    return respostas, estatisticas, vazao
+
+try:
+    # 1. Cliente configurado com o limite do provedor: praticamente nenhum 429
+    # (pode sobrar 1 ou 2 pela diferença de relógio entre cliente e servidor)
+    respostas, estatisticas, vazao = rodar_lote(rpm_cliente=RPM_PROVEDOR)
+    assert all(r.content == "ok" for r in respostas)
+    assert estatisticas.rejeitadas_429 <= TOTAL_CHAMADAS * 0.05, "O token bucket deveria evitar os 429"
+    print("OK: token bucket manteve o lote dentro do limite.")
+
+    assert vazao >= RPM_PROVEDOR * 0.85, f"Vazão {vazao:.0f}/min abaixo do limite do provedor"
+
+    # 2. Cliente otimista (limite 5x maior): recebe 429, mas tenta de novo e termina tudo,
+    # e a taxa do balde se ajusta ao limite real (em vez de ficar muito abaixo dele)
+    respostas, estatisticas, vazao = rodar_lote(rpm_cliente=RPM_PROVEDOR * 5)
+    assert len(respostas) == TOTAL_CHAMADAS and all(r.content == "ok" for r in respostas)
+    assert vazao >= RPM_PROVEDOR * 0.85, f"Vazão {vazao:.0f}/min: a taxa não se ajustou ao limite do provedor"
+    print("OK: 429 absorvidos por novas tentativas + AIMD na taxa, vazão perto do limite do provedor.")
+
+    print("\n--- SUCESSO! ---")
+except Exception as e:
+    print(f"\n--- ERRO! ---\n{e}")
+    raise
@@ -0,0 +1,86 @@
+# Testa a deduplicação por hash perceptual: re-scans próximos, índice por bandas e confirmação por OCR
+import os
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+
+from tools.dedup_imagens import IndiceImagens, hashes_imagem, calcular_hashes, distancia, confirmar_por_ocr, numeros_confirmados, DEDUP_DISTANCIA_MAX
+
+pasta = tempfile.mkdtemp()
+
+def recibo(total: str) -> np.ndarray:
+    img = np.full((1400, 800), 255, np.uint8)
+    cv2.putText(img, "SUPERMERCADO EXEMPLO LTDA", (40, 80), cv2.FONT_HERSHEY_SIMPLEX, 1, 0, 2)
+    cv2.putText(img, "NF 4521", (40, 130), cv2.FONT_HERSHEY_SIMPLEX, 1, 0, 2)
+    for i in range(20):
+        cv2.putText(img, f"ITEM {i:02d} PRODUTO QUALQUER   {3.5 + i:.2f}", (40, 180 + i * 45), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 0, 2)
+    cv2.putText(img, f"TOTAL R$ {total}", (40, 1300), cv2.FONT_HERSHEY_SIMPLEX, 1.2, 0, 3)
+    return img
+
+def rescan(img: np.ndarray) -> np.ndarray:
+    """Outra digitalização: escala, desfoque, ruído, brilho e JPEG."""
+    copia = cv2.GaussianBlur(cv2.resize(img, (700, 1225)), (3, 3), 0)
+    ruido = np.random.default_rng(1).normal(0, 6, copia.shape)
+    copia = np.clip(copia.astype(float) * 0.9 + 15 + ruido, 0, 255).astype(np.uint8)
+    _, jpeg = cv2.imencode(".jpg", copia, [cv2.IMWRITE_JPEG_QUALITY, 60])
+    return cv2.imdecode(jpeg, cv2.IMREAD_GRAYSCALE)
+
+original = recibo("123,45")
+caminho_original = os.path.join(pasta, "recibo.png")
+cv2.imwrite(caminho_original, original)
+
+print("--- Testando hashes perceptuais ---")
+h_original = calcular_hashes(caminho_original)
+h_rescan = hashes_imagem(rescan(original))
+h_recorte = hashes_imagem(original[10:-5, 8:-3])
+assert h_original == hashes_imagem(original)
+for nome, h in (("re-scan", h_rescan), ("recorte", h_recorte)):
+    d = (distancia(h_original["phash"], h["phash"]), distancia(h_original["dhash"], h["dhash"]))
+    print(f"  {nome}: distância pHash/dHash = {d}")
+    assert max(d) <= DEDUP_DISTANCIA_MAX, d
+h_diferente = hashes_imagem(np.random.default_rng(2).integers(0, 255, (1400, 800), dtype=np.uint8))
+assert distancia(h_original["phash"], h_diferente["phash"]) > 16
+assert calcular_hashes(os.path.join(pasta, "nota.xml")) is None
+print("OK.")
+
+print("--- Testando o índice (bandas) ---")
+indice = IndiceImagens(os.path.join(pasta, "imagens.sqlite"))
+rng = np.random.default_rng(3)
+for i in range(500): # Ruído: imagens sem relação
+    indice.registrar(hashes_imagem(rng.integers(0, 255, (64, 64), dtype=np.uint8)), {"numero_nf": str(i)})
+id_recibo = indice.registrar(h_original, {"numero_nf": "4521", "valor_total": 123.45}, "dados_saida/NotaFiscal_4521.xlsx", "recibo.png")
+encontrada = indice.buscar(h_rescan)
+assert encontrada["id"] == id_recibo and encontrada["dados"]["numero_nf"] == "4521", encontrada
+assert encontrada["excel_file_path"] == "dados_saida/NotaFiscal_4521.xlsx"
+assert indice.buscar(h_diferente) is None
+print("OK.")
+
+print("--- Testando a confirmação por OCR (mesmo layout, outra nota) ---")
+# Mesmo modelo de recibo com outro total: o hash sozinho não separa, a confirmação sim
+caminho_outro = os.path.join(pasta, "outro_recibo.png")
+cv2.imwrite(caminho_outro, recibo("987,10"))
+assert indice.buscar(calcular_hashes(caminho_outro)) is not None
+if shutil.which("tesseract"):
+    dados_anteriores = {"numero_nf": "4521", "valor_total": 123.45}
+    assert confirmar_por_ocr(caminho_original, dados_anteriores)
+    assert not confirmar_por_ocr(caminho_outro, dados_anteriores)
+    print("OK.")
+else:
+    print("tesseract não encontrado: confirmação por OCR não testada.")
+assert not confirmar_por_ocr(caminho_original, {}) # Sem número/valor, nunca confirma
+
+print("--- Testando a comparação dos números do OCR ---")
+texto = "SUPERMERCADO EXEMPLO\nNF 004521 SERIE 1\nITEM 01 1,00 UN 3,50\nTOTAL R$ 1.234,56\nCNPJ 11.222.333/0001-81"
+assert numeros_confirmados(texto, {"numero_nf": "4521", "valor_total": 1234.56})
+assert numeros_confirmados(texto.replace("1.234,56", "1234.56"), {"numero_nf": "4521", "valor_total": 1234.56})
+assert not numeros_confirmados(texto, {"numero_nf": "4521", "valor_total": 987.10}) # Outro total
+assert not numeros_confirmados(texto, {"numero_nf": "452", "valor_total": 1234.56}) # Pedaço de outro número não vale
+assert not numeros_confirmados(texto, {"numero_nf": "1", "valor_total": 1.0}) # Poucos dígitos: aparece em qualquer nota
+assert not numeros_confirmados(texto, {"valor_total": 3.5})
+assert numeros_confirmados(texto, {"numero_nf": "4521", "valor_total": "1.234,56"}) # Valor como texto (lido do Excel)
+assert not numeros_confirmados(texto, {"numero_nf": "4521", "valor_total": "n/d"}) # Valor ilegível: não confirma
+print("OK.")
+
+print("\n--- SUCESSO! ---")
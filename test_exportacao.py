@@ -0,0 +1,55 @@
+# Testa a exportação em lotes (CSV, XLSX write-only e Parquet) e os nomes de arquivo do modo único
+import io
+import os
+import tempfile
+
+import pandas as pd
+
+from tools.armazenamento import ArmazenamentoNotas
+from tools.exportacao import exportar_para_arquivo, gerar_exportacao, formatos_disponiveis
+from tools.extracao import DadosNotaFiscal, _caminho_arquivo_nota
+
+pasta = tempfile.mkdtemp()
+armazenamento = ArmazenamentoNotas(os.path.join(pasta, "notas_teste.sqlite"))
+armazenamento.salvar_varias([
+    {"chave_acesso": f"CHAVE-{i:04d}", "numero_nf": str(i), "data_emissao": f"{i % 28 + 1:02d}/09/2025",
+     "nome_emitente": "Emitente Ção", "cnpj_emitente": "11.222.333/0001-81", "valor_total": float(i)}
+    for i in range(1, 1201) # Mais de um lote (500 por consulta)
+])
+
+print(f"--- Testando exportação ({', '.join(formatos_disponiveis())}) ---")
+csv_bytes = b"".join(gerar_exportacao("csv", armazenamento))
+df_csv = pd.read_csv(io.BytesIO(csv_bytes), encoding="utf-8-sig", dtype={"numero_nf": str})
+assert len(df_csv) == 1200 and df_csv["nome_emitente"].iloc[0] == "Emitente Ção"
+assert list(df_csv.columns) == list(DadosNotaFiscal.__fields__)
+
+caminho_xlsx = os.path.join(pasta, "notas.xlsx")
+assert exportar_para_arquivo("xlsx", caminho_xlsx, armazenamento) == 1200
+assert pd.read_excel(caminho_xlsx)["valor_total"].sum() == sum(range(1, 1201))
+
+xlsx_bytes = b"".join(gerar_exportacao("xlsx", armazenamento, data_inicio=None, cnpj_emitente="11222333000181"))
+assert len(pd.read_excel(io.BytesIO(xlsx_bytes))) == 1200
+
+if "parquet" in formatos_disponiveis():
+    parquet_bytes = b"".join(gerar_exportacao("parquet", armazenamento))
+    assert pd.read_parquet(io.BytesIO(parquet_bytes))["valor_total"].sum() == sum(range(1, 1201))
+
+try:
+    gerar_exportacao("json", armazenamento); raise AssertionError("Formato inválido deveria falhar")
+except ValueError:
+    pass
+print("OK.")
+
+print("--- Testando nomes de arquivo do modo único (sem sobrescrever) ---")
+sem_numero_1 = _caminho_arquivo_nota(pasta, {"numero_nf": None})
+sem_numero_2 = _caminho_arquivo_nota(pasta, {"numero_nf": None})
+assert sem_numero_1 != sem_numero_2
+caminho = _caminho_arquivo_nota(pasta, {"numero_nf": "123", "cnpj_emitente": "11.222.333/0001-81"})
+pd.DataFrame([{"numero_nf": "123", "cnpj_emitente": "11.222.333/0001-81"}]).to_excel(caminho, index=False)
+assert _caminho_arquivo_nota(pasta, {"numero_nf": "123", "cnpj_emitente": "11222333000181"}) == caminho # Mesma nota
+outro = _caminho_arquivo_nota(pasta, {"numero_nf": "123", "cnpj_emitente": "79.379.491/0138-38"})
+assert outro != caminho and outro.endswith("NotaFiscal_123_79379491013838.xlsx"), outro
+print("OK.")
+
+armazenamento.fechar()
+print("\n--- SUCESSO! ---")
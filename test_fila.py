@@ -0,0 +1,84 @@
+# Testa a fila durável dos workers: contrapressão, visibilidade, novas tentativas e reserva entre processos
+import os
+import time
+import tempfile
+import multiprocessing
+
+from workers.fila import FilaTarefas, FilaCheia, PENDENTE, PROCESSANDO, CONCLUIDA, FALHOU
+
+pasta = tempfile.mkdtemp()
+
+def nova_fila(nome: str, **kwargs) -> FilaTarefas:
+    return FilaTarefas(os.path.join(pasta, f"{nome}.sqlite"), **kwargs)
+
+print("--- Testando contrapressão ---")
+fila = nova_fila("capacidade", capacidade=3)
+ids = [fila.enfileirar(f"arquivo_{i}.pdf", "single", f"nota_{i}.pdf") for i in range(3)]
+try:
+    fila.enfileirar("arquivo_extra.pdf", "single")
+    raise AssertionError("A fila deveria recusar acima da capacidade")
+except FilaCheia:
+    pass
+tarefa = fila.reservar("w1")
+assert tarefa["id"] == ids[0] and tarefa["estado"] == PROCESSANDO and tarefa["tentativas"] == 1
+assert fila.concluir(tarefa["id"], "w1", {"status_code": 200, "dados": {"numero_nf": "1"}}) == CONCLUIDA
+fila.enfileirar("arquivo_extra.pdf", "single") # Concluída libera espaço
+assert fila.obter(ids[0])["resultado"]["dados"]["numero_nf"] == "1"
+assert fila.contar() == {PENDENTE: 3, CONCLUIDA: 1}, fila.contar()
+print("OK.")
+
+print("--- Testando visibilidade (worker que morreu) ---")
+fila = nova_fila("visibilidade", visibilidade_segundos=0.3, max_tentativas=2)
+tarefa_id = fila.enfileirar("a.pdf", "single")
+assert fila.reservar("w1")["id"] == tarefa_id
+assert fila.reservar("w2") is None # Invisível durante a reserva
+assert fila.renovar(tarefa_id, "w1")
+time.sleep(0.4)
+tarefa = fila.reservar("w2") # Reserva vencida: outro worker pega
+assert tarefa["id"] == tarefa_id and tarefa["worker"] == "w2" and tarefa["tentativas"] == 2
+assert not fila.renovar(tarefa_id, "w1") and fila.concluir(tarefa_id, "w1", {}) is None # w1 perdeu a tarefa
+time.sleep(0.4)
+assert fila.reservar("w3") is None # Última tentativa vencida: falhou
+assert fila.obter(tarefa_id)["estado"] == FALHOU
+print("OK.")
+
+print("--- Testando novas tentativas com backoff ---")
+fila = nova_fila("tentativas", max_tentativas=2, backoff_segundos=0.2)
+tarefa_id = fila.enfileirar("b.pdf", "accumulated")
+fila.reservar("w1")
+assert fila.falhar(tarefa_id, "w1", "429 do provedor") == PENDENTE
+assert fila.reservar("w1") is None # Ainda no backoff
+time.sleep(0.25)
+assert fila.reservar("w1")["tentativas"] == 2
+assert fila.falhar(tarefa_id, "w1", "429 do provedor") == FALHOU # Tentativas esgotadas
+tarefa_id = fila.enfileirar("c.pdf", "single")
+fila.reservar("w1")
+assert fila.falhar(tarefa_id, "w1", "sem dados", repetir=False, resultado={"status_code": 500}) == FALHOU
+assert fila.obter(tarefa_id)["resultado"] == {"status_code": 500}
+print("OK.")
+
+print("--- Testando reserva concorrente entre processos ---")
+TOTAL_TAREFAS, PROCESSOS = 200, 4
+caminho_concorrencia = os.path.join(pasta, "concorrencia.sqlite")
+
+def consumir(caminho: str, worker: str) -> None:
+    fila_worker = FilaTarefas(caminho)
+    while True:
+        tarefa = fila_worker.reservar(worker)
+        if tarefa is None:
+            return
+        fila_worker.concluir(tarefa["id"], worker, {"worker": worker})
+
+if __name__ == "__main__":
+    fila = FilaTarefas(caminho_concorrencia, capacidade=TOTAL_TAREFAS)
+    for i in range(TOTAL_TAREFAS):
+        fila.enfileirar(f"{i}.pdf", "single")
+    processos = [multiprocessing.Process(target=consumir, args=(caminho_concorrencia, f"w{i}")) for i in range(PROCESSOS)]
+    for processo in processos: processo.start()
+    for processo in processos: processo.join()
+    linhas = fila._conectar().execute("SELECT estado, tentativas, COUNT(*) FROM tarefas GROUP BY estado, tentativas").fetchall()
+    # Cada tarefa reservada exatamente uma vez
+    assert [tuple(linha) for linha in linhas] == [(CONCLUIDA, 1, TOTAL_TAREFAS)], [tuple(l) for l in linhas]
+    print("OK.")
+
+    print("\n--- SUCESSO! ---")
@@ -0,0 +1,83 @@
+# Testa as conversões do motor de layouts, uma NFS-e de São Paulo sintética e o retorno ao fluxo normal
+import os
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from tools.layouts import (converter_campo, extrair_por_layout, identificar_layout, extrair_com_layout,
+                           LAYOUT_NFSE_SAO_PAULO, _localizar_moldura, _recortar)
+
+print("--- Testando conversão dos campos lidos nas caixas ---")
+assert converter_campo("Número da Nota\n00012345\n", "numero") == "00012345"
+assert converter_campo("Data e Hora de Emissão 05/03/2024 14:22:10", "data") == "05/03/2024 14:22:10"
+assert converter_campo("Código de Verificação\nAB1C-2D3E", "codigo") == "AB1C-2D3E"
+assert converter_campo("CPF/CNPJ: 12.345.678/0001-90 Inscrição Municipal: 1.234.567-8", "documento") == "12.345.678/0001-90"
+assert converter_campo("Nome/Razão Social: EMPRESA EXEMPLO LTDA", "texto") == "EMPRESA EXEMPLO LTDA"
+assert converter_campo("E-mail: ---", "texto") is None
+assert converter_campo("VALOR TOTAL DO SERVIÇO = R$ 1.234,56", "valor") == 1234.56
+print("Conversões OK.")
+
+# --- NFS-e sintética: cada valor escrito dentro da caixa do campo no layout (A4 a 200 dpi) ---
+ESPERADO = {
+    "numero_nf": "00012345", "data_emissao": "05/03/2024 14:22:10", "chave_acesso": "AB1C-2D3E",
+    "cnpj_emitente": "11.222.333/0001-81", "nome_emitente": "EMPRESA EXEMPLO LTDA",
+    "municipio_emitente": "Sao Paulo", "nome_destinatario": "CLIENTE TESTE SA",
+    "cnpj_cpf_destinatario": "111.444.777-35", "valor_total": 1234.56, "base_calculo": 1234.56, "valor_iss": 61.73,
+}
+TEXTOS = {
+    "numero_nf": "00012345", "data_emissao": "05/03/2024 14:22:10", "chave_acesso": "AB1C-2D3E",
+    "cnpj_emitente": "CPF/CNPJ: 11.222.333/0001-81", "nome_emitente": "Nome: EMPRESA EXEMPLO LTDA",
+    "endereco_emitente": "Endereco: RUA EXEMPLO 100", "municipio_emitente": "Municipio: Sao Paulo",
+    "nome_destinatario": "Nome: CLIENTE TESTE SA", "cnpj_cpf_destinatario": "CPF/CNPJ: 111.444.777-35",
+    "endereco_destinatario": "Endereco: AV TESTE 200", "municipio_destinatario": "Municipio: Sao Paulo",
+    "discriminacao_servicos": "Servicos de consultoria", "valor_total": "VALOR TOTAL = R$ 1.234,56",
+    "base_calculo": "1.234,56", "valor_iss": "61,73",
+}
+MOLDURA = (90, 120, 1560, 2200) # Margens diferentes da folha: as caixas são relativas à moldura
+
+def nfse_sintetica() -> np.ndarray:
+    pagina = np.full((2339, 1654), 255, np.uint8)
+    x0, y0, x1, y1 = MOLDURA
+    cv2.rectangle(pagina, (x0, y0), (x1, y1), 0, 3)
+    def escrever(texto, caixa, linha=0, escala=0.8):
+        cx0, cy0, cx1, cy1 = (int(x0 + caixa[0] * (x1 - x0)), int(y0 + caixa[1] * (y1 - y0)),
+                              int(x0 + caixa[2] * (x1 - x0)), int(y0 + caixa[3] * (y1 - y0)))
+        base = cy0 + 40 + linha * 50 if linha else (cy0 + cy1) // 2 + 10
+        cv2.putText(pagina, texto, (cx0 + 8, base), cv2.FONT_HERSHEY_SIMPLEX, escala, 0, 2)
+    for linha, ancora in enumerate(LAYOUT_NFSE_SAO_PAULO.ancoras):
+        escrever(ancora, LAYOUT_NFSE_SAO_PAULO.regiao_ancoras, linha + 1, escala=1.1) # Legível na miniatura de 100 dpi
+    for nome_campo, texto in TEXTOS.items():
+        escrever(texto, LAYOUT_NFSE_SAO_PAULO.campos[nome_campo].caixa)
+    return pagina
+
+print("--- Testando a moldura e as caixas na NFS-e sintética ---")
+pagina = nfse_sintetica()
+moldura = _localizar_moldura(pagina)
+assert all(abs(a - b) <= 3 for a, b in zip(moldura, MOLDURA)), moldura
+for nome_campo, campo in LAYOUT_NFSE_SAO_PAULO.campos.items():
+    recorte = _recortar(pagina, moldura, campo.caixa)
+    assert recorte.size and (recorte < 128).any(), f"Caixa de '{nome_campo}' vazia"
+print("OK.")
+
+print("--- Testando identificação e extração (PDF da NFS-e sintética) ---")
+pasta = tempfile.mkdtemp()
+caminho_pdf = os.path.join(pasta, "nfse_sp_sintetica.pdf")
+Image.fromarray(pagina).save(caminho_pdf, resolution=200)
+assert extrair_por_layout(caminho_pdf) is None # Registro desligado por padrão (NF_LAYOUTS_ATIVOS)
+if shutil.which("tesseract") and shutil.which("pdftoppm"):
+    layout = identificar_layout(caminho_pdf)
+    assert layout is not None and layout.nome == "nfse_sao_paulo"
+    dados = extrair_com_layout(caminho_pdf, layout)
+    assert dados is not None
+    for nome_campo, valor in ESPERADO.items():
+        assert getattr(dados, nome_campo) == valor, (nome_campo, getattr(dados, nome_campo))
+    print("OK.")
+else:
+    print("tesseract/poppler não encontrados: identificação e extração não testadas.")
+
+print("--- Testando retorno ao fluxo normal (não-PDF) ---")
+assert extrair_por_layout("dados_teste/nota.png") is None
+print("OK.")
@@ -0,0 +1,60 @@
+# Testa o OCR adaptativo sem o tesseract: o 'image_to_data' é trocado por respostas
+# fixas (confiança baixa na primeira passada, alta na releitura) e contamos as passadas.
+import numpy as np
+import pytesseract
+import tools.extracao as extracao
+
+def resposta(linhas):
+    """Monta a saída do image_to_data (Output.DICT) com uma palavra por linha: [(texto, confiança, y)]."""
+    dados = {k: [] for k in ("text", "conf", "block_num", "par_num", "line_num", "left", "top", "width", "height")}
+    for numero, (texto, confianca, y) in enumerate(linhas, start=1):
+        for chave, valor in (("text", texto), ("conf", confianca), ("block_num", 1), ("par_num", 1),
+                             ("line_num", numero), ("left", 10), ("top", y), ("width", 200), ("height", 20)):
+            dados[chave].append(valor)
+    return dados
+
+chamadas = []
+
+def simular(respostas):
+    fila = list(respostas)
+    def image_to_data_falso(imagem, lang=None, timeout=0, config="", output_type=None):
+        chamadas.append({"forma": imagem.shape, "config": config})
+        return fila.pop(0)
+    chamadas.clear()
+    pytesseract.image_to_data = image_to_data_falso
+
+original = pytesseract.image_to_data
+img = np.full((400, 600), 255, dtype=np.uint8)
+print("Iniciando teste do OCR adaptativo (image_to_data simulado)...\n")
+try:
+    # 1. Tudo com confiança alta: uma passada só
+    simular([resposta([("NOTA", 95, 10), ("138,95", 92, 50)])])
+    texto, confianca = extracao.ocr_adaptativo_imagem(img)
+    assert len(chamadas) == 1, chamadas
+    assert texto == "NOTA\n138,95" and confianca > 90, (texto, confianca)
+
+    # 2. Uma linha ruim em três: passada rápida + releitura só do recorte dessa linha
+    simular([resposta([("NOTA", 95, 10), ("l3B,9S", 40, 50), ("FISCAL", 90, 90)]),
+             resposta([("138,95", 96, 5)])])
+    texto, confianca = extracao.ocr_adaptativo_imagem(img)
+    assert len(chamadas) == 2, chamadas
+    assert chamadas[1]["config"] == "--psm 7", chamadas[1]
+    assert chamadas[1]["forma"][0] < img.shape[0], "a releitura deveria ser de um recorte da linha"
+    assert texto == "NOTA\n138,95\nFISCAL" and confianca > 90, (texto, confianca)
+
+    # 3. Maioria ruim: passada rápida + releitura da imagem inteira ampliada
+    simular([resposta([("N0TA", 30, 10), ("l3B,9S", 40, 50), ("FISCAL", 90, 90)]),
+             resposta([("NOTA", 93, 20), ("138,95", 91, 100), ("FISCAL", 94, 180)])])
+    texto, confianca = extracao.ocr_adaptativo_imagem(img)
+    assert len(chamadas) == 2, chamadas
+    assert chamadas[1]["forma"] == (800, 1200), chamadas[1]
+    assert texto == "NOTA\n138,95\nFISCAL" and confianca > 90, (texto, confianca)
+
+    # 4. Releitura pior que a primeira passada: fica com a primeira
+    simular([resposta([("N0TA", 30, 10), ("l3B,9S", 40, 50)]), resposta([("???", 10, 20)])])
+    texto, _ = extracao.ocr_adaptativo_imagem(img)
+    assert len(chamadas) == 2 and texto == "N0TA\nl3B,9S", (chamadas, texto)
+finally:
+    pytesseract.image_to_data = original
+
+print("\n--- SUCESSO! ---")
@@ -0,0 +1,81 @@
+# Testa a divisão do PDF em janelas de páginas quando as páginas têm tamanhos diferentes
+# (ex.: capa A6 seguida de páginas A3). A janela deve respeitar o teto de memória em
+# TODAS as páginas, não só no tamanho da primeira.
+import os
+import shutil
+import tempfile
+from PIL import Image
+import tools.extracao as extracao
+
+DPI = 200
+MEMORIA_MB = 50
+A6 = (298.0, 420.0)
+A3 = (842.0, 1191.0)
+
+def bytes_pagina(tamanho):
+    return (tamanho[0] / 72 * DPI) * (tamanho[1] / 72 * DPI) * 3
+
+def conferir_janelas(tamanhos, janelas):
+    # Cobre todas as páginas, em ordem, sem buracos
+    assert janelas[0][0] == 1 and janelas[-1][1] == len(tamanhos), janelas
+    for (_, ultima), (primeira, _) in zip(janelas, janelas[1:]):
+        assert primeira == ultima + 1, janelas
+    # Cada janela cabe no teto (ou é uma página sozinha)
+    for primeira, ultima in janelas:
+        soma = sum(bytes_pagina(t) for t in tamanhos[primeira - 1:ultima])
+        assert soma <= MEMORIA_MB * 1024 * 1024 or primeira == ultima, (primeira, ultima, soma)
+
+print("Iniciando teste de janelas de páginas com tamanhos mistos...\n")
+
+# 1. Função pura: capa pequena + páginas grandes
+tamanhos = [A6] + [A3] * 5
+janelas = extracao._janelas_paginas(tamanhos, DPI, MEMORIA_MB)
+print(f"Janelas (capa A6 + 5 x A3): {janelas}")
+conferir_janelas(tamanhos, janelas)
+assert janelas == [(1, 3), (4, 5), (6, 6)], janelas
+# Pela capa sozinha caberiam 17 páginas por janela: o PDF inteiro de uma vez
+assert int(MEMORIA_MB * 1024 * 1024 // bytes_pagina(A6)) >= len(tamanhos)
+
+# Página maior que o teto fica sozinha, sem travar o laço
+assert extracao._janelas_paginas([A3, A3], DPI, 10) == [(1, 1), (2, 2)]
+assert extracao._janelas_paginas([], DPI, MEMORIA_MB) == []
+
+# 2. iterar_paginas_pdf com o pdfinfo simulado (saída real do 'pdfinfo -f 1 -l N')
+info_pdfinfo = {"Pages": "6", "Page size": "297.6 x 419.5 pts (A6)"}
+for numero, tamanho in enumerate(tamanhos, start=1):
+    info_pdfinfo[f"Page {numero:>4} size"] = f"{tamanho[0]} x {tamanho[1]} pts"
+renderizadas = []
+
+def pdfinfo_falso(caminho, **kwargs):
+    if "first_page" in kwargs:
+        return info_pdfinfo
+    return {k: v for k, v in info_pdfinfo.items() if not k.startswith("Page ")}
+
+def renderizar_falso(caminho, dpi, first_page, last_page):
+    renderizadas.append((first_page, last_page))
+    return [Image.new("L", (10, 10)) for _ in range(first_page, last_page + 1)]
+
+originais = (extracao.pdfinfo_from_path, extracao.renderizar_paginas_pdf)
+extracao.pdfinfo_from_path, extracao.renderizar_paginas_pdf = pdfinfo_falso, renderizar_falso
+try:
+    assert extracao._tamanhos_paginas("mista.pdf") == tamanhos
+    paginas = [(n, total) for n, total, _ in extracao.iterar_paginas_pdf("mista.pdf", dpi=DPI, memoria_max_mb=MEMORIA_MB)]
+finally:
+    extracao.pdfinfo_from_path, extracao.renderizar_paginas_pdf = originais
+assert paginas == [(n, 6) for n in range(1, 7)], paginas
+assert renderizadas == [(1, 3), (4, 5), (6, 6)], renderizadas
+
+# 3. PDF real de tamanhos mistos (só com o Poppler instalado)
+if shutil.which("pdfinfo"):
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho_pdf = os.path.join(pasta, "mista.pdf")
+        # A 72 dpi, 1 pixel = 1 ponto
+        imagens = [Image.new("L", (int(t[0]), int(t[1])), 255) for t in tamanhos]
+        imagens[0].save(caminho_pdf, save_all=True, append_images=imagens[1:], resolution=72)
+        lidos = extracao._tamanhos_paginas(caminho_pdf)
+        assert [(round(l), round(a)) for l, a in lidos] == [(int(l), int(a)) for l, a in tamanhos], lidos
+        conferir_janelas(lidos, extracao._janelas_paginas(lidos, DPI, MEMORIA_MB))
+else:
+    print("(pdfinfo não encontrado: pulei a leitura de um PDF real)")
+
+print("\n--- SUCESSO! ---")
@@ -0,0 +1,68 @@
+# Testa o perfilador por amostragem: pilhas dos nós, formatos gravados e o limiar de requisição lenta
+import os
+import json
+import time
+import tempfile
+import threading
+import contextvars
+
+pasta = tempfile.mkdtemp()
+os.environ["NF_PERFIL_DIR"] = pasta # Antes do import: os perfis do teste não vão para dados_saida/
+
+from workflows import perfilador
+from workflows.perfilador import perfilar_no, sessao_perfil, deve_gravar, gravar_perfil
+
+arquivo = os.path.join(pasta, "nota.xml")
+with open(arquivo, "w") as f:
+    f.write("<nfe/>")
+
+def funcao_lenta():
+    fim = time.monotonic() + 0.3
+    while time.monotonic() < fim:
+        sum(range(1000))
+
+@perfilar_no("action")
+def no_de_teste(estado):
+    funcao_lenta()
+    return estado
+
+print("--- Testando amostragem das threads dos nós ---")
+with sessao_perfil("nota.xml", "cabecalho", arquivo) as sessao:
+    # O nó roda em outra thread, como no pool do LangGraph (o contexto é copiado)
+    contexto = contextvars.copy_context()
+    thread = threading.Thread(target=contexto.run, args=(no_de_teste, {}))
+    thread.start(); thread.join()
+    no_de_teste({}) # E na própria thread
+assert sum(sessao.pilhas.values()) > 10, sum(sessao.pilhas.values())
+pilha_mais_comum = sessao.pilhas.most_common(1)[0][0]
+assert pilha_mais_comum[0][0] == "action" and pilha_mais_comum[1][0] == "no_de_teste", pilha_mais_comum[:3]
+assert any(quadro[0] == "funcao_lenta" for quadro in pilha_mais_comum)
+assert len(sessao.hash_documento) == 64 and sessao.nome_base.startswith(sessao.hash_documento[:16])
+print("OK.")
+
+print("--- Testando arquivos gravados ---")
+nome_base = gravar_perfil(sessao, pasta) # Também gravado ao sair do bloco (motivo 'cabecalho')
+with open(os.path.join(pasta, f"{nome_base}.speedscope.json")) as f:
+    speedscope = json.load(f)
+perfil = speedscope["profiles"][0]
+assert perfil["type"] == "sampled" and len(perfil["samples"]) == len(perfil["weights"])
+assert all(0 <= i < len(speedscope["shared"]["frames"]) for amostra in perfil["samples"] for i in amostra)
+with open(os.path.join(pasta, f"{nome_base}.folded")) as f:
+    assert f.readline().startswith("action;no_de_teste")
+with open(os.path.join(pasta, "indice.jsonl")) as f:
+    entrada = json.loads(f.readline())
+assert entrada["sha256"] == sessao.hash_documento and entrada["perfil"] == nome_base
+print("OK.")
+
+print("--- Testando limiar de requisição lenta ---")
+perfilador.PERFIL_LIMIAR_SEGUNDOS = 10
+sessao.motivo = "limiar"
+assert not deve_gravar(sessao) # 0,6s < 10s
+perfilador.PERFIL_LIMIAR_SEGUNDOS = 0.1
+assert deve_gravar(sessao)
+assert not deve_gravar(None)
+with sessao_perfil("nada", None) as sessao_vazia:
+    assert sessao_vazia is None
+print("OK.")
+
+print("\n--- SUCESSO! ---")
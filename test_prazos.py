@@ -0,0 +1,76 @@
+# Testa os prazos por etapa: OCR encerrado no meio e chamada ao LLM cortada (servidor mock lento)
+import os
+import time
+os.environ.setdefault("OPENAI_API_KEY", "sk-teste")
+
+import pytesseract
+from langchain_core.messages import HumanMessage
+
+from bench.mock_openai import iniciar_servidor_mock
+from tools.extracao import extrair_texto_imagem
+from tools.prazos import MARCADOR_OCR_INTERROMPIDO, PrazoEsgotado, prazo_etapa, segundos_restantes
+from workflows.cliente_llm import ClienteLLM
+
+print("--- Testando prazos aninhados ---")
+with prazo_etapa(10):
+    with prazo_etapa(60): # Etapa interna nunca ganha mais tempo que a externa
+        assert segundos_restantes() <= 10
+assert segundos_restantes() is None
+print("OK.")
+
+print("--- Testando OCR interrompido pelo prazo ---")
+try:
+    pytesseract.get_tesseract_version()
+    inicio = time.time()
+    with prazo_etapa(0.05):
+        resultado = extrair_texto_imagem.func("dados_teste/imagem_exemplo.png")
+    assert MARCADOR_OCR_INTERROMPIDO in resultado, resultado
+    print(f"OK: OCR encerrado em {time.time() - inicio:.2f}s.")
+except pytesseract.TesseractNotFoundError:
+    print("Tesseract não instalado, teste de OCR ignorado.")
+
+print("--- Testando chamada ao LLM cortada pelo prazo ---")
+servidor, base_url, _ = iniciar_servidor_mock(latencia_segundos=3.0)
+cliente = ClienteLLM(tentativas=3)
+modelo = cliente.criar_modelo(model="gpt-4o-mini", base_url=base_url)
+inicio = time.time()
+try:
+    with prazo_etapa(0.5):
+        cliente.invocar(modelo, [HumanMessage(content="oi")])
+    raise AssertionError("A chamada deveria ter sido interrompida")
+except PrazoEsgotado:
+    duracao = time.time() - inicio
+assert duracao < 1.5, duracao
+servidor.shutdown()
+print(f"OK: LLM interrompido em {duracao:.2f}s.")
+
+print("--- Testando prazo do documento desde o primeiro nó (OCR de confirmação incluído) ---")
+import workflows.graph as grafo
+restantes = {}
+def confirmar_lento(caminho, dados):
+    restantes["dedup"] = segundos_restantes()
+    time.sleep(0.3)
+    return False
+def layout_medido(caminho):
+    restantes["layout"] = segundos_restantes()
+    return None
+originais = (grafo.DEDUP_MODO, grafo.calcular_hashes, grafo.indice_imagens.buscar, grafo.confirmar_por_ocr, grafo.extrair_por_layout)
+grafo.DEDUP_MODO = "sinalizar"
+grafo.calcular_hashes = lambda caminho: {"phash": "0" * 16}
+grafo.indice_imagens.buscar = lambda hashes: {"id": 1, "nome_arquivo": "anterior.png", "distancia": 2, "excel_file_path": None, "dados": {}}
+grafo.confirmar_por_ocr, grafo.extrair_por_layout = confirmar_lento, layout_medido
+try:
+    inicio = time.time()
+    config = {"configurable": {"prazo_segundos": 1.0}}
+    estado = {"file_path": "nota.png", "app_mode": "single"}
+    estado.update(grafo.check_duplicate(estado, config))
+    assert abs(estado["prazo_final"] - (inicio + 1.0)) < 0.1, estado["prazo_final"] - inicio
+    assert restantes["dedup"] <= 1.0
+    estado.update(grafo.try_layout(estado, config))
+    assert estado["prazo_final"] - inicio < 1.1, "try_layout não pode reiniciar o prazo do documento"
+    assert restantes["layout"] <= 0.75, restantes
+finally:
+    (grafo.DEDUP_MODO, grafo.calcular_hashes, grafo.indice_imagens.buscar, grafo.confirmar_por_ocr, grafo.extrair_por_layout) = originais
+print(f"OK: restavam {restantes['layout']:.2f}s do prazo de 1s ao chegar no layout.")
+
+print("\n--- SUCESSO! ---")
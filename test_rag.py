@@ -0,0 +1,88 @@
+# Testa o RAG offline (embeddings falsos): índice persistido/reconstruído e cache de respostas
+import os
+import tempfile
+from typing import List
+
+import faiss
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from rag.indice import obter_indice, calcular_hash_docs, ler_manifesto, _FLAGS_MMAP
+from rag.cache_respostas import CacheRespostasRAG
+
+pasta = tempfile.mkdtemp()
+
+class EmbeddingsContados(DeterministicFakeEmbedding):
+    """Embeddings determinísticos (mesmo texto, mesmo vetor) que contam os trechos enviados, como se fossem pagos."""
+    trechos_enviados: int = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.trechos_enviados += len(texts)
+        return super().embed_documents(texts)
+
+embeddings = EmbeddingsContados(size=32)
+doc = os.path.join(pasta, "guia.md")
+with open(doc, "w", encoding="utf-8") as f:
+    f.write("# Guia\n\nEndpoint: /processar_nf/ (POST)\n\n" + "Texto do guia. " * 200)
+pasta_indice = os.path.join(pasta, "indice_rag")
+
+# Registra as leituras do índice (com ou sem mmap)
+leituras = []
+read_index_original = faiss.read_index
+def read_index_registrando(caminho, *flags):
+    leituras.append(flags[0] if flags else 0)
+    return read_index_original(caminho, *flags)
+faiss.read_index = read_index_registrando
+
+print("--- Testando índice persistido ---")
+vectorstore = obter_indice(embeddings, [doc], pasta_indice) # 1ª vez: constrói
+trechos = embeddings.trechos_enviados
+assert trechos > 1 and ler_manifesto(pasta_indice)["total_trechos"] == trechos
+assert leituras == []
+
+recarregado = obter_indice(embeddings, [doc], pasta_indice) # Mesmos docs: só carrega, sem embeddings
+assert embeddings.trechos_enviados == trechos, "Não deveria reconstruir"
+assert leituras == [_FLAGS_MMAP], leituras # Carregado memory-mapped
+assert recarregado.index.ntotal == vectorstore.index.ntotal
+resultado = recarregado.similarity_search("Endpoint: /processar_nf/ (POST)", k=1)
+assert resultado and resultado[0].metadata["source"] == doc
+
+hash_antigo = calcular_hash_docs(embeddings, [doc])
+with open(doc, "a", encoding="utf-8") as f:
+    f.write("\n\nNovo endpoint: /tarefas\n")
+obter_indice(embeddings, [doc], pasta_indice) # Docs mudaram: reconstrói
+assert embeddings.trechos_enviados > trechos
+assert ler_manifesto(pasta_indice)["hash"] == calcular_hash_docs(embeddings, [doc]) != hash_antigo
+faiss.read_index = read_index_original
+print("OK.")
+
+print("--- Testando cache de respostas ---")
+caminho_cache = os.path.join(pasta, "rag_respostas.sqlite")
+cache = CacheRespostasRAG(hash_indice=hash_antigo, caminho=caminho_cache) # Limiar padrão (0.98)
+rng = np.random.default_rng(0)
+vetor = rng.normal(size=32)
+cache.salvar("Qual o formato da resposta?", vetor.tolist(), "JSON")
+assert cache.buscar_exata("qual o FORMATO da resposta") == "JSON" # Acerto exato (após normalizar)
+assert cache.buscar_exata("Como enviar um PDF?") is None
+vizinho = vetor + rng.normal(scale=0.05, size=32) # Pergunta parecida: vetor quase igual
+resposta, similaridade = cache.buscar_similar(vizinho.tolist(), "Qual é o formato da resposta?")
+assert resposta == "JSON" and similaridade >= 0.98, similaridade
+assert cache.buscar_similar(rng.normal(size=32).tolist()) is None # Pergunta sem relação
+distante = vetor + rng.normal(scale=0.3, size=32) # Similaridade ~0.96: parecida, mas abaixo do limiar
+assert 0.93 < float(np.dot(distante, vetor) / np.linalg.norm(distante) / np.linalg.norm(vetor)) < 0.98
+assert cache.buscar_similar(distante.tolist()) is None
+
+# Perguntas que só diferem nos números: embeddings quase iguais, respostas diferentes
+vetor_nota = rng.normal(size=32)
+cache.salvar("Qual o status da nota 123?", vetor_nota.tolist(), "Nota 123: processada")
+quase_igual = (vetor_nota + rng.normal(scale=0.01, size=32)).tolist()
+assert cache.buscar_similar(quase_igual, "Qual o status da nota 456?") is None
+assert cache.buscar_similar(quase_igual, "qual o status da nota 123")[0] == "Nota 123: processada"
+
+# Documentos mudaram (outro hash do índice): respostas antigas descartadas
+cache_novo = CacheRespostasRAG(hash_indice=calcular_hash_docs(embeddings, [doc]), caminho=caminho_cache)
+assert cache_novo.buscar_exata("Qual o formato da resposta?") is None
+assert cache_novo.buscar_similar(vetor.tolist()) is None
+print("OK.")
+
+print("\n--- SUCESSO! ---")
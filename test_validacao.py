@@ -0,0 +1,54 @@
+# Testa o validador e a re-extração direcionada (sem chamar a OpenAI: a resposta do LLM é simulada)
+import os
+os.environ.setdefault("OPENAI_API_KEY", "sk-teste")
+
+from langchain_core.messages import AIMessage
+from langchain_openai import ChatOpenAI
+
+from tools.extracao import DadosNotaFiscal
+from tools.validacao import cnpj_valido, cpf_valido, validar_chave_acesso, interpretar_data, validar_dados
+from workflows.reextracao import reextrair_campos
+
+print("--- Testando dígitos verificadores ---")
+assert cnpj_valido("11.222.333/0001-81") and not cnpj_valido("11.222.333/0001-82")
+assert cnpj_valido("12.ABC.345/01DE-35") # CNPJ alfanumérico
+assert cpf_valido("529.982.247-25") and not cpf_valido("529.982.247-26")
+assert not cnpj_valido("00.000.000/0000-00")
+
+chave = "3525091122233300018165001000012345100000001"
+pesos = [2 + (i % 8) for i in range(43)][::-1]
+resto = sum(int(c) * p for c, p in zip(chave, pesos)) % 11
+chave += str(0 if resto < 2 else 11 - resto)
+assert validar_chave_acesso(chave) is None
+assert validar_chave_acesso(chave[:-1] + str((int(chave[-1]) + 1) % 10)) is not None
+assert validar_chave_acesso("AB1C-2D3E") is None # Código de verificação da NFS-e
+print("OK.")
+
+print("--- Testando datas ---")
+assert interpretar_data("20/09/2025 19:51:09").year == 2025
+assert interpretar_data("2025-09-20T19:51:09-03:00").hour == 19
+assert interpretar_data("20 de setembro") is None
+print("OK.")
+
+print("--- Testando validação completa ---")
+ok = DadosNotaFiscal(chave_acesso=chave, cnpj_emitente="11.222.333/0001-81", cnpj_cpf_destinatario="529.982.247-25",
+                     data_emissao="20/09/2025 19:51:09", valor_total=1000.0, base_calculo=1000.0, valor_iss=50.0)
+assert validar_dados(ok) == {}, validar_dados(ok)
+ruim = DadosNotaFiscal(**{**ok.dict(), "cnpj_emitente": "11.222.333/0001-18", "valor_iss": 500.0})
+erros = validar_dados(ruim)
+assert set(erros) == {"cnpj_emitente", "base_calculo", "valor_iss"}, erros
+print(f"Erros encontrados: {erros}")
+
+print("--- Testando re-extração só dos campos reprovados ---")
+chamadas = []
+def invocar_simulado(modelo, mensagens):
+    chamadas.append((modelo, mensagens))
+    return AIMessage(content="", tool_calls=[{"name": "corrigir_campos_nota", "id": "c1",
+                                              "args": {"cnpj_emitente": "11.222.333/0001-81", "valor_iss": 50.0, "base_calculo": 1000.0}}])
+
+corrigido = reextrair_campos(ChatOpenAI(model="gpt-4o-mini"), "texto bruto da nota", ruim, erros, invocar_simulado)
+assert len(chamadas) == 1
+ferramenta = chamadas[0][0].kwargs["tools"][0]["function"]
+assert set(ferramenta["parameters"]["properties"]) == set(erros), ferramenta
+assert validar_dados(corrigido) == {} and corrigido.nome_emitente == ruim.nome_emitente
+print("OK.")
@@ -0,0 +1,295 @@
+"""
+ARMAZENAMENTO indexado das notas salvas (SQLite), para consultas sem abrir os Excel.
+
+- Tabela 'notas': todos os campos de DadosNotaFiscal + colunas normalizadas
+  (CNPJ/CPF só com dígitos/letras, data em ISO) usadas pelos índices;
+- Índices compostos (documento, data, id) atendem filtro + ordenação + paginação
+  por cursor (keyset) sem varrer a tabela;
+- Tabelas de resumo (por dia, por dia/emitente e por mês/emitente), mantidas a cada
+  gravação, respondem as somas por período/emitente lendo poucas linhas mesmo com
+  milhões de notas.
+
+Notas com a mesma chave de acesso e emitente são atualizadas, não duplicadas. Sem
+chave de acesso, vale o mesmo para o mesmo emitente, número e data de emissão (ex: a
+nota que está no COMPILADO_MESTRE.xlsx e também no seu NotaFiscal_*.xlsx).
+
+Importar os Excel já existentes:  python -m tools.armazenamento --importar dados_saida
+"""
+import os
+import re
+import time
+import sqlite3
+import argparse
+import threading
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from tools.extracao import DadosNotaFiscal
+from tools.validacao import interpretar_data, interpretar_valor
+
+# --- Configuração (via .env) ---
+ARMAZENAMENTO_CAMINHO = os.getenv("NF_ARMAZENAMENTO_CAMINHO", os.path.join("dados_saida", "notas.sqlite"))
+CONSULTA_LIMITE_MAX = 500
+
+CAMPOS_NOTA = list(DadosNotaFiscal.__fields__)
+VALORES_AGREGADOS = ("valor_total", "valor_iss", "valor_icms")
+# Comprimento do prefixo de 'dia' (AAAA-MM-DD) que define cada período
+PERIODOS = {"dia": 10, "mes": 7, "ano": 4}
+
+
+def normalizar_documento(valor: Optional[str]) -> Optional[str]:
+    """'11.222.333/0001-81' -> '11222333000181' (mantém letras do CNPJ alfanumérico)."""
+    if not valor:
+        return None
+    return re.sub(r"[^0-9A-Z]", "", str(valor).upper()) or None
+
+def _data_iso(valor: Optional[str]) -> str:
+    """Data de emissão em ISO ('AAAA-MM-DDTHH:MM:SS'); '' se ausente ou não reconhecida (fica no fim da ordenação)."""
+    data = interpretar_data(str(valor)) if valor else None
+    return data.strftime("%Y-%m-%dT%H:%M:%S") if data else ""
+
+def _fim_exclusivo(data_fim: date) -> str:
+    return (data_fim + timedelta(days=1)).isoformat()
+
+
+class ArmazenamentoNotas:
+    def __init__(self, caminho: str = ARMAZENAMENTO_CAMINHO):
+        self.caminho = caminho
+        self._trava = threading.Lock()
+        self._conexao: Optional[sqlite3.Connection] = None
+
+    def _conectar(self) -> sqlite3.Connection:
+        if self._conexao is None:
+            pasta = os.path.dirname(self.caminho)
+            if pasta: os.makedirs(pasta, exist_ok=True)
+            # A API atende as consultas em threads diferentes
+            conexao = sqlite3.connect(self.caminho, timeout=30, check_same_thread=False)
+            conexao.row_factory = sqlite3.Row
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            colunas = ", ".join(f"{campo} {'REAL' if campo in VALORES_AGREGADOS or campo == 'base_calculo' else 'TEXT'}"
+                                for campo in CAMPOS_NOTA)
+            conexao.executescript(f"""
+                CREATE TABLE IF NOT EXISTS notas (
+                    id INTEGER PRIMARY KEY,
+                    {colunas},
+                    emitente_doc TEXT, destinatario_doc TEXT,
+                    data_emissao_iso TEXT NOT NULL DEFAULT '',
+                    modo TEXT, arquivo_excel TEXT, salvo_em REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_notas_emitente ON notas (emitente_doc, data_emissao_iso, id);
+                CREATE INDEX IF NOT EXISTS idx_notas_destinatario ON notas (destinatario_doc, data_emissao_iso, id);
+                CREATE INDEX IF NOT EXISTS idx_notas_data ON notas (data_emissao_iso, id);
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_notas_chave ON notas (chave_acesso, emitente_doc);
+                CREATE INDEX IF NOT EXISTS idx_notas_numero ON notas (emitente_doc, numero_nf, data_emissao_iso);
+
+                CREATE TABLE IF NOT EXISTS resumo_dia (
+                    dia TEXT PRIMARY KEY, quantidade INTEGER NOT NULL,
+                    valor_total REAL NOT NULL, valor_iss REAL NOT NULL, valor_icms REAL NOT NULL
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS resumo_dia_emitente (
+                    emitente_doc TEXT NOT NULL, dia TEXT NOT NULL, quantidade INTEGER NOT NULL,
+                    valor_total REAL NOT NULL, valor_iss REAL NOT NULL, valor_icms REAL NOT NULL,
+                    PRIMARY KEY (emitente_doc, dia)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS resumo_mes_emitente (
+                    emitente_doc TEXT NOT NULL, mes TEXT NOT NULL, quantidade INTEGER NOT NULL,
+                    valor_total REAL NOT NULL, valor_iss REAL NOT NULL, valor_icms REAL NOT NULL,
+                    PRIMARY KEY (emitente_doc, mes)
+                ) WITHOUT ROWID;
+                -- Índices "cobrindo" os valores: o agrupamento por período lê só o índice
+                CREATE INDEX IF NOT EXISTS idx_resumo_dia_emitente_dia
+                    ON resumo_dia_emitente (dia, emitente_doc, quantidade, valor_total, valor_iss, valor_icms);
+                CREATE INDEX IF NOT EXISTS idx_resumo_mes_emitente_mes
+                    ON resumo_mes_emitente (mes, emitente_doc, quantidade, valor_total, valor_iss, valor_icms);
+            """)
+            conexao.commit()
+            self._conexao = conexao
+        return self._conexao
+
+    # --- Gravação ---
+    def _somar_resumo(self, conexao: sqlite3.Connection, linha: Dict[str, Any], sinal: int) -> None:
+        """Soma (sinal=1) ou desconta (sinal=-1) uma nota das tabelas de resumo."""
+        dia = linha["data_emissao_iso"][:10]
+        emitente = linha["emitente_doc"] or ""
+        valores = [sinal * (linha[campo] or 0.0) for campo in VALORES_AGREGADOS]
+        somas = ("quantidade = quantidade + excluded.quantidade, valor_total = valor_total + excluded.valor_total,"
+                 " valor_iss = valor_iss + excluded.valor_iss, valor_icms = valor_icms + excluded.valor_icms")
+        conexao.execute(f"INSERT INTO resumo_dia VALUES (?, ?, ?, ?, ?) ON CONFLICT (dia) DO UPDATE SET {somas}",
+                        (dia, sinal, *valores))
+        conexao.execute(f"INSERT INTO resumo_dia_emitente VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (emitente_doc, dia) DO UPDATE SET {somas}",
+                        (emitente, dia, sinal, *valores))
+        conexao.execute(f"INSERT INTO resumo_mes_emitente VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (emitente_doc, mes) DO UPDATE SET {somas}",
+                        (emitente, dia[:7], sinal, *valores))
+
+    def _gravar(self, conexao: sqlite3.Connection, dados: Dict[str, Any], modo: Optional[str], arquivo_excel: Optional[str]) -> int:
+        linha = {campo: dados.get(campo) for campo in CAMPOS_NOTA}
+        linha.update(
+            emitente_doc=normalizar_documento(linha["cnpj_emitente"]),
+            destinatario_doc=normalizar_documento(linha["cnpj_cpf_destinatario"]),
+            data_emissao_iso=_data_iso(linha["data_emissao"]),
+            modo=modo, arquivo_excel=arquivo_excel, salvo_em=time.time(),
+        )
+        existente = None
+        if linha["chave_acesso"]:
+            existente = conexao.execute(
+                "SELECT * FROM notas WHERE chave_acesso = ? AND emitente_doc IS ?", (linha["chave_acesso"], linha["emitente_doc"])
+            ).fetchone()
+        elif linha["numero_nf"] and linha["emitente_doc"]: # Sem chave: mesma nota = mesmo emitente, número e data
+            existente = conexao.execute(
+                "SELECT * FROM notas WHERE emitente_doc = ? AND numero_nf = ? AND data_emissao_iso = ? AND (chave_acesso IS NULL OR chave_acesso = '')",
+                (linha["emitente_doc"], linha["numero_nf"], linha["data_emissao_iso"])
+            ).fetchone()
+        if existente is not None: # Nota reprocessada: substitui e corrige os resumos
+            self._somar_resumo(conexao, dict(existente), -1)
+            conexao.execute("DELETE FROM notas WHERE id = ?", (existente["id"],))
+        colunas = list(linha)
+        cursor = conexao.execute(
+            f"INSERT INTO notas ({', '.join(colunas)}) VALUES ({', '.join('?' for _ in colunas)})", [linha[c] for c in colunas]
+        )
+        self._somar_resumo(conexao, linha, 1)
+        return cursor.lastrowid
+
+    def salvar(self, dados: Dict[str, Any], modo: Optional[str] = None, arquivo_excel: Optional[str] = None) -> int:
+        """Grava uma nota (dicionário de DadosNotaFiscal). Retorna o id."""
+        with self._trava:
+            conexao = self._conectar()
+            with conexao: # Transação: nota + resumos juntos
+                return self._gravar(conexao, dados, modo, arquivo_excel)
+
+    def salvar_varias(self, lista_dados: List[Dict[str, Any]], modo: Optional[str] = None, arquivo_excel: Optional[str] = None) -> int:
+        """Grava várias notas numa única transação (importação). Retorna quantas."""
+        with self._trava:
+            conexao = self._conectar()
+            with conexao:
+                for dados in lista_dados:
+                    self._gravar(conexao, dados, modo, arquivo_excel)
+        return len(lista_dados)
+
+    # --- Consultas ---
+    def consultar(self, cnpj_emitente: Optional[str] = None, cnpj_cpf_destinatario: Optional[str] = None,
+                  chave_acesso: Optional[str] = None, data_inicio: Optional[date] = None, data_fim: Optional[date] = None,
+                  limite: int = 50, cursor: Optional[str] = None, crescente: bool = False) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Notas filtradas, da mais recente para a mais antiga (ou o contrário, com 'crescente').
+        Paginação por cursor (keyset): passe o 'proximo_cursor' retornado para a página seguinte.
+        """
+        condicoes, parametros = [], []
+        if cnpj_emitente:
+            condicoes.append("emitente_doc = ?"); parametros.append(normalizar_documento(cnpj_emitente))
+        if cnpj_cpf_destinatario:
+            condicoes.append("destinatario_doc = ?"); parametros.append(normalizar_documento(cnpj_cpf_destinatario))
+        if chave_acesso:
+            condicoes.append("chave_acesso = ?"); parametros.append(chave_acesso.strip())
+        if data_inicio:
+            condicoes.append("data_emissao_iso >= ?"); parametros.append(data_inicio.isoformat())
+        if data_fim:
+            condicoes.append("data_emissao_iso < ?"); parametros.append(_fim_exclusivo(data_fim))
+        if cursor:
+            data_cursor, _, id_cursor = cursor.rpartition("|")
+            condicoes.append(f"(data_emissao_iso, id) {'>' if crescente else '<'} (?, ?)"); parametros.extend([data_cursor, int(id_cursor)])
+
+        limite = max(1, min(limite, CONSULTA_LIMITE_MAX))
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        ordem = "ASC" if crescente else "DESC"
+        sql = (f"SELECT id, {', '.join(CAMPOS_NOTA)}, data_emissao_iso, modo, arquivo_excel FROM notas {where}"
+               f" ORDER BY data_emissao_iso {ordem}, id {ordem} LIMIT ?")
+        with self._trava:
+            linhas = self._conectar().execute(sql, [*parametros, limite + 1]).fetchall()
+        itens = [dict(linha) for linha in linhas[:limite]]
+        proximo_cursor = f"{itens[-1]['data_emissao_iso']}|{itens[-1]['id']}" if len(linhas) > limite else None
+        return itens, proximo_cursor
+
+    def iterar(self, tamanho_lote: int = CONSULTA_LIMITE_MAX, **filtros) -> Iterator[List[Dict[str, Any]]]:
+        """Percorre TODAS as notas filtradas em lotes (ordem cronológica), sem carregar o resultado inteiro."""
+        cursor = None
+        while True:
+            itens, cursor = self.consultar(limite=tamanho_lote, cursor=cursor, crescente=True, **filtros)
+            if itens:
+                yield itens
+            if cursor is None:
+                return
+
+    def agregar(self, periodo: str = "mes", por_emitente: bool = False, cnpj_emitente: Optional[str] = None,
+                data_inicio: Optional[date] = None, data_fim: Optional[date] = None) -> List[Dict[str, Any]]:
+        """Quantidade e somas de valor_total/valor_iss/valor_icms por período (e, opcionalmente, por emitente)."""
+        if periodo not in PERIODOS:
+            raise ValueError(f"Período inválido: '{periodo}'. Use {', '.join(PERIODOS)}.")
+        # Escolhe o menor resumo que responde a pergunta: o mensal só serve se o intervalo for de meses inteiros
+        meses_inteiros = (not data_inicio or data_inicio.day == 1) and (not data_fim or (data_fim + timedelta(days=1)).day == 1)
+        if not (por_emitente or cnpj_emitente):
+            tabela, coluna = "resumo_dia", "dia"
+        elif periodo != "dia" and meses_inteiros:
+            tabela, coluna = "resumo_mes_emitente", "mes"
+        else:
+            tabela, coluna = "resumo_dia_emitente", "dia"
+        tamanho = 10 if coluna == "dia" else 7
+
+        condicoes, parametros = [], []
+        if cnpj_emitente:
+            condicoes.append("emitente_doc = ?"); parametros.append(normalizar_documento(cnpj_emitente))
+        if data_inicio:
+            condicoes.append(f"{coluna} >= ?"); parametros.append(data_inicio.isoformat()[:tamanho])
+        if data_fim:
+            condicoes.append(f"{coluna} < ?"); parametros.append(_fim_exclusivo(data_fim)[:tamanho])
+
+        grupos = [f"substr({coluna}, 1, {PERIODOS[periodo]})"] + (["emitente_doc"] if por_emitente else [])
+        colunas = [f"{grupos[0]} AS periodo"] + (["emitente_doc AS cnpj_emitente"] if por_emitente else [])
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        sql = (f"SELECT {', '.join(colunas)}, SUM(quantidade) AS quantidade,"
+               f" {', '.join(f'ROUND(SUM({v}), 2) AS soma_{v}' for v in VALORES_AGREGADOS)}"
+               f" FROM {tabela} {where} GROUP BY {', '.join(grupos)} HAVING SUM(quantidade) > 0 ORDER BY {', '.join(grupos)}")
+        with self._trava:
+            return [dict(linha) for linha in self._conectar().execute(sql, parametros).fetchall()]
+
+    def fechar(self) -> None:
+        with self._trava:
+            if self._conexao is not None:
+                self._conexao.close(); self._conexao = None
+
+
+# Instância compartilhada (grafo e API)
+armazenamento_notas = ArmazenamentoNotas()
+
+def registrar_nota(dados: Dict[str, Any], modo: Optional[str] = None, arquivo_excel: Optional[str] = None) -> None:
+    """Grava a nota no armazenamento indexado. Falhas não interrompem o salvamento no Excel."""
+    try:
+        armazenamento_notas.salvar(dados, modo, arquivo_excel)
+    except Exception as e:
+        print(f"Erro ao registrar nota no armazenamento indexado: {e}")
+
+
+def importar_excel(pasta: str, armazenamento: ArmazenamentoNotas = armazenamento_notas) -> int:
+    """Importa os NotaFiscal_*.xlsx e o COMPILADO_MESTRE.xlsx já existentes na pasta."""
+    import pandas as pd
+    total = 0
+    for nome in sorted(os.listdir(pasta)):
+        if not nome.endswith(".xlsx"):
+            continue
+        caminho = os.path.join(pasta, nome)
+        df = pd.read_excel(caminho, dtype=str)
+        registros = [
+            {campo: (None if pd.isna(valor) else valor) for campo, valor in registro.items()}
+            for registro in df.to_dict(orient="records")
+        ]
+        for numero_linha, registro in enumerate(registros, start=2): # Excel lido como texto para não estragar CNPJ/chave; valores voltam a número
+            for campo in VALORES_AGREGADOS + ("base_calculo",):
+                if registro.get(campo) is not None:
+                    valor = interpretar_valor(registro[campo])
+                    if valor is None: # Uma célula ruim não derruba a importação
+                        print(f"Aviso: {nome}, linha {numero_linha}: '{campo}' = '{registro[campo]}' não é um valor, ignorado.")
+                    registro[campo] = valor
+        modo = "accumulated" if nome == "COMPILADO_MESTRE.xlsx" else "single"
+        total += armazenamento.salvar_varias(registros, modo, caminho)
+        print(f"Importado: {caminho} ({len(registros)} notas)")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Armazenamento indexado das notas fiscais")
+    parser.add_argument("--importar", metavar="PASTA", help="Importa os arquivos .xlsx já gerados (ex: dados_saida)")
+    args = parser.parse_args()
+    if args.importar:
+        print(f"Total importado: {importar_excel(args.importar)} notas em '{armazenamento_notas.caminho}'.")
+    else:
+        parser.print_help()
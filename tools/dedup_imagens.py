@@ -0,0 +1,205 @@
+"""
+DEDUPLICAÇÃO de imagens quase idênticas (várias fotos ou re-scans da mesma nota).
+
+O hash exato do arquivo não pega a mesma nota fotografada duas vezes. Aqui cada
+imagem vira dois hashes perceptuais de 64 bits (OpenCV/NumPy, imagem reduzida
+em tons de cinza):
+- pHash: sinal dos coeficientes de baixa frequência da DCT (32x32 -> 8x8);
+- dHash: sinal do gradiente horizontal numa miniatura 9x8.
+Imagens parecidas têm hashes a poucos bits de distância (Hamming).
+
+Índice de vizinhos próximos (SQLite): o pHash é dividido em 8 bandas de 8 bits,
+cada uma indexada. Pelo princípio da casa dos pombos, dois hashes a até 7 bits
+de distância coincidem em pelo menos uma banda; só esses candidatos são comparados.
+
+ATENÇÃO: notas diferentes do MESMO modelo (mesmo estabelecimento/layout) também
+ficam a poucos bits, pois os valores são detalhes pequenos na miniatura. Por
+isso, antes de sinalizar ou reutilizar, uma leitura rápida de OCR confere que o
+número e o valor da nota anterior estão na imagem.
+
+Modos (NF_DEDUP_MODO):
+- 'sinalizar' (padrão): processa normalmente e informa a duplicata confirmada;
+- 'reutilizar': devolve o resultado anterior sem o OCR completo e sem o LLM;
+- 'desligado'.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+import pytesseract
+
+from tools.extracao import ocr_com_prazo, OCR_LADO_MAX_RAPIDO
+from tools.validacao import interpretar_valor
+
+# --- Configuração (via .env) ---
+DEDUP_MODO = os.getenv("NF_DEDUP_MODO", "sinalizar")
+DEDUP_CAMINHO = os.getenv("NF_DEDUP_CAMINHO", os.path.join("dados_saida", "imagens.sqlite"))
+# Distância máxima (bits, de 64) nos DOIS hashes para considerar a imagem quase idêntica (até 7: garantido pelas bandas)
+DEDUP_DISTANCIA_MAX = int(os.getenv("NF_DEDUP_DISTANCIA_MAX", "6"))
+DEDUP_MODOS = ("sinalizar", "reutilizar", "desligado")
+# Mínimo de dígitos (número + valor da nota) para a confirmação por OCR valer
+CONFIRMACAO_DIGITOS_MIN = int(os.getenv("NF_DEDUP_CONFIRMACAO_DIGITOS_MIN", "6"))
+
+EXTENSOES_IMAGEM = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp")
+BITS_BANDA = 8
+NUMERO_BANDAS = 64 // BITS_BANDA
+
+
+# --- Hashes perceptuais ---
+def _bits_para_hex(bits: np.ndarray) -> str:
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):016x}"
+
+def phash(img_cinza: np.ndarray) -> str:
+    reduzida = cv2.resize(img_cinza, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    coeficientes = cv2.dct(reduzida)[:8, :8].flatten()
+    # O coeficiente DC (brilho médio) não entra na mediana: o hash ignora mudanças de brilho
+    return _bits_para_hex(coeficientes > np.median(coeficientes[1:]))
+
+def dhash(img_cinza: np.ndarray) -> str:
+    reduzida = cv2.resize(img_cinza, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return _bits_para_hex((reduzida[:, 1:] > reduzida[:, :-1]).flatten())
+
+def hashes_imagem(img_cinza: np.ndarray) -> Dict[str, str]:
+    return {"phash": phash(img_cinza), "dhash": dhash(img_cinza)}
+
+def calcular_hashes(caminho_arquivo: str) -> Optional[Dict[str, str]]:
+    """Hashes de um arquivo de imagem. None para outros formatos ou imagem ilegível."""
+    if os.path.splitext(caminho_arquivo)[1].lower() not in EXTENSOES_IMAGEM:
+        return None
+    img_cinza = cv2.imread(caminho_arquivo, cv2.IMREAD_GRAYSCALE)
+    return None if img_cinza is None else hashes_imagem(img_cinza)
+
+def distancia(hash_a: str, hash_b: str) -> int:
+    """Distância de Hamming entre dois hashes em hexadecimal."""
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
+
+def _bandas(hash_hex: str) -> List[int]:
+    valor = int(hash_hex, 16)
+    return [(valor >> (i * BITS_BANDA)) & ((1 << BITS_BANDA) - 1) for i in range(NUMERO_BANDAS)]
+
+
+# --- Índice ---
+class IndiceImagens:
+    def __init__(self, caminho: str = DEDUP_CAMINHO):
+        self.caminho = caminho
+        self._trava = threading.Lock()
+        self._conexao: Optional[sqlite3.Connection] = None
+
+    def _conectar(self) -> sqlite3.Connection:
+        if self._conexao is None:
+            pasta = os.path.dirname(self.caminho)
+            if pasta: os.makedirs(pasta, exist_ok=True)
+            conexao = sqlite3.connect(self.caminho, timeout=30, check_same_thread=False)
+            conexao.row_factory = sqlite3.Row
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            bandas = ", ".join(f"banda{i} INTEGER NOT NULL" for i in range(NUMERO_BANDAS))
+            indices = "\n".join(f"CREATE INDEX IF NOT EXISTS idx_imagens_banda{i} ON imagens (banda{i});" for i in range(NUMERO_BANDAS))
+            conexao.executescript(f"""
+                CREATE TABLE IF NOT EXISTS imagens (
+                    id INTEGER PRIMARY KEY,
+                    phash TEXT NOT NULL, dhash TEXT NOT NULL, {bandas},
+                    nome_arquivo TEXT, dados TEXT NOT NULL, excel_file_path TEXT, salva_em REAL NOT NULL
+                );
+                {indices}
+            """)
+            conexao.commit()
+            self._conexao = conexao
+        return self._conexao
+
+    def registrar(self, hashes: Dict[str, str], dados: Dict[str, Any], excel_file_path: Optional[str] = None,
+                  nome_arquivo: Optional[str] = None) -> int:
+        """Guarda os hashes de uma imagem já processada com o resultado da extração."""
+        colunas = ["phash", "dhash", *(f"banda{i}" for i in range(NUMERO_BANDAS)), "nome_arquivo", "dados", "excel_file_path", "salva_em"]
+        valores = [hashes["phash"], hashes["dhash"], *_bandas(hashes["phash"]), nome_arquivo,
+                   json.dumps(dados, ensure_ascii=False, default=str), excel_file_path, time.time()]
+        with self._trava:
+            conexao = self._conectar()
+            cursor = conexao.execute(f"INSERT INTO imagens ({', '.join(colunas)}) VALUES ({', '.join('?' for _ in colunas)})", valores)
+            conexao.commit()
+        return cursor.lastrowid
+
+    def buscar(self, hashes: Dict[str, str], distancia_max: int = DEDUP_DISTANCIA_MAX) -> Optional[Dict[str, Any]]:
+        """A imagem indexada mais próxima dentro de 'distancia_max' bits (nos dois hashes), ou None."""
+        bandas = _bandas(hashes["phash"])
+        condicao = " OR ".join(f"banda{i} = ?" for i in range(NUMERO_BANDAS))
+        with self._trava:
+            candidatos = self._conectar().execute(
+                f"SELECT id, phash, dhash, nome_arquivo, dados, excel_file_path, salva_em FROM imagens WHERE {condicao}", bandas
+            ).fetchall()
+        melhor = None
+        for candidato in candidatos:
+            d_phash = distancia(hashes["phash"], candidato["phash"])
+            d_dhash = distancia(hashes["dhash"], candidato["dhash"])
+            if d_phash > distancia_max or d_dhash > distancia_max:
+                continue
+            if melhor is None or d_phash + d_dhash < melhor["distancia"]:
+                melhor = {**dict(candidato), "dados": json.loads(candidato["dados"]), "distancia": d_phash + d_dhash}
+        return melhor
+
+    def fechar(self) -> None:
+        with self._trava:
+            if self._conexao is not None:
+                self._conexao.close()
+                self._conexao = None
+
+
+# Instância global (grafo, API e workers usam o mesmo arquivo)
+indice_imagens = IndiceImagens()
+
+
+# --- Confirmação antes de sinalizar/reutilizar ---
+# Números no texto do OCR: '4521', '1.234,56', '123.45' (pontuação no meio vira um número só)
+_REGEX_NUMERO = re.compile(r"\d(?:[\d.,]*\d)?")
+
+def _digitos(texto: str) -> str:
+    return re.sub(r"\D", "", texto)
+
+def numeros_confirmados(texto: str, dados: Dict[str, Any]) -> bool:
+    """
+    O número e o valor total da nota anterior aparecem no texto, cada um como um número
+    inteiro do texto (não como pedaço de outro). Sem dígitos suficientes, não confirma:
+    um valor como 1,00 sozinho aparece em quase qualquer nota.
+    """
+    numero = _digitos(str(dados.get("numero_nf") or "")).lstrip("0")
+    valor = dados.get("valor_total")
+    if valor is not None:
+        # Notas vindas do Excel podem trazer o valor como texto ('1.234,56')
+        valor = interpretar_valor(valor)
+        if valor is None:
+            return False
+        valor = _digitos(f"{valor:.2f}")
+    else:
+        valor = ""
+    partes = [parte for parte in (numero, valor) if parte]
+    if sum(len(parte) for parte in partes) < CONFIRMACAO_DIGITOS_MIN:
+        return False
+    # Só dígitos: '1.234,56' e '1234.56' viram '123456'; zeros à esquerda do número da nota não contam
+    numeros_texto = {_digitos(token).lstrip("0") for token in _REGEX_NUMERO.findall(texto)}
+    return all(parte.lstrip("0") in numeros_texto for parte in partes)
+
+def confirmar_por_ocr(caminho_arquivo: str, dados: Dict[str, Any]) -> bool:
+    """
+    Leitura rápida (imagem reduzida, uma passada) para conferir que o número e o valor
+    total da nota anterior aparecem nesta imagem.
+    """
+    if not any(dados.get(campo) is not None for campo in ("numero_nf", "valor_total")):
+        return False
+    img_cinza = cv2.imread(caminho_arquivo, cv2.IMREAD_GRAYSCALE)
+    if img_cinza is None:
+        return False
+    escala = min(1.0, OCR_LADO_MAX_RAPIDO / max(img_cinza.shape[:2]))
+    if escala < 1.0:
+        img_cinza = cv2.resize(img_cinza, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA)
+    try:
+        texto = ocr_com_prazo(pytesseract.image_to_string, img_cinza)
+    except Exception as e:
+        print(f"Dedup: OCR de confirmação falhou ({e}).")
+        return False
+    return numeros_confirmados(texto, dados)
@@ -0,0 +1,139 @@
+"""
+EXPORTAÇÃO das notas do armazenamento indexado em memória constante.
+
+As notas são lidas em lotes (cursor) e escritas conforme chegam:
+- CSV: gerado em pedaços direto para a resposta (nada vai para o disco);
+- XLSX: openpyxl em modo 'write_only' (as linhas não ficam em memória) num arquivo temporário;
+- Parquet: pyarrow.ParquetWriter, um row group por lote (requer 'pyarrow', opcional).
+
+XLSX e Parquet precisam do arquivo completo (zip/rodapé no fim), por isso passam
+por um arquivo temporário que é enviado em blocos e apagado em seguida.
+"""
+import io
+import os
+import csv
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Iterator, List
+
+from openpyxl import Workbook
+
+from tools.armazenamento import ArmazenamentoNotas, CAMPOS_NOTA, armazenamento_notas
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # Parquet é opcional
+    pa = None
+
+# --- Configuração ---
+TAMANHO_BLOCO_BYTES = 64 * 1024
+COLUNAS_NUMERICAS = ("valor_total", "base_calculo", "valor_iss", "valor_icms")
+
+FORMATOS_EXPORTACAO = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def formatos_disponiveis() -> List[str]:
+    return [formato for formato in FORMATOS_EXPORTACAO if formato != "parquet" or pa is not None]
+
+def _validar_formato(formato: str) -> None:
+    if formato not in FORMATOS_EXPORTACAO:
+        raise ValueError(f"Formato inválido: '{formato}'. Use {', '.join(FORMATOS_EXPORTACAO)}.")
+    if formato == "parquet" and pa is None:
+        raise ValueError("Exportação em Parquet indisponível: instale o pacote 'pyarrow'.")
+
+def _linhas(lote: List[Dict[str, Any]]) -> Iterator[list]:
+    for nota in lote:
+        yield [nota.get(campo) for campo in CAMPOS_NOTA]
+
+
+# --- Escritores ---
+def _gerar_csv(lotes: Iterator[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(CAMPOS_NOTA)
+    primeiro = True
+    for lote in lotes:
+        escritor.writerows(_linhas(lote))
+        # BOM no início: o Excel abre o CSV em UTF-8 com os acentos corretos
+        yield (("\ufeff" if primeiro else "") + buffer.getvalue()).encode("utf-8")
+        primeiro = False
+        buffer.seek(0); buffer.truncate()
+    if primeiro: # Nenhuma nota: só o cabeçalho
+        yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+
+def _escrever_xlsx(lotes: Iterator[List[Dict[str, Any]]], caminho_destino: str) -> int:
+    livro = Workbook(write_only=True)
+    planilha = livro.create_sheet("Notas")
+    planilha.append(CAMPOS_NOTA)
+    total = 0
+    for lote in lotes:
+        for linha in _linhas(lote):
+            planilha.append(linha)
+        total += len(lote)
+    livro.save(caminho_destino)
+    return total
+
+def _escrever_parquet(lotes: Iterator[List[Dict[str, Any]]], caminho_destino: str) -> int:
+    esquema = pa.schema([(campo, pa.float64() if campo in COLUNAS_NUMERICAS else pa.string()) for campo in CAMPOS_NOTA])
+    total = 0
+    with pq.ParquetWriter(caminho_destino, esquema) as escritor:
+        for lote in lotes:
+            colunas = {campo: [nota.get(campo) for nota in lote] for campo in CAMPOS_NOTA}
+            escritor.write_table(pa.Table.from_pydict(colunas, schema=esquema))
+            total += len(lote)
+    return total
+
+
+# --- Interface ---
+def exportar_para_arquivo(formato: str, caminho_destino: str, armazenamento: ArmazenamentoNotas = armazenamento_notas,
+                          **filtros) -> int:
+    """Exporta as notas filtradas para um arquivo. Retorna quantas notas foram escritas."""
+    _validar_formato(formato)
+    lotes = armazenamento.iterar(**filtros)
+    if formato == "xlsx":
+        return _escrever_xlsx(lotes, caminho_destino)
+    if formato == "parquet":
+        return _escrever_parquet(lotes, caminho_destino)
+    total = 0
+    def contar(lotes):
+        nonlocal total
+        for lote in lotes:
+            total += len(lote)
+            yield lote
+    with open(caminho_destino, "wb") as f:
+        for pedaco in _gerar_csv(contar(lotes)):
+            f.write(pedaco)
+    return total
+
+def gerar_exportacao(formato: str, armazenamento: ArmazenamentoNotas = armazenamento_notas, **filtros) -> Iterator[bytes]:
+    """
+    Bytes do arquivo exportado, em blocos, para uma resposta 'chunked'.
+    Valide o formato ANTES de iniciar a resposta (ValueError em formato inválido é levantado aqui, já na chamada).
+    """
+    _validar_formato(formato)
+    if formato == "csv":
+        return _gerar_csv(armazenamento.iterar(**filtros))
+    return _enviar_temporario(formato, armazenamento, filtros)
+
+def _enviar_temporario(formato: str, armazenamento: ArmazenamentoNotas, filtros: Dict[str, Any]) -> Iterator[bytes]:
+    descritor, caminho_temporario = tempfile.mkstemp(suffix=f".{formato}")
+    os.close(descritor)
+    try:
+        total = exportar_para_arquivo(formato, caminho_temporario, armazenamento, **filtros)
+        print(f"Exportação {formato}: {total} notas, {os.path.getsize(caminho_temporario)} bytes.")
+        with open(caminho_temporario, "rb") as f:
+            while True:
+                bloco = f.read(TAMANHO_BLOCO_BYTES)
+                if not bloco:
+                    break
+                yield bloco
+    finally: # Também ao cliente desconectar no meio do download
+        os.remove(caminho_temporario)
+
+def nome_arquivo_exportacao(formato: str) -> str:
+    return f"notas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{formato}"
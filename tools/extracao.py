@@ -2,22 +2,63 @@ import pandas as pd
 from lxml import etree
 import pytesseract
 import cv2  # OpenCV
+import numpy as np
 from langchain.tools import tool
 from PIL import Image
 import os
-import tempfile
-from typing import Optional, Tuple, Dict, Any
+import re
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Tuple, Dict, Any, Callable, Iterator, List
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
 
 # Novas importações
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
+from pdf2image.exceptions import PDFPopplerTimeoutError
 from bs4 import BeautifulSoup
 
 # --- MUDANÇA CRUCIAL: Importando explicitamente do Pydantic v1 ---
 from pydantic.v1 import BaseModel, Field # Era 'from pydantic import BaseModel, Field'
 
+from tools.prazos import MARCADOR_OCR_INTERROMPIDO, PrazoEsgotado, segundos_restantes, verificar_prazo
+
 # --- Configuração (Necessário para Windows) ---
 poppler_path = None # Deixe None se estiver no PATH
 
+# --- Configuração do PDF (via .env) ---
+PDF_DPI = int(os.getenv("NF_PDF_DPI", "200"))
+# Teto de memória para as páginas renderizadas ao mesmo tempo (define o tamanho da janela)
+PDF_MEMORIA_MAX_MB = float(os.getenv("NF_PDF_MEMORIA_MAX_MB", "256"))
+
+# --- Configuração do OCR adaptativo (via .env) ---
+# 'fixo': uma passada na resolução padrão | 'adaptativo': passada rápida + reforço só onde a confiança é baixa
+OCR_MODO = os.getenv("NF_OCR_MODO", "fixo")
+OCR_DPI_RAPIDO = int(os.getenv("NF_OCR_DPI_RAPIDO", "100"))
+OCR_DPI_ALTO = int(os.getenv("NF_OCR_DPI_ALTO", "300"))
+OCR_CONFIANCA_MIN = float(os.getenv("NF_OCR_CONFIANCA_MIN", "80")) # 0-100, escala do tesseract
+OCR_LADO_MAX_RAPIDO = int(os.getenv("NF_OCR_LADO_MAX_RAPIDO", "1600")) # px, imagens maiores são reduzidas na passada rápida
+
+# --- Progresso (usado pelo streaming SSE da API) ---
+# Quem chama a ferramenta (o nó do grafo) registra aqui para onde mandar os eventos.
+callback_progresso: ContextVar[Optional[Callable[[Dict[str, Any]], None]]] = ContextVar("callback_progresso", default=None)
+
+def notificar_progresso(**evento) -> None:
+    """Envia um evento de progresso (ex: página OCR concluída), se alguém estiver ouvindo."""
+    callback = callback_progresso.get()
+    if callback is None:
+        return
+    try:
+        callback(evento)
+    except Exception as e:
+        print(f"Erro ao notificar progresso: {e}")
+
 # --- "MOLDE" DE DADOS EXPANDIDO (v3.0 - Agora usando Pydantic v1) ---
 class DadosNotaFiscal(BaseModel): # <-- Usa o BaseModel do v1
     """
@@ -97,6 +138,109 @@ def extrair_dados_xml(caminho_do_arquivo_xml: str) -> str:
     except Exception as e:
         print(f"Erro ao processar XML: {e}"); return f"Erro ao processar o arquivo XML: {e}"
 
+# --- OCR com prazo (cancelamento cooperativo) ---
+
+def _tempo_limite(etapa: str) -> float:
+    """Segundos restantes para passar ao tesseract/poppler (0 = sem limite). Levanta PrazoEsgotado se já acabou."""
+    verificar_prazo(etapa)
+    restante = segundos_restantes()
+    return 0 if restante is None else restante
+
+def ocr_com_prazo(funcao: Callable, imagem: Any, **kwargs) -> Any:
+    """Chama uma função do pytesseract respeitando o prazo: ao estourar, o processo do tesseract é encerrado."""
+    try:
+        return funcao(imagem, lang='por', timeout=_tempo_limite("OCR"), **kwargs)
+    except RuntimeError as e:
+        if "timeout" in str(e).lower():
+            raise PrazoEsgotado("Prazo esgotado durante o OCR") from e
+        raise
+
+def renderizar_paginas_pdf(caminho_do_arquivo_pdf: str, **kwargs) -> list:
+    """convert_from_path respeitando o prazo (o pdftoppm é encerrado ao estourar)."""
+    try:
+        return convert_from_path(caminho_do_arquivo_pdf, timeout=_tempo_limite("renderização do PDF") or None,
+                                 grayscale=True, poppler_path=poppler_path, **kwargs)
+    except PDFPopplerTimeoutError as e:
+        raise PrazoEsgotado("Prazo esgotado renderizando o PDF") from e
+
+# --- OCR Adaptativo (usa a confiança do tesseract) ---
+
+def _ocr_linhas(imagem: Any, config: str = "") -> list:
+    """
+    Roda o 'image_to_data' e agrupa as palavras por linha.
+    Cada linha: {'bloco', 'texto', 'confianca' (média ponderada pelo tamanho das palavras), 'caixa' (x0, y0, x1, y1)}.
+    """
+    dados = ocr_com_prazo(pytesseract.image_to_data, imagem, config=config, output_type=pytesseract.Output.DICT)
+    linhas: Dict[tuple, dict] = {}
+    for i, palavra in enumerate(dados["text"]):
+        confianca = float(dados["conf"][i])
+        if not palavra.strip() or confianca < 0:
+            continue
+        chave = (dados["block_num"][i], dados["par_num"][i], dados["line_num"][i])
+        x, y, w, h = dados["left"][i], dados["top"][i], dados["width"][i], dados["height"][i]
+        linha = linhas.setdefault(chave, {"bloco": chave[0], "palavras": [], "pesos": 0, "soma_conf": 0.0, "caixa": [x, y, x + w, y + h]})
+        linha["palavras"].append(palavra)
+        linha["pesos"] += len(palavra)
+        linha["soma_conf"] += confianca * len(palavra)
+        caixa = linha["caixa"]
+        linha["caixa"] = [min(caixa[0], x), min(caixa[1], y), max(caixa[2], x + w), max(caixa[3], y + h)]
+    return [
+        {"bloco": l["bloco"], "texto": " ".join(l["palavras"]), "confianca": l["soma_conf"] / l["pesos"], "caixa": l["caixa"]}
+        for _, l in sorted(linhas.items())
+    ]
+
+def _confianca_media(linhas: list) -> float:
+    """Confiança média ponderada pelo tamanho do texto (0 se nada foi lido)."""
+    total = sum(len(l["texto"]) for l in linhas)
+    return sum(l["confianca"] * len(l["texto"]) for l in linhas) / total if total else 0.0
+
+def _texto_das_linhas(linhas: list) -> str:
+    partes, bloco_anterior = [], None
+    for linha in linhas:
+        if bloco_anterior is not None and linha["bloco"] != bloco_anterior:
+            partes.append("")
+        partes.append(linha["texto"])
+        bloco_anterior = linha["bloco"]
+    return "\n".join(partes)
+
+def ocr_adaptativo_imagem(img_cinza: np.ndarray) -> Tuple[str, float]:
+    """
+    1) Passada rápida na imagem reduzida (no máximo OCR_LADO_MAX_RAPIDO px);
+    2) Linhas com confiança baixa são recortadas da imagem ORIGINAL, ampliadas e lidas de novo.
+    Se a maioria das linhas estiver ruim, relê a imagem inteira em resolução cheia.
+    Retorna (texto, confiança média final).
+    """
+    altura, largura = img_cinza.shape[:2]
+    escala = min(1.0, OCR_LADO_MAX_RAPIDO / max(altura, largura))
+    img_rapida = cv2.resize(img_cinza, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA) if escala < 1.0 else img_cinza
+    linhas = _ocr_linhas(img_rapida)
+    ruins = [l for l in linhas if l["confianca"] < OCR_CONFIANCA_MIN]
+    if not ruins and linhas:
+        return _texto_das_linhas(linhas), _confianca_media(linhas)
+
+    if not linhas or len(ruins) > len(linhas) / 2:
+        print(f"OCR adaptativo: {len(ruins)}/{len(linhas)} linhas com baixa confiança, relendo a imagem inteira.")
+        ampliacao = 2.0 if escala == 1.0 else 1.0
+        img_cheia = cv2.resize(img_cinza, None, fx=ampliacao, fy=ampliacao, interpolation=cv2.INTER_CUBIC) if ampliacao > 1 else img_cinza
+        linhas_cheias = _ocr_linhas(img_cheia)
+        if _confianca_media(linhas_cheias) >= _confianca_media(linhas):
+            linhas = linhas_cheias
+        return _texto_das_linhas(linhas), _confianca_media(linhas)
+
+    print(f"OCR adaptativo: relendo {len(ruins)}/{len(linhas)} linhas com baixa confiança.")
+    for linha in ruins:
+        x0, y0, x1, y1 = (int(v / escala) for v in linha["caixa"])
+        margem = max(4, (y1 - y0) // 4)
+        recorte = img_cinza[max(0, y0 - margem):min(altura, y1 + margem), max(0, x0 - margem):min(largura, x1 + margem)]
+        if recorte.size == 0:
+            continue
+        ampliado = cv2.resize(recorte, None, fx=2.0, fy=2.0, interpolation=cv2.INTER_CUBIC)
+        releitura = _ocr_linhas(ampliado, config="--psm 7") # psm 7 = uma única linha de texto
+        if releitura and _confianca_media(releitura) > linha["confianca"]:
+            linha["texto"] = " ".join(l["texto"] for l in releitura)
+            linha["confianca"] = _confianca_media(releitura)
+    return _texto_das_linhas(linhas), _confianca_media(linhas)
+
 @tool
 def extrair_texto_imagem(caminho_do_arquivo_imagem: str) -> str:
     """
@@ -108,12 +252,110 @@ def extrair_texto_imagem(caminho_do_arquivo_imagem: str) -> str:
     try:
         img = cv2.imread(caminho_do_arquivo_imagem)
         img_cinza = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        texto_extraido = pytesseract.image_to_string(img_cinza, lang='por')
+        if OCR_MODO == "adaptativo":
+            texto_extraido, confianca = ocr_adaptativo_imagem(img_cinza)
+            print(f"OCR adaptativo: confiança média {confianca:.1f}")
+        else:
+            texto_extraido = ocr_com_prazo(pytesseract.image_to_string, img_cinza)
+        notificar_progresso(evento="pagina_ocr", pagina=1, total_paginas=1)
         if not texto_extraido: return "Nenhum texto encontrado na imagem."
         print("Texto da imagem extraído com sucesso!"); return texto_extraido
+    except PrazoEsgotado as e:
+        print(f"OCR da imagem interrompido: {e}"); return f"Erro: {e}. {MARCADOR_OCR_INTERROMPIDO}"
     except Exception as e:
         print(f"Erro ao processar imagem: {e}"); return f"Erro ao processar o arquivo de imagem: {e}."
 
+# --- Leitura de PDF em janelas de páginas (memória constante) ---
+
+def _tamanhos_paginas(caminho_do_arquivo_pdf: str) -> List[Tuple[float, float]]:
+    """(largura, altura) em pontos de CADA página: uma capa pequena não define o tamanho das outras."""
+    prazo = _tempo_limite("leitura do PDF") or None
+    info = pdfinfo_from_path(caminho_do_arquivo_pdf, poppler_path=poppler_path, timeout=prazo)
+    total_paginas = int(info["Pages"])
+    if total_paginas > 1: # Com -f/-l o pdfinfo lista 'Page    N size: L x A pts' de cada página
+        info = pdfinfo_from_path(caminho_do_arquivo_pdf, poppler_path=poppler_path, timeout=prazo,
+                                 first_page=1, last_page=total_paginas)
+    padrao = re.search(r"([\d.]+) x ([\d.]+)", str(info.get("Page size", "")))
+    padrao = (float(padrao.group(1)), float(padrao.group(2))) if padrao else (595.0, 842.0) # A4
+    tamanhos = [padrao] * total_paginas
+    for chave, valor in info.items():
+        pagina = re.fullmatch(r"Page\s+(\d+) size", chave)
+        tamanho = re.search(r"([\d.]+) x ([\d.]+)", str(valor))
+        if pagina and tamanho and 1 <= int(pagina.group(1)) <= total_paginas:
+            tamanhos[int(pagina.group(1)) - 1] = (float(tamanho.group(1)), float(tamanho.group(2)))
+    return tamanhos
+
+def _janelas_paginas(tamanhos_pts: List[Tuple[float, float]], dpi: int, memoria_max_mb: float) -> List[Tuple[int, int]]:
+    """
+    Divide as páginas em janelas (primeira, última) cuja soma cabe em 'memoria_max_mb'.
+    Estima cada página renderizada em tons de cinza (1 byte/pixel) com folga de 3x
+    (imagem PIL + cópia do tesseract + buffers). Uma página maior que o teto fica sozinha.
+    """
+    limite = memoria_max_mb * 1024 * 1024
+    janelas, primeira, acumulado = [], 1, 0.0
+    for numero_pagina, (largura_pts, altura_pts) in enumerate(tamanhos_pts, start=1):
+        bytes_pagina = (largura_pts / 72 * dpi) * (altura_pts / 72 * dpi) * 3
+        if numero_pagina > primeira and acumulado + bytes_pagina > limite:
+            janelas.append((primeira, numero_pagina - 1))
+            primeira, acumulado = numero_pagina, 0.0
+        acumulado += bytes_pagina
+    if tamanhos_pts:
+        janelas.append((primeira, len(tamanhos_pts)))
+    return janelas
+
+def iterar_paginas_pdf(caminho_do_arquivo_pdf: str, dpi: int = PDF_DPI,
+                       memoria_max_mb: float = PDF_MEMORIA_MAX_MB) -> Iterator[Tuple[int, int, Image.Image]]:
+    """
+    Gera (número da página, total de páginas, imagem em tons de cinza), renderizando
+    só uma janela de páginas por vez com 'first_page'/'last_page' do pdf2image.
+    """
+    tamanhos = _tamanhos_paginas(caminho_do_arquivo_pdf)
+    total_paginas = len(tamanhos)
+    for primeira, ultima in _janelas_paginas(tamanhos, dpi, memoria_max_mb):
+        imagens = renderizar_paginas_pdf(caminho_do_arquivo_pdf, dpi=dpi, first_page=primeira, last_page=ultima)
+        numero_pagina = primeira
+        while imagens:
+            imagem = imagens.pop(0) # Solta a referência: a página é liberada assim que o OCR termina
+            yield numero_pagina, total_paginas, imagem
+            imagem.close()
+            numero_pagina += 1
+
+def _ocr_pagina_alta_resolucao(caminho_do_arquivo_pdf: str, numero_pagina: int) -> list:
+    """Renderiza de novo UMA página em OCR_DPI_ALTO e retorna as linhas lidas."""
+    imagens = renderizar_paginas_pdf(caminho_do_arquivo_pdf, dpi=OCR_DPI_ALTO, first_page=numero_pagina, last_page=numero_pagina)
+    try:
+        return _ocr_linhas(imagens[0])
+    finally:
+        for imagem in imagens: imagem.close()
+
+def extrair_texto_pdf_por_pagina(caminho_do_arquivo_pdf: str, dpi: int = PDF_DPI,
+                                 memoria_max_mb: float = PDF_MEMORIA_MAX_MB,
+                                 modo: str = OCR_MODO) -> Iterator[Tuple[int, int, str]]:
+    """
+    Gera (número da página, total de páginas, texto OCR da página), uma página por vez.
+    No modo 'adaptativo', todas as páginas passam primeiro em OCR_DPI_RAPIDO e só as de
+    confiança abaixo de OCR_CONFIANCA_MIN são renderizadas de novo em OCR_DPI_ALTO.
+    """
+    if modo != "adaptativo":
+        for numero_pagina, total_paginas, imagem in iterar_paginas_pdf(caminho_do_arquivo_pdf, dpi, memoria_max_mb):
+            texto_pagina = ocr_com_prazo(pytesseract.image_to_string, imagem)
+            yield numero_pagina, total_paginas, texto_pagina
+        return
+
+    paginas_relidas = 0
+    for numero_pagina, total_paginas, imagem in iterar_paginas_pdf(caminho_do_arquivo_pdf, OCR_DPI_RAPIDO, memoria_max_mb):
+        linhas = _ocr_linhas(imagem)
+        confianca = _confianca_media(linhas)
+        if confianca < OCR_CONFIANCA_MIN:
+            print(f"OCR adaptativo: página {numero_pagina} com confiança {confianca:.1f}, relendo em {OCR_DPI_ALTO} DPI...")
+            linhas_alta = _ocr_pagina_alta_resolucao(caminho_do_arquivo_pdf, numero_pagina)
+            if _confianca_media(linhas_alta) >= confianca:
+                linhas = linhas_alta
+            paginas_relidas += 1
+        yield numero_pagina, total_paginas, _texto_das_linhas(linhas)
+        if numero_pagina == total_paginas:
+            print(f"OCR adaptativo: {paginas_relidas}/{total_paginas} páginas precisaram de alta resolução.")
+
 @tool
 def extrair_texto_pdf(caminho_do_arquivo_pdf: str) -> str:
     """
@@ -122,22 +364,23 @@ def extrair_texto_pdf(caminho_do_arquivo_pdf: str) -> str:
     Recebe o CAMINHO para o arquivo .pdf e retorna uma string única com todo o texto.
     """
     print(f"--- Usando Ferramenta de Extração de PDF (OCR) ---")
-    with tempfile.TemporaryDirectory() as path_temporario:
+    try:
+        partes_texto = []
         try:
-            imagens_pdf = convert_from_path(caminho_do_arquivo_pdf, poppler_path=poppler_path)
-            texto_completo = ""
-            for i, imagem in enumerate(imagens_pdf):
-                print(f"Processando página {i+1} do PDF...")
-                caminho_img_temp = os.path.join(path_temporario, f"pagina_{i}.png")
-                imagem.save(caminho_img_temp, "PNG")
-                img_cv = cv2.imread(caminho_img_temp)
-                img_cinza = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-                texto_pagina = pytesseract.image_to_string(img_cinza, lang='por')
-                texto_completo += f"\n--- Página {i+1} ---\n" + texto_pagina
-            if not texto_completo: return "Nenhum texto encontrado no PDF."
-            print("Texto do PDF extraído com sucesso!"); return texto_completo
-        except Exception as e:
-            print(f"Erro ao processar PDF: {e}"); return f"Erro ao processar o arquivo PDF: {e}."
+            for numero_pagina, total_paginas, texto_pagina in extrair_texto_pdf_por_pagina(caminho_do_arquivo_pdf):
+                print(f"Processando página {numero_pagina}/{total_paginas} do PDF...")
+                partes_texto.append(f"\n--- Página {numero_pagina} ---\n" + texto_pagina)
+                notificar_progresso(evento="pagina_ocr", pagina=numero_pagina, total_paginas=total_paginas)
+        except PrazoEsgotado as e:
+            # Resultado parcial: as páginas já lidas seguem para o agente
+            print(f"OCR do PDF interrompido após {len(partes_texto)} página(s): {e}")
+            if not partes_texto: return f"Erro: {e}. {MARCADOR_OCR_INTERROMPIDO}"
+            partes_texto.append(f"\n{MARCADOR_OCR_INTERROMPIDO} Páginas lidas: {len(partes_texto)}.")
+        texto_completo = "".join(partes_texto)
+        if not texto_completo: return "Nenhum texto encontrado no PDF."
+        print("Texto do PDF extraído com sucesso!"); return texto_completo
+    except Exception as e:
+        print(f"Erro ao processar PDF: {e}"); return f"Erro ao processar o arquivo PDF: {e}."
 
 @tool
 def extrair_texto_html(caminho_do_arquivo_html: str) -> str:
@@ -198,16 +441,7 @@ def salvar_dados_em_excel(dados_nota: DadosNotaFiscal) -> Tuple[str, Optional[Di
         dados_dict = dados_nota.dict() # <-- Usa .dict() para Pydantic v1
         df = pd.DataFrame([dados_dict])
         
-        numero_nota = dados_dict.get('numero_nf')
-        
-        if numero_nota:
-            numero_limpo = str(numero_nota).replace(' ', '_').replace('/', '-').replace('.', '')
-        else:
-            numero_limpo = "sem_numero"
-        
-        nome_arquivo = f"NotaFiscal_{numero_limpo}.xlsx"
-        
-        caminho_completo = os.path.join(output_dir, nome_arquivo)
+        caminho_completo = _caminho_arquivo_nota(output_dir, dados_dict)
         
         df.to_excel(caminho_completo, index=False)
         
@@ -217,6 +451,67 @@ def salvar_dados_em_excel(dados_nota: DadosNotaFiscal) -> Tuple[str, Optional[Di
     except Exception as e:
         print(f"Erro ao salvar arquivo Excel: {e}"); return f"Erro ao salvar: {e}", dados_dict
 
+def _caminho_arquivo_nota(output_dir: str, dados_dict: Dict[str, Any]) -> str:
+    """
+    Nome do Excel do modo único, sem sobrescrever notas diferentes:
+    - 'NotaFiscal_<número>.xlsx' (a mesma nota reprocessada substitui o próprio arquivo);
+    - mesmo número de OUTRO emitente: 'NotaFiscal_<número>_<cnpj emitente>.xlsx';
+    - sem número: 'NotaFiscal_sem_numero_<data-hora>_<id>.xlsx' (sempre um arquivo novo).
+    """
+    numero_nota = dados_dict.get('numero_nf')
+    if not numero_nota:
+        return os.path.join(output_dir, f"NotaFiscal_sem_numero_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.xlsx")
+
+    numero_limpo = str(numero_nota).replace(' ', '_').replace('/', '-').replace('.', '')
+    caminho = os.path.join(output_dir, f"NotaFiscal_{numero_limpo}.xlsx")
+    emitente = re.sub(r"[^0-9A-Za-z]", "", str(dados_dict.get('cnpj_emitente') or ""))
+    if not os.path.exists(caminho):
+        return caminho
+    try: # Planilha de uma linha só: leitura rápida
+        emitente_existente = pd.read_excel(caminho, dtype=str, usecols=["cnpj_emitente"])["cnpj_emitente"].iloc[0]
+        emitente_existente = re.sub(r"[^0-9A-Za-z]", "", str(emitente_existente if pd.notna(emitente_existente) else ""))
+    except Exception:
+        emitente_existente = None
+    if emitente_existente == emitente:
+        return caminho
+    sufixo = emitente or uuid.uuid4().hex[:8]
+    return os.path.join(output_dir, f"NotaFiscal_{numero_limpo}_{sufixo}.xlsx")
+
+# --- Trava do arquivo mestre (modo compilado) ---
+# Threads da API/Streamlit, processos worker e máquinas que compartilham dados_saida
+# fazem ler-somar-gravar no mesmo COMPILADO_MESTRE.xlsx: sem trava, linhas se perdem.
+# A trava de arquivo (lockf num '.lock' ao lado) vale entre processos e, via NFS, entre máquinas;
+# ela é por processo, então as threads do mesmo processo se enfileiram antes no threading.Lock.
+_trava_mestre = threading.Lock()
+
+@contextmanager
+def trava_arquivo(caminho_trava: str) -> Iterator[None]:
+    with _trava_mestre, open(caminho_trava, "a+b") as f:
+        if fcntl is not None:
+            fcntl.lockf(f, fcntl.LOCK_EX)
+        else: # Windows
+            f.seek(0)
+            while True:
+                try: msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1); break
+                except OSError: time.sleep(0.05) # LK_LOCK desiste depois de ~10s
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.lockf(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0); msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _gravar_excel_atomico(df: pd.DataFrame, caminho: str) -> None:
+    """Grava num temporário na mesma pasta e troca de uma vez: quem lê nunca vê a planilha pela metade."""
+    pasta, nome = os.path.split(caminho)
+    temporario = os.path.join(pasta, f".{uuid.uuid4().hex}_{nome}") # Mantém o '.xlsx' (o pandas escolhe o motor pela extensão)
+    try:
+        df.to_excel(temporario, index=False)
+        os.replace(temporario, caminho)
+    finally:
+        if os.path.exists(temporario): os.remove(temporario)
+
 # --- RETORNA TUPLA (v3.7) E USA PYDANTIC v1 ---
 def acumular_dados_em_excel(dados_nota: DadosNotaFiscal) -> Tuple[str, Optional[Dict[str, Any]]]:
     """
@@ -233,22 +528,24 @@ def acumular_dados_em_excel(dados_nota: DadosNotaFiscal) -> Tuple[str, Optional[
         dados_dict = dados_nota.dict() # <-- Usa .dict() para Pydantic v1
         novo_df = pd.DataFrame([dados_dict])
         
-        if os.path.exists(caminho_arquivo_mestre):
-            print("Arquivo mestre encontrado. Lendo dados existentes...")
-            df_existente = pd.read_excel(caminho_arquivo_mestre)
-            colunas_todas = set(df_existente.columns) | set(novo_df.columns)
-            df_existente = df_existente.reindex(columns=colunas_todas)
-            novo_df = novo_df.reindex(columns=colunas_todas)
-            
-            df_combinado = pd.concat([df_existente, novo_df], ignore_index=True)
-            df_combinado.to_excel(caminho_arquivo_mestre, index=False)
-            print("Dados adicionados ao arquivo mestre com sucesso.")
-        else:
-            print("Arquivo mestre não encontrado. Criando novo arquivo...")
-            novo_df.to_excel(caminho_arquivo_mestre, index=False)
-            print("Novo arquivo mestre criado com sucesso.")
+        # Ler, somar e gravar com a trava: um salvamento por vez, em qualquer processo
+        with trava_arquivo(caminho_arquivo_mestre + ".lock"):
+            if os.path.exists(caminho_arquivo_mestre):
+                print("Arquivo mestre encontrado. Lendo dados existentes...")
+                df_existente = pd.read_excel(caminho_arquivo_mestre)
+                colunas_todas = list(df_existente.columns) + [c for c in novo_df.columns if c not in df_existente.columns]
+                df_existente = df_existente.reindex(columns=colunas_todas)
+                novo_df = novo_df.reindex(columns=colunas_todas)
+                
+                df_combinado = pd.concat([df_existente, novo_df], ignore_index=True)
+                _gravar_excel_atomico(df_combinado, caminho_arquivo_mestre)
+                print("Dados adicionados ao arquivo mestre com sucesso.")
+            else:
+                print("Arquivo mestre não encontrado. Criando novo arquivo...")
+                _gravar_excel_atomico(novo_df, caminho_arquivo_mestre)
+                print("Novo arquivo mestre criado com sucesso.")
             
         return caminho_arquivo_mestre, dados_dict
         
     except Exception as e:
-        print(f"Erro ao acumular dados no Excel: {e}"); return f"Erro ao acumular: {e}", dados_dict
\ No newline at end of file
+        print(f"Erro ao acumular dados no Excel: {e}"); return f"Erro ao acumular: {e}", dados_dict
@@ -0,0 +1,202 @@
+"""
+Motor de LAYOUTS conhecidos (OCR só nas regiões de interesse).
+
+Para prefeituras com PDF de layout fixo (ex: NFS-e de São Paulo):
+1. Renderiza uma miniatura da 1ª página e lê só a região do cabeçalho;
+2. Se as âncoras de algum layout registrado aparecerem, renderiza a página em
+   alta resolução e faz OCR APENAS nas caixas dos campos;
+3. Monta o DadosNotaFiscal direto, sem passar o texto da página inteira ao LLM.
+Layouts desconhecidos (ou com campos obrigatórios vazios/inválidos) retornam None e seguem o fluxo normal.
+
+As caixas são frações (x0, y0, x1, y1) da MOLDURA da nota (o maior retângulo da
+página), não da folha: assim margens e escalas diferentes de impressão não importam.
+"""
+import os
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import pytesseract
+from pydantic.v1 import BaseModel, Field
+
+from tools.extracao import DadosNotaFiscal, renderizar_paginas_pdf, ocr_com_prazo
+from tools.validacao import validar_dados
+
+# --- Configuração (via .env) ---
+# Desligado por padrão: custa uma renderização + OCR do cabeçalho em todo PDF, e as caixas do
+# layout de São Paulo foram conferidas só com uma nota sintética (test_layouts.py), não com PDFs reais
+LAYOUTS_ATIVOS = os.getenv("NF_LAYOUTS_ATIVOS", "0") == "1"
+LAYOUT_DPI_MINIATURA = int(os.getenv("NF_LAYOUT_DPI_MINIATURA", "100"))
+LAYOUT_DPI_CAMPOS = int(os.getenv("NF_LAYOUT_DPI_CAMPOS", "300"))
+LAYOUT_MIN_ANCORAS = 0.8 # Fração mínima das palavras de cada âncora encontradas no cabeçalho
+
+Caixa = Tuple[float, float, float, float]
+
+
+class CampoLayout(BaseModel):
+    """Região de um campo de DadosNotaFiscal dentro da moldura da nota."""
+    caixa: Caixa = Field(description="(x0, y0, x1, y1) em frações da moldura")
+    tipo: str = Field("texto", description="texto | numero | codigo | documento | data | valor")
+
+
+class LayoutNF(BaseModel):
+    nome: str
+    ancoras: List[str] = Field(description="Textos que identificam o layout no cabeçalho")
+    regiao_ancoras: Caixa = Field(description="Região do cabeçalho lida na miniatura")
+    campos: Dict[str, CampoLayout]
+    obrigatorios: List[str] = Field(description="Sem estes campos o resultado é descartado (volta ao fluxo do LLM)")
+
+
+# --- Layouts Registrados ---
+LAYOUT_NFSE_SAO_PAULO = LayoutNF(
+    nome="nfse_sao_paulo",
+    ancoras=["PREFEITURA DO MUNICIPIO DE SAO PAULO", "NOTA FISCAL ELETRONICA DE SERVICOS"],
+    regiao_ancoras=(0.15, 0.0, 0.80, 0.11),
+    campos={
+        "numero_nf": CampoLayout(caixa=(0.78, 0.015, 1.0, 0.043), tipo="numero"),
+        "data_emissao": CampoLayout(caixa=(0.78, 0.050, 1.0, 0.077), tipo="data"),
+        "chave_acesso": CampoLayout(caixa=(0.78, 0.085, 1.0, 0.112), tipo="codigo"),
+        "cnpj_emitente": CampoLayout(caixa=(0.12, 0.129, 0.58, 0.151), tipo="documento"),
+        "nome_emitente": CampoLayout(caixa=(0.12, 0.149, 1.0, 0.170)),
+        "endereco_emitente": CampoLayout(caixa=(0.12, 0.167, 1.0, 0.203)),
+        "municipio_emitente": CampoLayout(caixa=(0.12, 0.200, 0.72, 0.221)),
+        "nome_destinatario": CampoLayout(caixa=(0.0, 0.243, 0.58, 0.264)),
+        "cnpj_cpf_destinatario": CampoLayout(caixa=(0.0, 0.261, 0.44, 0.282), tipo="documento"),
+        "endereco_destinatario": CampoLayout(caixa=(0.0, 0.279, 0.86, 0.300)),
+        "municipio_destinatario": CampoLayout(caixa=(0.0, 0.297, 0.48, 0.318)),
+        "discriminacao_servicos": CampoLayout(caixa=(0.0, 0.382, 1.0, 0.742)),
+        "valor_total": CampoLayout(caixa=(0.27, 0.746, 0.73, 0.770), tipo="valor"),
+        "base_calculo": CampoLayout(caixa=(0.21, 0.847, 0.41, 0.871), tipo="valor"),
+        "valor_iss": CampoLayout(caixa=(0.59, 0.847, 0.80, 0.871), tipo="valor"),
+    },
+    obrigatorios=["numero_nf", "cnpj_emitente", "valor_total"],
+)
+
+REGISTRO_LAYOUTS: List[LayoutNF] = [LAYOUT_NFSE_SAO_PAULO]
+
+def registrar_layout(layout: LayoutNF) -> None:
+    """Adiciona um layout ao registro (ex: outro município)."""
+    REGISTRO_LAYOUTS.append(layout)
+
+
+# --- Funções de Apoio ---
+def _normalizar(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", texto.upper())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r"[^A-Z0-9]+", " ", texto).strip()
+
+def _renderizar_primeira_pagina(caminho_do_arquivo_pdf: str, dpi: int) -> np.ndarray:
+    imagens = renderizar_paginas_pdf(caminho_do_arquivo_pdf, dpi=dpi, first_page=1, last_page=1)
+    try:
+        return np.array(imagens[0])
+    finally:
+        for imagem in imagens: imagem.close()
+
+def _localizar_moldura(img_cinza: np.ndarray) -> Tuple[int, int, int, int]:
+    """Retorna (x0, y0, x1, y1) do maior retângulo da página; a página inteira se não houver moldura."""
+    altura, largura = img_cinza.shape[:2]
+    _, binaria = cv2.threshold(img_cinza, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    contornos, _ = cv2.findContours(binaria, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if contornos:
+        x, y, w, h = cv2.boundingRect(max(contornos, key=cv2.contourArea))
+        if w * h >= 0.3 * largura * altura:
+            return x, y, x + w, y + h
+    return 0, 0, largura, altura
+
+def _recortar(img_cinza: np.ndarray, moldura: Tuple[int, int, int, int], caixa: Caixa) -> np.ndarray:
+    mx0, my0, mx1, my1 = moldura
+    largura, altura = mx1 - mx0, my1 - my0
+    x0, y0 = mx0 + int(caixa[0] * largura), my0 + int(caixa[1] * altura)
+    x1, y1 = mx0 + int(caixa[2] * largura), my0 + int(caixa[3] * altura)
+    return img_cinza[y0:y1, x0:x1]
+
+def _sem_rotulo(texto: str) -> str:
+    """'Nome/Razão Social: FULANO' -> 'FULANO' (remove só o primeiro rótulo)."""
+    texto = re.sub(r"\s+", " ", texto).strip()
+    partes = texto.split(":", 1)
+    if len(partes) == 2 and len(partes[0]) <= 25:
+        texto = partes[1].strip()
+    return texto
+
+_VAZIOS = {"", "-", "--", "---", "----", "-----", "NAO INFORMADO"}
+
+def converter_campo(texto: str, tipo: str):
+    """Limpa o texto lido numa caixa conforme o tipo do campo. Retorna None se não houver valor."""
+    if tipo == "texto":
+        limpo = _sem_rotulo(texto)
+        return None if _normalizar(limpo) in _VAZIOS or limpo in _VAZIOS else limpo
+    if tipo == "numero":
+        achado = re.search(r"\d{3,}", texto.replace(".", "").replace(" ", ""))
+        return achado.group(0) if achado else None
+    if tipo == "codigo":
+        achado = re.search(r"[A-Z0-9]{4}-[A-Z0-9]{4}", texto.upper().replace(" ", ""))
+        return achado.group(0) if achado else None
+    if tipo == "documento":
+        achado = re.search(r"\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}|\d{3}\.?\d{3}\.?\d{3}-?\d{2}", texto.replace(" ", ""))
+        return achado.group(0) if achado else None
+    if tipo == "data":
+        achado = re.search(r"\d{2}/\d{2}/\d{4}(?:\s+\d{2}:\d{2}(?::\d{2})?)?", texto)
+        return achado.group(0) if achado else None
+    if tipo == "valor":
+        valores = re.findall(r"\d{1,3}(?:\.\d{3})*,\d{2}", texto)
+        return float(valores[-1].replace(".", "").replace(",", ".")) if valores else None
+    raise ValueError(f"Tipo de campo desconhecido: {tipo}")
+
+
+# --- Identificação e Extração ---
+def identificar_layout(caminho_do_arquivo_pdf: str) -> Optional[LayoutNF]:
+    """Lê só o cabeçalho de uma miniatura da 1ª página e compara com as âncoras registradas."""
+    miniatura = _renderizar_primeira_pagina(caminho_do_arquivo_pdf, LAYOUT_DPI_MINIATURA)
+    moldura = _localizar_moldura(miniatura)
+    textos_lidos: Dict[Caixa, set] = {}
+    for layout in REGISTRO_LAYOUTS:
+        if layout.regiao_ancoras not in textos_lidos: # Layouts com a mesma região reaproveitam o OCR
+            recorte = _recortar(miniatura, moldura, layout.regiao_ancoras)
+            textos_lidos[layout.regiao_ancoras] = set(_normalizar(ocr_com_prazo(pytesseract.image_to_string, recorte)).split())
+        palavras_cabecalho = textos_lidos[layout.regiao_ancoras]
+        if all(
+            len(set(ancora.split()) & palavras_cabecalho) >= LAYOUT_MIN_ANCORAS * len(ancora.split())
+            for ancora in layout.ancoras
+        ):
+            return layout
+    return None
+
+def extrair_com_layout(caminho_do_arquivo_pdf: str, layout: LayoutNF) -> Optional[DadosNotaFiscal]:
+    """OCR apenas nas caixas dos campos do layout. Retorna None se faltar campo obrigatório ou a validação reprovar."""
+    pagina = _renderizar_primeira_pagina(caminho_do_arquivo_pdf, LAYOUT_DPI_CAMPOS)
+    moldura = _localizar_moldura(pagina)
+    dados = {}
+    for nome_campo, campo in layout.campos.items():
+        recorte = _recortar(pagina, moldura, campo.caixa)
+        if recorte.size == 0:
+            continue
+        texto = ocr_com_prazo(pytesseract.image_to_string, recorte, config="--psm 6") # psm 6 = bloco de texto
+        dados[nome_campo] = converter_campo(texto, campo.tipo)
+    faltando = [nome for nome in layout.obrigatorios if not dados.get(nome)]
+    if faltando:
+        print(f"Layout '{layout.nome}': campos obrigatórios não lidos {faltando}, voltando ao fluxo normal.")
+        return None
+    resultado = DadosNotaFiscal(**dados)
+    erros = validar_dados(resultado) # Caixa deslocada ou OCR ruim: melhor o fluxo completo do que salvar errado
+    if erros:
+        print(f"Layout '{layout.nome}': validação reprovou {erros}, voltando ao fluxo normal.")
+        return None
+    return resultado
+
+def extrair_por_layout(caminho_do_arquivo_pdf: str) -> Optional[Tuple[str, DadosNotaFiscal]]:
+    """Tenta o caminho rápido por layout. Retorna (nome do layout, dados) ou None."""
+    if not LAYOUTS_ATIVOS or not caminho_do_arquivo_pdf.lower().endswith(".pdf"):
+        return None
+    print(f"--- Verificando layouts conhecidos ---")
+    try:
+        layout = identificar_layout(caminho_do_arquivo_pdf)
+        if layout is None:
+            print("Nenhum layout conhecido reconhecido.")
+            return None
+        print(f"Layout reconhecido: {layout.nome}")
+        dados = extrair_com_layout(caminho_do_arquivo_pdf, layout)
+        return (layout.nome, dados) if dados is not None else None
+    except Exception as e:
+        print(f"Erro ao aplicar layout: {e}"); return None
@@ -0,0 +1,61 @@
+"""
+PRAZOS por documento (orçamento de latência).
+
+- Total: tempo máximo do documento inteiro no grafo (o agente encerra com o que tiver);
+- OCR: tempo máximo de uma extração (o tesseract/poppler é encerrado e o texto lido até ali é usado);
+- LLM: tempo máximo de uma chamada ao modelo (incluindo as novas tentativas).
+
+O prazo vale para a thread/tarefa atual via ContextVar: o nó do grafo abre um
+'prazo_etapa(...)' e as ferramentas só consultam 'segundos_restantes()'.
+"""
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+# --- Configuração (via .env) ---
+PRAZO_TOTAL_SEGUNDOS = float(os.getenv("NF_PRAZO_TOTAL_SEGUNDOS", "120"))
+PRAZO_OCR_SEGUNDOS = float(os.getenv("NF_PRAZO_OCR_SEGUNDOS", "60"))
+PRAZO_LLM_SEGUNDOS = float(os.getenv("NF_PRAZO_LLM_SEGUNDOS", "30"))
+# Passos máximos do grafo (recursion_limit): corta loops agente <-> ferramentas
+LIMITE_PASSOS_GRAFO = int(os.getenv("NF_LIMITE_PASSOS_GRAFO", "15"))
+
+MARCADOR_OCR_INTERROMPIDO = "[OCR interrompido: prazo esgotado]"
+
+# Instante (time.time()) em que a etapa atual deve parar. None = sem prazo.
+_prazo_atual: ContextVar[Optional[float]] = ContextVar("prazo_atual", default=None)
+
+
+class PrazoEsgotado(TimeoutError):
+    """O orçamento de tempo da etapa (ou do documento) acabou."""
+
+
+def segundos_restantes() -> Optional[float]:
+    """Quanto falta para o prazo da etapa atual (pode ser negativo). None se não houver prazo."""
+    prazo = _prazo_atual.get()
+    return None if prazo is None else prazo - time.time()
+
+def verificar_prazo(etapa: str) -> None:
+    """Ponto de cancelamento cooperativo: levanta PrazoEsgotado se o prazo já passou."""
+    restante = segundos_restantes()
+    if restante is not None and restante <= 0:
+        raise PrazoEsgotado(f"Prazo esgotado na etapa: {etapa}")
+
+def prazo_expirado(prazo_final: Optional[float]) -> bool:
+    return prazo_final is not None and time.time() >= prazo_final
+
+@contextmanager
+def prazo_etapa(segundos: Optional[float], prazo_final: Optional[float] = None) -> Iterator[None]:
+    """
+    Define o prazo da etapa: o menor entre 'agora + segundos', o prazo final do
+    documento e um prazo já ativo (etapas aninhadas nunca ganham mais tempo).
+    """
+    candidatos = [p for p in (_prazo_atual.get(), prazo_final) if p is not None]
+    if segundos is not None:
+        candidatos.append(time.time() + segundos)
+    token = _prazo_atual.set(min(candidatos) if candidatos else None)
+    try:
+        yield
+    finally:
+        _prazo_atual.reset(token)
@@ -0,0 +1,176 @@
+"""
+VALIDADOR rápido dos dados extraídos (sem LLM, sem I/O).
+
+Verifica o que dá para conferir só com aritmética:
+- CNPJ/CPF: dígitos verificadores (inclui o CNPJ alfanumérico);
+- Chave de acesso da NF-e (44 dígitos): DV módulo 11 e CNPJ embutido;
+- Data de emissão: formato brasileiro ou ISO (XML) e data plausível;
+- Impostos: ISS/ICMS não maiores que a base, alíquota do ISS entre 2% e 5%.
+
+Retorna {campo: motivo}. Vazio = tudo certo (campos nulos não são erro).
+"""
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from tools.extracao import DadosNotaFiscal
+
+# --- Configuração ---
+ALIQUOTA_ISS_MIN = 0.02 # LC 116/2003 e EC 37/2002
+ALIQUOTA_ISS_MAX = 0.05
+TOLERANCIA_CENTAVOS = 0.02 # Arredondamentos da prefeitura
+DATA_MINIMA = datetime(2000, 1, 1)
+
+_FORMATOS_DATA = [
+    "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y",
+    "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d",
+]
+
+
+# --- Documentos ---
+def _valor_caractere(c: str) -> int:
+    # CNPJ alfanumérico (IN RFB 2.229/2024): valor = código ASCII - 48 ('0'=0 ... 'A'=17)
+    return ord(c) - 48
+
+def _dv_modulo_11(base: str, pesos) -> int:
+    resto = sum(_valor_caractere(c) * p for c, p in zip(base, pesos)) % 11
+    return 0 if resto < 2 else 11 - resto
+
+def _limpar_documento(valor: str) -> str:
+    return re.sub(r"[^0-9A-Z]", "", valor.upper())
+
+def cnpj_valido(valor: str) -> bool:
+    cnpj = _limpar_documento(valor)
+    if not re.fullmatch(r"[0-9A-Z]{12}\d{2}", cnpj) or len(set(cnpj)) == 1:
+        return False
+    dv1 = _dv_modulo_11(cnpj[:12], [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+    dv2 = _dv_modulo_11(cnpj[:12] + str(dv1), [6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+    return cnpj[12:] == f"{dv1}{dv2}"
+
+def cpf_valido(valor: str) -> bool:
+    cpf = re.sub(r"\D", "", valor)
+    if len(cpf) != 11 or len(set(cpf)) == 1:
+        return False
+    for tamanho in (9, 10):
+        soma = sum(int(cpf[i]) * (tamanho + 1 - i) for i in range(tamanho))
+        if (soma * 10 % 11) % 10 != int(cpf[tamanho]):
+            return False
+    return True
+
+def validar_documento(valor: str) -> Optional[str]:
+    """CNPJ ou CPF. Retorna o motivo da falha ou None. CPF mascarado (***.123.456-**) não é verificável."""
+    if "*" in valor:
+        return None
+    documento = _limpar_documento(valor)
+    if len(documento) == 14:
+        return None if cnpj_valido(documento) else "CNPJ com dígitos verificadores inválidos"
+    if len(documento) == 11 and documento.isdigit():
+        return None if cpf_valido(documento) else "CPF com dígitos verificadores inválidos"
+    return f"documento com {len(documento)} caracteres (esperado CNPJ com 14 ou CPF com 11)"
+
+def validar_chave_acesso(valor: str) -> Optional[str]:
+    """
+    Só a chave da NF-e/NFC-e (somente dígitos) é verificável; o Código de
+    Verificação da NFS-e (ex: 'AB1C-2D3E') tem formato livre de cada prefeitura.
+    """
+    if re.search(r"[A-Za-z]", valor):
+        return None
+    chave = re.sub(r"\D", "", valor)
+    if len(chave) < 40: # Código de verificação numérico curto
+        return None
+    if len(chave) != 44:
+        return f"chave de acesso com {len(chave)} dígitos (esperado 44)"
+    # DV: pesos 2..9 da direita para a esquerda sobre os 43 primeiros dígitos
+    pesos = [2 + (i % 8) for i in range(43)][::-1]
+    if _dv_modulo_11(chave[:43], pesos) != int(chave[43]):
+        return "dígito verificador da chave de acesso inválido"
+    return None
+
+
+# --- Datas ---
+def interpretar_data(valor: str) -> Optional[datetime]:
+    """'20/09/2025 19:51:09', '2025-09-20T19:51:09-03:00', ... -> datetime (sem fuso). None se não reconhecer."""
+    texto = re.sub(r"\s+", " ", valor.strip())
+    texto = re.sub(r"(T\d{2}:\d{2}:\d{2})(\.\d+)?([+-]\d{2}:?\d{2}|Z)?$", r"\1", texto) # Remove fuso/frações do XML
+    for formato in _FORMATOS_DATA:
+        try:
+            return datetime.strptime(texto, formato)
+        except ValueError:
+            continue
+    return None
+
+def validar_data(valor: str) -> Optional[str]:
+    data = interpretar_data(valor)
+    if data is None:
+        return "data em formato não reconhecido"
+    if data < DATA_MINIMA or data > datetime.now() + timedelta(days=1):
+        return f"data fora do intervalo plausível ({data:%d/%m/%Y})"
+    return None
+
+
+# --- Valores ---
+def interpretar_valor(valor: Any) -> Optional[float]:
+    """'R$ 1.234,56', '138,95', '1234.56' (planilha lida como texto), 138.95 -> float. None se não reconhecer."""
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    texto = re.sub(r"[^\d.,-]", "", str(valor))
+    if "," in texto and "." in texto: # O último separador é o decimal
+        milhar = "." if texto.rfind(",") > texto.rfind(".") else ","
+        texto = texto.replace(milhar, "")
+    elif texto.count(".") > 1: # '1.234.567': só milhar
+        texto = texto.replace(".", "")
+    texto = texto.replace(",", ".")
+    try:
+        return float(texto)
+    except ValueError:
+        return None
+
+
+# --- Validação Completa ---
+def validar_dados(dados: DadosNotaFiscal) -> Dict[str, str]:
+    """Retorna {campo: motivo} para cada campo reprovado. Cruzamentos reprovam os dois campos envolvidos."""
+    erros: Dict[str, str] = {}
+
+    for campo in ("cnpj_emitente", "cnpj_cpf_destinatario"):
+        valor = getattr(dados, campo)
+        if valor:
+            motivo = validar_documento(valor)
+            if motivo: erros[campo] = motivo
+
+    if dados.chave_acesso:
+        motivo = validar_chave_acesso(dados.chave_acesso)
+        if motivo:
+            erros["chave_acesso"] = motivo
+        elif dados.cnpj_emitente and "cnpj_emitente" not in erros:
+            chave = re.sub(r"\D", "", dados.chave_acesso)
+            emitente = _limpar_documento(dados.cnpj_emitente)
+            if len(chave) == 44 and len(emitente) == 14 and chave[6:20] != emitente:
+                motivo = "CNPJ do emitente diferente do CNPJ contido na chave de acesso"
+                erros["chave_acesso"] = motivo; erros["cnpj_emitente"] = motivo
+
+    if dados.data_emissao:
+        motivo = validar_data(dados.data_emissao)
+        if motivo: erros["data_emissao"] = motivo
+
+    for campo in ("valor_total", "base_calculo", "valor_iss", "valor_icms"):
+        valor = getattr(dados, campo)
+        if valor is not None and valor < 0:
+            erros[campo] = "valor negativo"
+
+    base = dados.base_calculo
+    if base is not None and base >= 0:
+        for campo in ("valor_iss", "valor_icms"):
+            imposto = getattr(dados, campo)
+            if imposto is not None and imposto > base + TOLERANCIA_CENTAVOS:
+                motivo = f"{campo} ({imposto:.2f}) maior que a base de cálculo ({base:.2f})"
+                erros[campo] = motivo; erros["base_calculo"] = motivo
+        # Alíquota do ISS só é conferida quando a base é claramente do ISS (sem ICMS na mesma nota)
+        iss = dados.valor_iss
+        if iss and base > 0 and not dados.valor_icms and "valor_iss" not in erros:
+            minimo = base * ALIQUOTA_ISS_MIN - TOLERANCIA_CENTAVOS
+            maximo = base * ALIQUOTA_ISS_MAX + TOLERANCIA_CENTAVOS
+            if not minimo <= iss <= maximo:
+                motivo = f"ISS de {iss / base:.2%} da base (esperado entre {ALIQUOTA_ISS_MIN:.0%} e {ALIQUOTA_ISS_MAX:.0%})"
+                erros["valor_iss"] = motivo; erros["base_calculo"] = motivo
+
+    return erros
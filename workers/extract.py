@@ -0,0 +1,158 @@
+"""
+WORKER de extração: consome a fila durável e roda o grafo (OCR/PDF/LLM) fora da API.
+
+Uso:
+    python -m workers.extract                 # 1 processo
+    python -m workers.extract --processos 4   # 4 processos (o OCR usa um núcleo por processo)
+    python -m workers.extract --uma-vez       # processa o que estiver na fila e sai
+
+Mais capacidade de OCR = mais processos ou mais máquinas apontando para a mesma
+fila (NF_FILA_CAMINHO) e a mesma pasta de uploads (NF_FILA_UPLOADS_DIR).
+No modo compilado, todos acumulam no mesmo COMPILADO_MESTRE.xlsx com trava de
+arquivo (lockf): vale entre processos e entre máquinas que compartilham
+dados_saida (em NFS, com o serviço de travas ativo).
+SIGTERM/Ctrl+C: termina a tarefa atual e sai (a reserva de uma tarefa
+interrompida vence e ela volta para a fila).
+"""
+import os
+import time
+import signal
+import socket
+import argparse
+import threading
+import multiprocessing
+from typing import Any, Dict
+
+import openai
+from langgraph.errors import GraphRecursionError
+
+from tools.prazos import PRAZO_TOTAL_SEGUNDOS
+from workers.fila import FilaTarefas, fila_tarefas, PENDENTE, remover_upload
+from workflows.perfilador import motivo_perfil, sessao_perfil
+
+# --- Configuração (via .env) ---
+WORKER_PROCESSOS = int(os.getenv("NF_WORKER_PROCESSOS", "1"))
+WORKER_INTERVALO_SEGUNDOS = float(os.getenv("NF_WORKER_INTERVALO_SEGUNDOS", "1"))
+
+# Erros do provedor que valem nova tentativa mais tarde (o cliente LLM já esgotou o backoff dele)
+ERROS_PROVEDOR = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+_parar = threading.Event()
+
+
+def _resultado_do_estado(final_state: Dict[str, Any], status_processamento: str) -> Dict[str, Any]:
+    """Mesmo formato do evento 'concluido'/'erro' do /processar_nf/stream."""
+    dados_extraidos = final_state.get("extracted_data")
+    if dados_extraidos:
+        return {"status_code": 200, "dados": dados_extraidos, "excel_file_path": final_state.get("excel_file_path"),
+                "campos_invalidos": final_state.get("campos_invalidos") or {}, "status_processamento": status_processamento,
+                "duplicata_de": final_state.get("duplicata_de")}
+    if status_processamento == "parcial":
+        return {"status_code": 504, "detail": "Prazo de processamento esgotado antes de extrair os dados da nota.",
+                "status_processamento": status_processamento}
+    last_message = (final_state.get("messages") or [None])[-1]
+    return {"status_code": 500,
+            "detail": f"Agente concluiu, mas não retornou dados extraídos. Última mensagem: {getattr(last_message, 'content', 'N/A')}"}
+
+
+def _manter_reserva(fila: FilaTarefas, tarefa_id: str, worker: str, fim: threading.Event) -> None:
+    """Renova a reserva enquanto o grafo roda (a cada 1/3 da visibilidade)."""
+    while not fim.wait(fila.visibilidade_segundos / 3):
+        if not fila.renovar(tarefa_id, worker):
+            print(f"[{worker}] Reserva da tarefa {tarefa_id} perdida (venceu e foi pega por outro worker).")
+            return
+
+
+def processar_tarefa(fila: FilaTarefas, tarefa: Dict[str, Any], worker: str) -> str:
+    """Roda o grafo para uma tarefa reservada e grava o resultado na fila. Retorna o novo estado."""
+    # Importado aqui: compila o grafo (e o cliente LLM) só nos processos que trabalham
+    from workflows.graph import app as langgraph_app, montar_estado_inicial, montar_config
+
+    tarefa_id = tarefa["id"]
+    prazo = tarefa["prazo_segundos"] or PRAZO_TOTAL_SEGUNDOS
+    # Thread nova por tentativa: uma nova tentativa não herda o estado da anterior
+    config = montar_config(f"{tarefa_id}:{tarefa['tentativas']}", prazo)
+    print(f"[{worker}] Tarefa {tarefa_id} ('{tarefa['nome_original']}', tentativa {tarefa['tentativas']}, prazo: {prazo:.0f}s)")
+
+    fim = threading.Event()
+    renovacao = threading.Thread(target=_manter_reserva, args=(fila, tarefa_id, worker, fim), daemon=True)
+    renovacao.start()
+    inicio = time.monotonic()
+    try:
+        # Perfil por sorteio ou para tarefas lentas (NF_PERFIL_TAXA / NF_PERFIL_LIMIAR_SEGUNDOS)
+        with sessao_perfil(tarefa["nome_original"] or tarefa_id, motivo_perfil(None), tarefa["arquivo"]):
+            try:
+                final_state = langgraph_app.invoke(montar_estado_inicial(tarefa["arquivo"], tarefa["modo"]), config=config)
+                status_processamento = final_state.get("status_processamento") or "completo"
+            except GraphRecursionError:
+                print(f"[{worker}] Limite de passos do grafo atingido, usando o resultado parcial.")
+                final_state = langgraph_app.get_state(config).values
+                status_processamento = "parcial"
+        resultado = _resultado_do_estado(final_state, status_processamento)
+        if resultado["status_code"] == 200:
+            estado = fila.concluir(tarefa_id, worker, resultado)
+        else: # Sem dados: repetir o mesmo documento daria o mesmo resultado
+            estado = fila.falhar(tarefa_id, worker, resultado["detail"], repetir=False, resultado=resultado)
+    except ERROS_PROVEDOR as e:
+        print(f"[{worker}] Provedor LLM indisponível na tarefa {tarefa_id}: {e}")
+        estado = fila.falhar(tarefa_id, worker, f"Serviço do modelo indisponível: {e}")
+    except Exception as e:
+        print(f"[{worker}] Erro na tarefa {tarefa_id}: {e}")
+        estado = fila.falhar(tarefa_id, worker, f"Erro interno ao processar a nota: {e}")
+    finally:
+        fim.set()
+        renovacao.join()
+
+    print(f"[{worker}] Tarefa {tarefa_id}: {estado} em {time.monotonic() - inicio:.1f}s")
+    if estado is not None and estado != PENDENTE: # Não será mais tentada: o upload pode sair
+        remover_upload(tarefa["arquivo"])
+    return estado
+
+
+def executar(fila: FilaTarefas = fila_tarefas, uma_vez: bool = False,
+             intervalo_segundos: float = WORKER_INTERVALO_SEGUNDOS) -> int:
+    """Laço do worker: reserva, processa, repete. Retorna quantas tarefas processou."""
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    processadas = 0
+    print(f"[{worker}] Worker iniciado (fila: {fila.caminho})")
+    while not _parar.is_set():
+        tarefa = fila.reservar(worker)
+        if tarefa is None:
+            if uma_vez:
+                break
+            _parar.wait(intervalo_segundos)
+            continue
+        processar_tarefa(fila, tarefa, worker)
+        processadas += 1
+    print(f"[{worker}] Worker encerrado ({processadas} tarefas).")
+    return processadas
+
+
+def _pedir_parada(signum, frame) -> None:
+    print("Parada solicitada: terminando a tarefa atual...")
+    _parar.set()
+
+def _processo_worker(uma_vez: bool) -> None:
+    signal.signal(signal.SIGTERM, _pedir_parada)
+    signal.signal(signal.SIGINT, _pedir_parada)
+    executar(uma_vez=uma_vez)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker de extração de notas fiscais (consome a fila durável).")
+    parser.add_argument("--processos", type=int, default=WORKER_PROCESSOS, help="Processos worker nesta máquina")
+    parser.add_argument("--uma-vez", action="store_true", help="Processa as tarefas disponíveis e sai")
+    args = parser.parse_args()
+
+    if args.processos <= 1:
+        _processo_worker(args.uma_vez)
+    else:
+        processos = [multiprocessing.Process(target=_processo_worker, args=(args.uma_vez,), name=f"worker-{i}")
+                     for i in range(args.processos)]
+        for processo in processos:
+            processo.start()
+        # O pai repassa SIGTERM aos filhos (Ctrl+C já chega ao grupo de processos inteiro)
+        signal.signal(signal.SIGTERM, lambda signum, frame: [p.terminate() for p in processos])
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for processo in processos:
+            processo.join()
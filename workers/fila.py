@@ -0,0 +1,222 @@
+"""
+FILA DURÁVEL de tarefas de extração (SQLite), para separar a API do OCR/LLM.
+
+A API só grava o upload e enfileira; os workers ('python -m workers.extract')
+reservam as tarefas e rodam o grafo. O SQLite (WAL) é compartilhado entre
+processos da mesma máquina; para vários nós, use um volume compartilhado.
+
+- Visibilidade: a tarefa reservada fica invisível por VISIBILIDADE segundos. O
+  worker renova a reserva enquanto trabalha; se ele morrer, a tarefa volta a
+  ficar disponível e outro worker a pega (conta como nova tentativa);
+- Novas tentativas: falhas transitórias voltam para a fila com backoff exponencial
+  até MAX_TENTATIVAS; depois a tarefa fica 'falhou';
+- Contrapressão: com CAPACIDADE tarefas pendentes/em andamento, 'enfileirar'
+  recusa novas tarefas (FilaCheia), e a API responde 503 com Retry-After.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+
+# --- Configuração (via .env) ---
+FILA_CAMINHO = os.getenv("NF_FILA_CAMINHO", os.path.join("dados_saida", "fila.sqlite"))
+FILA_UPLOADS_DIR = os.getenv("NF_FILA_UPLOADS_DIR", os.path.join("api_uploads", "fila"))
+FILA_CAPACIDADE = int(os.getenv("NF_FILA_CAPACIDADE", "100"))
+FILA_VISIBILIDADE_SEGUNDOS = float(os.getenv("NF_FILA_VISIBILIDADE_SEGUNDOS", "60"))
+FILA_MAX_TENTATIVAS = int(os.getenv("NF_FILA_MAX_TENTATIVAS", "3"))
+FILA_BACKOFF_SEGUNDOS = float(os.getenv("NF_FILA_BACKOFF_SEGUNDOS", "5"))
+
+# Estados de uma tarefa
+PENDENTE, PROCESSANDO, CONCLUIDA, FALHOU = "pendente", "processando", "concluida", "falhou"
+ESTADOS_ATIVOS = (PENDENTE, PROCESSANDO)
+
+
+def remover_upload(arquivo: str) -> None:
+    try:
+        if os.path.exists(arquivo):
+            os.remove(arquivo)
+    except OSError as e:
+        print(f"Erro ao remover o upload {arquivo}: {e}")
+
+
+class FilaCheia(Exception):
+    """A fila atingiu a capacidade: o cliente deve tentar de novo mais tarde."""
+
+
+class FilaTarefas:
+    def __init__(self, caminho: str = FILA_CAMINHO, capacidade: int = FILA_CAPACIDADE,
+                 visibilidade_segundos: float = FILA_VISIBILIDADE_SEGUNDOS, max_tentativas: int = FILA_MAX_TENTATIVAS,
+                 backoff_segundos: float = FILA_BACKOFF_SEGUNDOS):
+        self.caminho = caminho
+        self.capacidade = capacidade
+        self.visibilidade_segundos = visibilidade_segundos
+        self.max_tentativas = max_tentativas
+        self.backoff_segundos = backoff_segundos
+        self._trava = threading.Lock()
+        self._conexao: Optional[sqlite3.Connection] = None
+
+    def _conectar(self) -> sqlite3.Connection:
+        if self._conexao is None:
+            pasta = os.path.dirname(self.caminho)
+            if pasta: os.makedirs(pasta, exist_ok=True)
+            # isolation_level=None: as transações são abertas explicitamente (BEGIN IMMEDIATE)
+            conexao = sqlite3.connect(self.caminho, timeout=30, check_same_thread=False, isolation_level=None)
+            conexao.row_factory = sqlite3.Row
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            conexao.executescript("""
+                CREATE TABLE IF NOT EXISTS tarefas (
+                    id TEXT PRIMARY KEY,
+                    estado TEXT NOT NULL,
+                    arquivo TEXT NOT NULL, nome_original TEXT, modo TEXT NOT NULL, prazo_segundos REAL,
+                    tentativas INTEGER NOT NULL DEFAULT 0,
+                    disponivel_em REAL NOT NULL, -- Pendente: quando pode ser reservada; processando: fim da reserva
+                    worker TEXT, resultado TEXT, erro TEXT,
+                    criada_em REAL NOT NULL, atualizada_em REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_tarefas_estado ON tarefas (estado, disponivel_em);
+            """)
+            self._conexao = conexao
+        return self._conexao
+
+    def _transacao(self, funcao, *args):
+        """Executa 'funcao(conexao, *args)' numa transação de escrita (BEGIN IMMEDIATE trava contra outros processos)."""
+        with self._trava:
+            conexao = self._conectar()
+            conexao.execute("BEGIN IMMEDIATE")
+            try:
+                resultado = funcao(conexao, *args)
+                conexao.execute("COMMIT")
+                return resultado
+            except BaseException:
+                conexao.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _tarefa(linha: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if linha is None:
+            return None
+        tarefa = dict(linha)
+        tarefa["resultado"] = json.loads(tarefa["resultado"]) if tarefa["resultado"] else None
+        return tarefa
+
+    # --- Produtor (API) ---
+    def enfileirar(self, arquivo: str, modo: str, nome_original: Optional[str] = None,
+                   prazo_segundos: Optional[float] = None) -> str:
+        """Cria a tarefa e retorna o id. Levanta FilaCheia se a fila estiver na capacidade."""
+        def inserir(conexao):
+            ativas = conexao.execute(
+                f"SELECT COUNT(*) FROM tarefas WHERE estado IN ({', '.join('?' for _ in ESTADOS_ATIVOS)})", ESTADOS_ATIVOS
+            ).fetchone()[0]
+            if ativas >= self.capacidade:
+                raise FilaCheia(f"Fila cheia ({ativas} tarefas pendentes ou em andamento).")
+            tarefa_id, agora = str(uuid.uuid4()), time.time()
+            conexao.execute(
+                "INSERT INTO tarefas (id, estado, arquivo, nome_original, modo, prazo_segundos, disponivel_em, criada_em, atualizada_em)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (tarefa_id, PENDENTE, arquivo, nome_original, modo, prazo_segundos, agora, agora, agora)
+            )
+            return tarefa_id
+        return self._transacao(inserir)
+
+    def obter(self, tarefa_id: str) -> Optional[Dict[str, Any]]:
+        with self._trava:
+            linha = self._conectar().execute("SELECT * FROM tarefas WHERE id = ?", (tarefa_id,)).fetchone()
+        return self._tarefa(linha)
+
+    def contar(self) -> Dict[str, int]:
+        with self._trava:
+            linhas = self._conectar().execute("SELECT estado, COUNT(*) FROM tarefas GROUP BY estado").fetchall()
+        return {estado: quantidade for estado, quantidade in linhas}
+
+    # --- Consumidor (worker) ---
+    def reservar(self, worker: str) -> Optional[Dict[str, Any]]:
+        """
+        Reserva a próxima tarefa disponível (pendente ou com a reserva vencida) por
+        'visibilidade_segundos'. Retorna None se não houver nenhuma.
+        """
+        abandonadas = []
+        def reservar_proxima(conexao):
+            agora = time.time()
+            while True:
+                linha = conexao.execute(
+                    "SELECT * FROM tarefas WHERE estado IN (?, ?) AND disponivel_em <= ? ORDER BY disponivel_em LIMIT 1",
+                    (PENDENTE, PROCESSANDO, agora)
+                ).fetchone()
+                if linha is None:
+                    return None
+                if linha["tentativas"] >= self.max_tentativas: # Reserva vencida na última tentativa (worker morreu)
+                    conexao.execute(
+                        "UPDATE tarefas SET estado = ?, erro = ?, atualizada_em = ? WHERE id = ?",
+                        (FALHOU, linha["erro"] or "Worker não concluiu a tarefa dentro do tempo de visibilidade.", agora, linha["id"])
+                    )
+                    abandonadas.append(linha["arquivo"])
+                    continue
+                conexao.execute(
+                    "UPDATE tarefas SET estado = ?, tentativas = tentativas + 1, disponivel_em = ?, worker = ?, atualizada_em = ?"
+                    " WHERE id = ?",
+                    (PROCESSANDO, agora + self.visibilidade_segundos, worker, agora, linha["id"])
+                )
+                return conexao.execute("SELECT * FROM tarefas WHERE id = ?", (linha["id"],)).fetchone()
+        linha = self._transacao(reservar_proxima)
+        for arquivo in abandonadas: # Upload de tarefa que não será mais tentada
+            remover_upload(arquivo)
+        return self._tarefa(linha)
+
+    def renovar(self, tarefa_id: str, worker: str) -> bool:
+        """Estende a reserva. False se a tarefa não é mais deste worker (a reserva venceu e outro a pegou)."""
+        def estender(conexao):
+            agora = time.time()
+            return conexao.execute(
+                "UPDATE tarefas SET disponivel_em = ?, atualizada_em = ? WHERE id = ? AND estado = ? AND worker = ?",
+                (agora + self.visibilidade_segundos, agora, tarefa_id, PROCESSANDO, worker)
+            ).rowcount == 1
+        return self._transacao(estender)
+
+    def concluir(self, tarefa_id: str, worker: str, resultado: Dict[str, Any]) -> Optional[str]:
+        return self._finalizar(tarefa_id, worker, CONCLUIDA, resultado=resultado)
+
+    def falhar(self, tarefa_id: str, worker: str, erro: str, repetir: bool = True,
+               resultado: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """
+        Falha transitória (repetir=True): volta para a fila com backoff exponencial, se
+        ainda houver tentativas. Senão a tarefa fica 'falhou'. Retorna o novo estado.
+        """
+        return self._finalizar(tarefa_id, worker, FALHOU, resultado=resultado, erro=erro, repetir=repetir)
+
+    def _finalizar(self, tarefa_id: str, worker: str, estado: str, resultado: Optional[Dict[str, Any]] = None,
+                   erro: Optional[str] = None, repetir: bool = False) -> Optional[str]:
+        """Retorna o novo estado, ou None se a tarefa não é mais deste worker."""
+        def atualizar(conexao):
+            linha = conexao.execute("SELECT tentativas FROM tarefas WHERE id = ? AND estado = ? AND worker = ?",
+                                    (tarefa_id, PROCESSANDO, worker)).fetchone()
+            if linha is None: # A reserva venceu e a tarefa foi pega por outro worker
+                return None
+            agora = time.time()
+            if repetir and linha["tentativas"] < self.max_tentativas:
+                espera = self.backoff_segundos * (2 ** (linha["tentativas"] - 1))
+                conexao.execute(
+                    "UPDATE tarefas SET estado = ?, disponivel_em = ?, worker = NULL, erro = ?, atualizada_em = ? WHERE id = ?",
+                    (PENDENTE, agora + espera, erro, agora, tarefa_id)
+                )
+                return PENDENTE
+            conexao.execute(
+                "UPDATE tarefas SET estado = ?, resultado = ?, erro = ?, atualizada_em = ? WHERE id = ?",
+                (estado, json.dumps(resultado, ensure_ascii=False, default=str) if resultado is not None else None,
+                 erro, agora, tarefa_id)
+            )
+            return estado
+        return self._transacao(atualizar)
+
+    def fechar(self) -> None:
+        with self._trava:
+            if self._conexao is not None:
+                self._conexao.close()
+                self._conexao = None
+
+
+# Instância global (API e workers usam o mesmo arquivo)
+fila_tarefas = FilaTarefas()
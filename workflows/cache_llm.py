@@ -0,0 +1,228 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import uuid
+import hashlib
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.messages import BaseMessage, messages_to_dict, messages_from_dict
+
+from tools.prazos import PrazoEsgotado, segundos_restantes
+
+# --- Configuração (via .env) ---
+CACHE_LLM_ATIVO = os.getenv("NF_CACHE_LLM_ATIVO", "1") != "0"
+CACHE_LLM_CAMINHO = os.getenv("NF_CACHE_LLM_CAMINHO", os.path.join("cache", "llm_cache.sqlite"))
+CACHE_LLM_MAX_ENTRADAS = int(os.getenv("NF_CACHE_LLM_MAX_ENTRADAS", "5000"))
+CACHE_LLM_TTL_SEGUNDOS = float(os.getenv("NF_CACHE_LLM_TTL_SEGUNDOS", str(7 * 24 * 3600)))
+# Espera máxima por uma chamada idêntica em andamento (o prazo da etapa, se houver, é menor)
+CACHE_LLM_ESPERA_MAX_SEGUNDOS = float(os.getenv("NF_CACHE_LLM_ESPERA_MAX_SEGUNDOS", "60"))
+
+# Partes das mensagens que mudam a cada requisição mas não mudam a resposta
+# (ex: o prefixo UUID do arquivo temporário em 'api_uploads/<uuid>_nota.pdf').
+_PADRAO_UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.IGNORECASE)
+_PADRAO_ESPACOS = re.compile(r"\s+")
+
+
+def _normalizar_texto(texto: Any) -> str:
+    if not isinstance(texto, str):
+        texto = json.dumps(texto, sort_keys=True, ensure_ascii=False, default=str)
+    texto = _PADRAO_UUID.sub("<uuid>", texto)
+    return _PADRAO_ESPACOS.sub(" ", texto).strip()
+
+
+def _normalizar_mensagens(mensagens: List[BaseMessage]) -> List[Dict[str, Any]]:
+    """
+    Reduz a lista de mensagens ao que importa para o LLM: tipo, conteúdo e
+    chamadas de ferramenta. Os IDs das tool calls são descartados, pois são
+    gerados de novo a cada execução.
+    """
+    normalizadas = []
+    for msg in mensagens:
+        item = {"tipo": msg.type, "conteudo": _normalizar_texto(msg.content)}
+        tool_calls = getattr(msg, "tool_calls", None)
+        if tool_calls:
+            item["tool_calls"] = [
+                {"nome": tc["name"], "args": _normalizar_texto(tc.get("args", {}))}
+                for tc in tool_calls
+            ]
+        normalizadas.append(item)
+    return normalizadas
+
+
+def _parametros_modelo(modelo: Any) -> Dict[str, Any]:
+    """Extrai os parâmetros que influenciam a resposta (modelo, temperatura, ferramentas)."""
+    kwargs = dict(getattr(modelo, "kwargs", None) or {})
+    kwargs.pop("timeout", None) # Não muda a resposta, só o tempo de espera
+    base = getattr(modelo, "bound", modelo)
+    parametros = {"classe": type(base).__name__, "kwargs": kwargs}
+    for atributo in ("model_name", "temperature", "max_tokens", "top_p", "seed"):
+        if hasattr(base, atributo):
+            parametros[atributo] = getattr(base, atributo)
+    return parametros
+
+
+def _renovar_ids_tool_calls(resposta: BaseMessage) -> BaseMessage:
+    """
+    Cópia da resposta com IDs novos nas tool calls. Uma resposta reaproveitada
+    não pode repetir os IDs da execução original: as ToolMessages de cada
+    execução precisam apontar para chamadas distintas.
+    """
+    dados = messages_to_dict([resposta])[0]
+    novos_ids: Dict[str, str] = {}
+    for campo in ("tool_calls", "invalid_tool_calls"):
+        for tc in dados["data"].get(campo) or []:
+            if tc.get("id"):
+                tc["id"] = novos_ids.setdefault(tc["id"], f"call_{uuid.uuid4().hex[:24]}")
+    # Formato bruto da OpenAI, reenviado ao provedor no histórico
+    for tc in (dados["data"].get("additional_kwargs") or {}).get("tool_calls") or []:
+        if tc.get("id") in novos_ids:
+            tc["id"] = novos_ids[tc["id"]]
+    return messages_from_dict([dados])[0]
+
+
+class _ChamadaEmAndamento:
+    """Uma chamada ao LLM em curso, compartilhada pelas requisições idênticas."""
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado: Optional[BaseMessage] = None
+        self.erro: Optional[BaseException] = None
+
+
+class CacheLLM:
+    """
+    Cache exato (após normalização) das respostas do LLM, guardado em SQLite.
+    - A chave é o hash das mensagens normalizadas + parâmetros do modelo.
+    - Remove as entradas menos usadas recentemente acima de 'max_entradas' e
+      ignora entradas mais velhas que 'ttl_segundos'.
+    - Chamadas idênticas simultâneas (no mesmo processo) são agrupadas em uma
+      única chamada ao provedor. Quem espera não passa do prazo da etapa
+      (tools.prazos) nem de 'espera_max_segundos': se a chamada em andamento
+      não terminar a tempo, chama o modelo por conta própria (ou levanta
+      PrazoEsgotado se o prazo acabou).
+    - Toda resposta reaproveitada recebe IDs novos nas tool calls.
+    """
+
+    def __init__(self, caminho: str = CACHE_LLM_CAMINHO, max_entradas: int = CACHE_LLM_MAX_ENTRADAS,
+                 ttl_segundos: float = CACHE_LLM_TTL_SEGUNDOS, ativo: bool = CACHE_LLM_ATIVO,
+                 espera_max_segundos: float = CACHE_LLM_ESPERA_MAX_SEGUNDOS):
+        self.caminho = caminho
+        self.espera_max_segundos = espera_max_segundos
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self.ativo = ativo
+        self._trava = threading.Lock()
+        self._em_andamento: Dict[str, _ChamadaEmAndamento] = {}
+        self._conexao: Optional[sqlite3.Connection] = None
+
+    # --- Armazenamento ---
+    def _conectar(self) -> sqlite3.Connection:
+        if self._conexao is None:
+            pasta = os.path.dirname(self.caminho)
+            if pasta: os.makedirs(pasta, exist_ok=True)
+            conexao = sqlite3.connect(self.caminho, timeout=30, check_same_thread=False)
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute(
+                "CREATE TABLE IF NOT EXISTS respostas ("
+                " chave TEXT PRIMARY KEY, resposta TEXT NOT NULL,"
+                " criado_em REAL NOT NULL, ultimo_acesso REAL NOT NULL)"
+            )
+            conexao.execute("CREATE INDEX IF NOT EXISTS idx_respostas_acesso ON respostas (ultimo_acesso)")
+            conexao.commit()
+            self._conexao = conexao
+        return self._conexao
+
+    def calcular_chave(self, modelo: Any, mensagens: List[BaseMessage]) -> str:
+        conteudo = {"modelo": _parametros_modelo(modelo), "mensagens": _normalizar_mensagens(mensagens)}
+        serializado = json.dumps(conteudo, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(serializado.encode("utf-8")).hexdigest()
+
+    def obter(self, chave: str) -> Optional[BaseMessage]:
+        agora = time.time()
+        with self._trava:
+            conexao = self._conectar()
+            linha = conexao.execute("SELECT resposta, criado_em FROM respostas WHERE chave = ?", (chave,)).fetchone()
+            if linha is None:
+                return None
+            if agora - linha[1] > self.ttl_segundos:
+                conexao.execute("DELETE FROM respostas WHERE chave = ?", (chave,)); conexao.commit()
+                return None
+            conexao.execute("UPDATE respostas SET ultimo_acesso = ? WHERE chave = ?", (agora, chave)); conexao.commit()
+        return _renovar_ids_tool_calls(messages_from_dict(json.loads(linha[0]))[0])
+
+    def salvar(self, chave: str, resposta: BaseMessage) -> None:
+        agora = time.time()
+        serializado = json.dumps(messages_to_dict([resposta]), ensure_ascii=False)
+        with self._trava:
+            conexao = self._conectar()
+            conexao.execute("INSERT OR REPLACE INTO respostas VALUES (?, ?, ?, ?)", (chave, serializado, agora, agora))
+            excedente = conexao.execute("SELECT COUNT(*) FROM respostas").fetchone()[0] - self.max_entradas
+            if excedente > 0:
+                conexao.execute(
+                    "DELETE FROM respostas WHERE chave IN"
+                    " (SELECT chave FROM respostas ORDER BY ultimo_acesso LIMIT ?)", (excedente,)
+                )
+            conexao.commit()
+
+    def limpar(self) -> None:
+        with self._trava:
+            conexao = self._conectar()
+            conexao.execute("DELETE FROM respostas"); conexao.commit()
+
+    # --- Chamada com cache + coalescência ---
+    def invocar(self, modelo: Any, mensagens: List[BaseMessage],
+                chamar: Optional[Callable[[List[BaseMessage]], BaseMessage]] = None) -> BaseMessage:
+        """
+        Retorna a resposta do cache ou chama o LLM.
+        'chamar' permite trocar a forma de chamar o modelo (padrão: modelo.invoke).
+        """
+        chamar = chamar or modelo.invoke
+        if not self.ativo:
+            return chamar(mensagens)
+
+        chave = self.calcular_chave(modelo, mensagens)
+        resposta = self.obter(chave)
+        if resposta is not None:
+            print(f"Cache LLM: resposta reutilizada ({chave[:12]}).")
+            return resposta
+
+        with self._trava:
+            chamada = self._em_andamento.get(chave)
+            lider = chamada is None
+            if lider:
+                chamada = _ChamadaEmAndamento()
+                self._em_andamento[chave] = chamada
+
+        if not lider:
+            print(f"Cache LLM: aguardando chamada idêntica em andamento ({chave[:12]}).")
+            restante = segundos_restantes()
+            espera = self.espera_max_segundos if restante is None else max(0.0, min(restante, self.espera_max_segundos))
+            if chamada.evento.wait(espera):
+                if chamada.erro is not None:
+                    raise chamada.erro
+                return _renovar_ids_tool_calls(chamada.resultado)
+            restante = segundos_restantes()
+            if restante is not None and restante <= 0:
+                raise PrazoEsgotado("Prazo esgotado aguardando chamada idêntica ao LLM")
+            print(f"Cache LLM: chamada idêntica não terminou em {espera:.1f}s, chamando o modelo ({chave[:12]}).")
+            resposta = chamar(mensagens)
+            self.salvar(chave, resposta)
+            return resposta
+
+        try:
+            # Outra chamada pode ter terminado entre a consulta e a trava
+            resposta = self.obter(chave)
+            if resposta is None:
+                resposta = chamar(mensagens)
+                self.salvar(chave, resposta)
+            chamada.resultado = resposta
+            return resposta
+        except BaseException as e:
+            chamada.erro = e
+            raise
+        finally:
+            with self._trava:
+                self._em_andamento.pop(chave, None)
+            chamada.evento.set()
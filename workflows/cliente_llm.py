@@ -0,0 +1,288 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+from typing import Any, Deque, List, Optional
+
+import httpx
+import openai
+from langchain_core.messages import BaseMessage
+from langchain_openai import ChatOpenAI
+
+from tools.prazos import PrazoEsgotado, segundos_restantes, verificar_prazo
+
+# --- Configuração (via .env) ---
+# Valores padrão = limites do gpt-4o-mini no tier 1 da OpenAI
+LLM_RPM = float(os.getenv("NF_LLM_RPM", "500"))
+LLM_TPM = float(os.getenv("NF_LLM_TPM", "200000"))
+LLM_RAJADA_SEGUNDOS = float(os.getenv("NF_LLM_RAJADA_SEGUNDOS", "1"))
+LLM_CONCORRENCIA_INICIAL = int(os.getenv("NF_LLM_CONCORRENCIA_INICIAL", "4"))
+LLM_CONCORRENCIA_MAX = int(os.getenv("NF_LLM_CONCORRENCIA_MAX", "32"))
+LLM_TENTATIVAS = int(os.getenv("NF_LLM_TENTATIVAS", "6"))
+LLM_TENTATIVAS_ENVIOS_FATOR = int(os.getenv("NF_LLM_TENTATIVAS_ENVIOS_FATOR", "4")) # Teto de envios = fator × tentativas (429 com a taxa caindo não gastam tentativa)
+LLM_ESPERA_BASE_SEGUNDOS = float(os.getenv("NF_LLM_ESPERA_BASE_SEGUNDOS", "0.5"))
+LLM_ESPERA_MAX_SEGUNDOS = float(os.getenv("NF_LLM_ESPERA_MAX_SEGUNDOS", "30"))
+LLM_TIMEOUT_SEGUNDOS = float(os.getenv("NF_LLM_TIMEOUT_SEGUNDOS", "60"))
+LLM_TOKENS_RESPOSTA_ESTIMADOS = int(os.getenv("NF_LLM_TOKENS_RESPOSTA_ESTIMADOS", "800"))
+# Adaptação da taxa de requisições aos 429 (útil quando NF_LLM_RPM está acima do limite real da conta)
+LLM_TAXA_FATOR_REDUCAO = float(os.getenv("NF_LLM_TAXA_FATOR_REDUCAO", "0.5"))
+LLM_TAXA_PASSO_RECUPERACAO = float(os.getenv("NF_LLM_TAXA_PASSO_RECUPERACAO", "0.005")) # Fração da taxa configurada por sucesso
+
+# Erros que valem nova tentativa (sobrecarga/instabilidade do provedor)
+ERROS_TRANSITORIOS = (openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+
+class BaldeDeTokens:
+    """
+    Token bucket: enche a 'taxa_por_minuto' e guarda no máximo 'rajada_segundos' de crédito.
+    Pedidos maiores que a capacidade são liberados com o balde cheio e deixam saldo negativo.
+
+    A taxa também se adapta (AIMD, como o LimitadorAIMD): um 429 a multiplica por
+    'fator_reducao' (no máximo uma vez por 'janela_reducao'), mas sem descer abaixo da
+    vazão que o provedor aceitou nos últimos 'janela_medicao' segundos; cada sucesso
+    soma 'passo_recuperacao' × taxa configurada, até voltar à taxa configurada.
+    """
+
+    def __init__(self, taxa_por_minuto: float, rajada_segundos: float = LLM_RAJADA_SEGUNDOS,
+                 fator_reducao: float = LLM_TAXA_FATOR_REDUCAO, passo_recuperacao: float = LLM_TAXA_PASSO_RECUPERACAO,
+                 janela_reducao: float = 1.0, janela_medicao: float = 2.0):
+        self.taxa_maxima = taxa_por_minuto / 60.0
+        self.taxa_minima = self.taxa_maxima * 0.01
+        self.rajada_segundos = rajada_segundos
+        self.fator_reducao = fator_reducao
+        self.passo_recuperacao = passo_recuperacao
+        self.janela_reducao = janela_reducao
+        self.janela_medicao = janela_medicao
+        self._sucessos: Deque[float] = deque() # Instantes das respostas aceitas (dentro da janela de medição)
+        self._definir_taxa(self.taxa_maxima)
+        self.saldo = self.capacidade
+        self._ultima_recarga = time.monotonic()
+        self._ultima_reducao = 0.0
+        self._condicao = threading.Condition()
+
+    def _definir_taxa(self, taxa_por_segundo: float) -> None:
+        self.taxa_por_segundo = taxa_por_segundo
+        self.capacidade = max(1.0, taxa_por_segundo * self.rajada_segundos)
+
+    def _vazao_aceita(self, agora: float) -> float:
+        while self._sucessos and agora - self._sucessos[0] > self.janela_medicao:
+            self._sucessos.popleft()
+        return len(self._sucessos) / self.janela_medicao
+
+    def _recarregar(self) -> None:
+        agora = time.monotonic()
+        self.saldo = min(self.capacidade, self.saldo + (agora - self._ultima_recarga) * self.taxa_por_segundo)
+        self._ultima_recarga = agora
+
+    def adquirir(self, quantidade: float = 1.0) -> float:
+        """Bloqueia até haver saldo. Retorna quanto tempo esperou (segundos)."""
+        inicio = time.monotonic()
+        with self._condicao:
+            while True:
+                self._recarregar()
+                necessario = min(quantidade, self.capacidade) # A capacidade muda com a taxa
+                if self.saldo >= necessario:
+                    self.saldo -= quantidade
+                    return time.monotonic() - inicio
+                self._condicao.wait((necessario - self.saldo) / self.taxa_por_segundo)
+
+    def tentar_adquirir(self, quantidade: float = 1.0) -> bool:
+        """Como 'adquirir', sem esperar: False se não houver saldo agora."""
+        with self._condicao:
+            self._recarregar()
+            if self.saldo < min(quantidade, self.capacidade):
+                return False
+            self.saldo -= quantidade
+            return True
+
+    def ajustar(self, diferenca: float) -> None:
+        """Corrige o saldo depois que o custo real (ex: tokens usados) é conhecido."""
+        with self._condicao:
+            self._recarregar()
+            self.saldo = min(self.capacidade, self.saldo - diferenca)
+            self._condicao.notify_all()
+
+    def reduzir_taxa(self) -> bool:
+        """
+        Limite do provedor atingido: reduz a taxa e esvazia o balde (as outras threads também seguram o envio).
+        Retorna True enquanto a taxa ainda está caindo (reduzida agora ou na janela de redução atual);
+        False quando ela já não desce mais (piso da vazão aceita ou taxa mínima).
+        """
+        with self._condicao:
+            self._recarregar()
+            agora = time.monotonic()
+            caindo = agora - self._ultima_reducao < self.janela_reducao
+            if not caindo:
+                nova_taxa = max(self.taxa_minima, min(self.taxa_por_segundo,
+                                max(self.taxa_por_segundo * self.fator_reducao, self._vazao_aceita(agora))))
+                caindo = nova_taxa < self.taxa_por_segundo
+                if caindo:
+                    self._definir_taxa(nova_taxa)
+                    self._ultima_reducao = agora
+                    print(f"Cliente LLM: limite do provedor, taxa reduzida para {self.taxa_por_segundo * 60:.0f}/min.")
+            self.saldo = min(self.saldo, 0.0)
+            return caindo
+
+    def recuperar_taxa(self) -> None:
+        """Resposta aceita pelo provedor: entra na medição de vazão e a taxa volta a subir."""
+        with self._condicao:
+            self._sucessos.append(time.monotonic())
+            if self.taxa_por_segundo < self.taxa_maxima:
+                self._recarregar()
+                self._definir_taxa(min(self.taxa_maxima, self.taxa_por_segundo + self.taxa_maxima * self.passo_recuperacao))
+                self._condicao.notify_all()
+
+
+class LimitadorAIMD:
+    """
+    Controle adaptativo de concorrência (AIMD, como no TCP):
+    - cada sucesso soma 1/limite (≈ +1 a cada 'limite' chamadas);
+    - cada sobrecarga (timeout/5xx) divide o limite por 2 (no máximo uma vez por 'janela_reducao').
+    Os 429 não passam por aqui: eles reduzem a taxa do BaldeDeTokens de requisições.
+    """
+
+    def __init__(self, inicial: int = LLM_CONCORRENCIA_INICIAL, maximo: int = LLM_CONCORRENCIA_MAX,
+                 minimo: int = 1, janela_reducao: float = 1.0):
+        self.limite = float(max(minimo, min(inicial, maximo)))
+        self.minimo = minimo
+        self.maximo = maximo
+        self.janela_reducao = janela_reducao
+        self.em_uso = 0
+        self._ultima_reducao = 0.0
+        self._condicao = threading.Condition()
+
+    def entrar(self) -> None:
+        with self._condicao:
+            while self.em_uso >= int(self.limite):
+                self._condicao.wait()
+            self.em_uso += 1
+
+    def sair(self, sobrecarga: bool = False) -> None:
+        with self._condicao:
+            self.em_uso -= 1
+            agora = time.monotonic()
+            if sobrecarga:
+                if agora - self._ultima_reducao >= self.janela_reducao:
+                    self.limite = max(self.minimo, self.limite / 2)
+                    self._ultima_reducao = agora
+                    print(f"Cliente LLM: sobrecarga, concorrência reduzida para {int(self.limite)}.")
+            else:
+                self.limite = min(self.maximo, self.limite + 1.0 / self.limite)
+            self._condicao.notify_all()
+
+
+def estimar_tokens(mensagens: List[BaseMessage]) -> int:
+    """Estimativa barata (~4 caracteres por token) do prompt + resposta esperada."""
+    caracteres = sum(len(str(msg.content)) for msg in mensagens)
+    return caracteres // 4 + LLM_TOKENS_RESPOSTA_ESTIMADOS
+
+
+def _tempo_retry_after(erro: Exception) -> Optional[float]:
+    """Lê o 'Retry-After' (ou 'retry-after-ms') da resposta de erro, se houver."""
+    resposta = getattr(erro, "response", None)
+    if resposta is None:
+        return None
+    try:
+        if resposta.headers.get("retry-after-ms"):
+            return float(resposta.headers["retry-after-ms"]) / 1000.0
+        if resposta.headers.get("retry-after"):
+            return float(resposta.headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+class ClienteLLM:
+    """
+    Camada compartilhada de acesso ao LLM:
+    - um único httpx.Client (pool de conexões keep-alive) para todos os modelos;
+    - token buckets de requisições/min e tokens/min (a taxa de requisições se adapta aos 429);
+    - concorrência adaptativa (AIMD) às sobrecargas;
+    - novas tentativas com backoff exponencial + jitter, respeitando o Retry-After;
+    - prazo da etapa atual (tools.prazos): timeout de cada chamada e nenhuma espera além do prazo.
+    """
+
+    def __init__(self, rpm: float = LLM_RPM, tpm: float = LLM_TPM, tentativas: int = LLM_TENTATIVAS,
+                 concorrencia_inicial: int = LLM_CONCORRENCIA_INICIAL, concorrencia_max: int = LLM_CONCORRENCIA_MAX):
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=concorrencia_max, max_keepalive_connections=concorrencia_max),
+            timeout=LLM_TIMEOUT_SEGUNDOS,
+        )
+        self.balde_requisicoes = BaldeDeTokens(rpm)
+        self.balde_tokens = BaldeDeTokens(tpm)
+        self.limitador = LimitadorAIMD(concorrencia_inicial, concorrencia_max)
+        self.tentativas = tentativas
+
+    def criar_modelo(self, **kwargs) -> ChatOpenAI:
+        """Cria um ChatOpenAI usando o pool HTTP compartilhado (as novas tentativas ficam por nossa conta)."""
+        kwargs.setdefault("timeout", LLM_TIMEOUT_SEGUNDOS)
+        return ChatOpenAI(http_client=self.http_client, max_retries=0, **kwargs)
+
+    def _espera_backoff(self, tentativa: int, erro: Exception) -> float:
+        retry_after = _tempo_retry_after(erro)
+        if isinstance(erro, openai.RateLimitError) and retry_after is not None:
+            # 429 com Retry-After: jitter em cima dele (senão as threads barradas pelo mesmo 429
+            # voltam juntas e levam outro), e nunca antes de o balde, já com a taxa reduzida, liberar um envio
+            espera = retry_after + random.uniform(0, retry_after)
+            return max(espera, 1.0 / self.balde_requisicoes.taxa_por_segundo)
+        # "Full jitter": sorteia entre 0 e o teto exponencial
+        teto = min(LLM_ESPERA_MAX_SEGUNDOS, LLM_ESPERA_BASE_SEGUNDOS * (2 ** tentativa))
+        espera = random.uniform(0, teto)
+        if retry_after is not None:
+            espera = max(espera, retry_after)
+        return espera
+
+    def invocar(self, modelo: Any, mensagens: List[BaseMessage]) -> BaseMessage:
+        """
+        Chama o modelo com novas tentativas. Um 429 recebido enquanto a taxa do balde ainda
+        está caindo não gasta tentativa (o cliente ainda está achando o limite do provedor);
+        o total de envios fica limitado a LLM_TENTATIVAS_ENVIOS_FATOR × tentativas.
+        """
+        tokens_estimados = estimar_tokens(mensagens)
+        falhas, envios = 0, 0
+        while True:
+            self.balde_requisicoes.adquirir(1)
+            self.balde_tokens.adquirir(tokens_estimados)
+            verificar_prazo("LLM")
+            self.limitador.entrar()
+            envios += 1
+            sobrecarga = False
+            try:
+                restante = segundos_restantes()
+                # O timeout da chamada nunca passa do prazo da etapa
+                limitado_pelo_prazo = restante is not None and restante < LLM_TIMEOUT_SEGUNDOS
+                parametros = {"timeout": max(0.1, restante)} if limitado_pelo_prazo else {}
+                resposta = modelo.invoke(mensagens, **parametros)
+                uso = getattr(resposta, "usage_metadata", None)
+                if uso and uso.get("total_tokens"):
+                    self.balde_tokens.ajustar(uso["total_tokens"] - tokens_estimados)
+                self.balde_requisicoes.recuperar_taxa()
+                return resposta
+            except (openai.RateLimitError, *ERROS_TRANSITORIOS) as e:
+                # 429 é limite de taxa (o balde de requisições se adapta), não de concorrência;
+                # timeout causado pelo nosso prazo curto não é sinal de sobrecarga do provedor
+                sobrecarga = not isinstance(e, openai.RateLimitError) and not (limitado_pelo_prazo and isinstance(e, openai.APITimeoutError))
+                # Cota esgotada também vem como 429, mas esperar não resolve
+                if getattr(e, "code", None) == "insufficient_quota":
+                    print(f"Cliente LLM: cota esgotada, desistindo: {e}")
+                    raise
+                taxa_caindo = isinstance(e, openai.RateLimitError) and self.balde_requisicoes.reduzir_taxa()
+                if not taxa_caindo:
+                    falhas += 1
+                if falhas >= self.tentativas or envios >= self.tentativas * LLM_TENTATIVAS_ENVIOS_FATOR:
+                    print(f"Cliente LLM: desistindo após {envios} envios ({falhas} tentativas): {e}")
+                    raise
+                espera = self._espera_backoff(max(0, falhas - 1), e)
+                restante = segundos_restantes()
+                if restante is not None and espera >= restante:
+                    print(f"Cliente LLM: sem tempo para nova tentativa ({restante:.1f}s restantes): {e}")
+                    raise PrazoEsgotado("Prazo esgotado aguardando o LLM") from e
+                print(f"Cliente LLM: {type(e).__name__} (tentativa {falhas}/{self.tentativas}, envio {envios}), aguardando {espera:.2f}s...")
+            finally:
+                self.limitador.sair(sobrecarga=sobrecarga)
+            time.sleep(espera)
+
+
+# Instância compartilhada por todo o processo (grafo, RAG, etc.)
+cliente_llm = ClienteLLM()
@@ -2,11 +2,14 @@ import os
 import pandas as pd
 from typing import TypedDict, Annotated, List, Union, Optional, Dict, Any # <-- Adicionado Dict, Any
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langgraph.graph import StateGraph, START, END
 from langgraph.checkpoint.memory import MemorySaver
+from langgraph.config import get_stream_writer
 import operator
+import time
+from langchain_core.runnables import RunnableConfig
 
 # --- 1. Importar NOSSAS FERRAMENTAS ---
 from tools.extracao import (
@@ -21,8 +24,21 @@ from tools.extracao import (
     salvar_dados_em_excel,
     acumular_dados_em_excel,
     
-    DadosNotaFiscal 
+    DadosNotaFiscal,
+    callback_progresso
 )
+from tools.layouts import extrair_por_layout
+from tools.dedup_imagens import DEDUP_MODO, calcular_hashes, confirmar_por_ocr, indice_imagens
+from tools.armazenamento import registrar_nota
+from tools.validacao import validar_dados
+from tools.prazos import (
+    PRAZO_TOTAL_SEGUNDOS, PRAZO_OCR_SEGUNDOS, PRAZO_LLM_SEGUNDOS, LIMITE_PASSOS_GRAFO, MARCADOR_OCR_INTERROMPIDO,
+    PrazoEsgotado, prazo_etapa, prazo_expirado
+)
+from workflows.cache_llm import CacheLLM
+from workflows.cliente_llm import cliente_llm
+from workflows.reextracao import REEXTRACAO_ATIVA, reextrair_campos
+from workflows.perfilador import perfilar_no
 
 # Carregar as variáveis de ambiente (nosso .env)
 from dotenv import load_dotenv
@@ -38,9 +54,13 @@ tools = [
 ]
 
 # --- 3. Definir o Modelo (LLM) ---
-model = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+# Criado pelo cliente compartilhado: pool HTTP, limites RPM/TPM, novas tentativas e AIMD
+model = cliente_llm.criar_modelo(model="gpt-4o-mini", temperature=0)
 model_with_tools = model.bind_tools(tools)
 
+# Cache local das respostas do LLM (mesmo texto OCR => mesma resposta, sem nova chamada)
+cache_llm = CacheLLM()
+
 # --- 4. Definir as Instruções (System Prompt) ---
 system_prompt = """
 Você é um assistente especialista em processamento de notas fiscais brasileiras.
@@ -83,26 +103,167 @@ class AgentState(TypedDict):
     app_mode: str 
     # --- MUDANÇA CRUCIAL (v3.7): Campo para guardar os dados extraídos ---
     extracted_data: Optional[Dict[str, Any]] = None 
+    # Texto bruto da última extração (para corrigir só os campos inválidos, sem novo OCR)
+    texto_bruto: Optional[str] = None
+    # Campos salvos que continuaram reprovados na validação: {campo: motivo}
+    campos_invalidos: Optional[Dict[str, str]] = None
+    # Orçamento de tempo do documento: instante limite (time.time()) e 'completo' | 'parcial'
+    prazo_final: Optional[float] = None
+    status_processamento: Optional[str] = None
+    # Imagens: hashes perceptuais deste arquivo (registrados após salvar) e a provável duplicata já processada
+    hashes_imagem: Optional[Dict[str, str]] = None
+    duplicata_de: Optional[Dict[str, Any]] = None
 
 # --- 6. Definir os "Nós" do Gráfico (As Etapas) ---
 
+def _emitir_evento(evento: Dict[str, Any]):
+    """Emite um evento 'custom' para quem usa app.stream(..., stream_mode='custom'). Sem stream, não faz nada."""
+    try:
+        get_stream_writer()(evento)
+    except RuntimeError: # Nó chamado fora do grafo (ex: testes)
+        pass
+
+def _salvar_conforme_modo(dados_pydantic: DadosNotaFiscal, app_mode: str):
+    """
+    Salva no Excel único ou no compilado, conforme o modo.
+    Retorna (mensagem para o agente, caminho do Excel ou None, dicionário de dados ou None).
+    """
+    print(f"Roteamento de salvamento. Modo atual: {app_mode}")
+    if app_mode == 'single':
+        resultado_msg, dados_retornados_dict = salvar_dados_em_excel(dados_pydantic)
+    else: # 'accumulated'
+        resultado_msg, dados_retornados_dict = acumular_dados_em_excel(dados_pydantic)
+
+    if str(resultado_msg).startswith("Erro"):
+        return str(resultado_msg), None, None # Não atualiza os dados em caso de erro de salvamento
+    excel_path = str(resultado_msg)
+    registrar_nota(dados_retornados_dict, app_mode, excel_path) # Índice para consultas (GET /notas)
+    if app_mode == 'single':
+        return f"Arquivo salvo com sucesso em: {excel_path}", excel_path, dados_retornados_dict
+    return f"Dados ACUMULADOS com sucesso em: {excel_path}", excel_path, dados_retornados_dict
+
+def _invocar_llm(modelo, mensagens):
+    """Chamada ao LLM passando pelo cache e pelo cliente com limites."""
+    return cache_llm.invocar(modelo, mensagens, chamar=lambda msgs: cliente_llm.invocar(modelo, msgs))
+
+def _validar_e_corrigir(dados_pydantic: DadosNotaFiscal, texto_bruto: Optional[str]):
+    """
+    Valida os dados e, se houver campos reprovados, re-extrai SÓ esses campos do texto bruto
+    (uma chamada pequena ao LLM). Retorna (dados, {campo: motivo} que continuaram inválidos).
+    """
+    erros = validar_dados(dados_pydantic)
+    if not erros:
+        return dados_pydantic, {}
+    print(f"Validação reprovou: {erros}")
+    if REEXTRACAO_ATIVA and texto_bruto:
+        _emitir_evento({"evento": "reextracao", "campos": sorted(erros)})
+        try:
+            dados_pydantic = reextrair_campos(model, texto_bruto, dados_pydantic, erros, _invocar_llm)
+            erros = validar_dados(dados_pydantic)
+        except Exception as e:
+            print(f"Erro na re-extração direcionada: {e}")
+    return dados_pydantic, erros
+
+def _registrar_imagem(state: AgentState, dados_dict: Dict[str, Any], excel_path: Optional[str]) -> None:
+    """Guarda os hashes da imagem com o resultado salvo, para reconhecer as próximas fotos da mesma nota."""
+    try:
+        indice_imagens.registrar(state["hashes_imagem"], dados_dict, excel_path, os.path.basename(state["file_path"]))
+    except Exception as e:
+        print(f"Erro ao registrar a imagem no índice de duplicatas: {e}")
+
+def check_duplicate(state: AgentState, config: RunnableConfig):
+    """Imagens quase idênticas a uma já processada: sinaliza ou reutiliza o resultado (sem OCR completo e sem LLM)."""
+    print("--- Nó: check_duplicate (Imagens Repetidas) ---")
+    _emitir_evento({"evento": "no_iniciado", "no": "dedup"})
+    # Primeiro nó do documento: o prazo total começa a contar aqui (a API pode pedir um prazo menor)
+    prazo_segundos = config.get("configurable", {}).get("prazo_segundos") or PRAZO_TOTAL_SEGUNDOS
+    prazo_final = time.time() + prazo_segundos
+    reinicio = {"hashes_imagem": None, "duplicata_de": None, "prazo_final": prazo_final}
+    if DEDUP_MODO == "desligado":
+        return reinicio
+    try:
+        hashes = calcular_hashes(state["file_path"])
+        anterior = indice_imagens.buscar(hashes) if hashes else None
+    except Exception as e:
+        print(f"Erro ao verificar duplicatas: {e}")
+        return reinicio
+    if anterior is None:
+        return {**reinicio, "hashes_imagem": hashes}
+
+    print(f"Imagem quase idêntica a '{anterior['nome_arquivo']}' (distância {anterior['distancia']} bits).")
+    # O hash não separa notas diferentes do mesmo layout: só sinaliza/reutiliza se o OCR rápido confirmar
+    with prazo_etapa(PRAZO_OCR_SEGUNDOS, prazo_final):
+        confirmada = confirmar_por_ocr(state["file_path"], anterior["dados"])
+    if not confirmada:
+        print("Dedup: número/valor da nota anterior não confirmados nesta imagem, processando normalmente.")
+        return {**reinicio, "hashes_imagem": hashes}
+
+    duplicata = {"id": anterior["id"], "nome_arquivo": anterior["nome_arquivo"], "distancia": anterior["distancia"],
+                 "excel_file_path": anterior["excel_file_path"], "reutilizada": False}
+    if DEDUP_MODO == "reutilizar":
+        # Mesmo documento: não salva de novo (no modo acumulado, a nota contaria duas vezes)
+        return {
+            "hashes_imagem": None, "duplicata_de": {**duplicata, "reutilizada": True},
+            "texto_bruto": None, "campos_invalidos": None, "prazo_final": None, "status_processamento": "completo",
+            "messages": [AIMessage(content=f"Imagem quase idêntica a '{anterior['nome_arquivo']}', já processada. Resultado anterior reutilizado.")],
+            "excel_file_path": anterior["excel_file_path"],
+            "extracted_data": anterior["dados"]
+        }
+    return {"hashes_imagem": hashes, "duplicata_de": duplicata, "prazo_final": prazo_final}
+
+def try_layout(state: AgentState, config: RunnableConfig):
+    """Caminho rápido: PDFs de layout conhecido são lidos por região, sem o LLM."""
+    print("--- Nó: try_layout (Layouts Conhecidos) ---")
+    _emitir_evento({"evento": "no_iniciado", "no": "layout"})
+    # O prazo do documento já corre desde o check_duplicate (o OCR de confirmação também conta)
+    prazo_final = state.get("prazo_final")
+    with prazo_etapa(PRAZO_OCR_SEGUNDOS, prazo_final):
+        resultado = extrair_por_layout(state["file_path"])
+    # Início de um novo documento: limpa o que sobrou do anterior (o Streamlit reaproveita o thread_id)
+    reinicio = {"texto_bruto": None, "campos_invalidos": None, "prazo_final": prazo_final, "status_processamento": "completo"}
+    if resultado is None:
+        return reinicio
+    nome_layout, dados_pydantic = resultado
+    msg_salvamento, excel_path, dados_dict = _salvar_conforme_modo(dados_pydantic, state["app_mode"])
+    if dados_dict is None:
+        return reinicio # Falhou ao salvar: deixa o agente tentar pelo fluxo normal
+    return {
+        **reinicio,
+        "messages": [AIMessage(content=f"Nota lida pelo layout conhecido '{nome_layout}'. {msg_salvamento}")],
+        "excel_file_path": excel_path,
+        "extracted_data": dados_dict
+    }
+
 def call_model(state: AgentState):
     """Chama o LLM para decidir o próximo passo."""
     print("--- Nó: call_model (Agente) ---")
+    _emitir_evento({"evento": "no_iniciado", "no": "agent"})
     messages = state["messages"]
+    prazo_final = state.get("prazo_final")
+
+    if prazo_expirado(prazo_final):
+        # Sem tool_calls: o should_continue encerra e a API devolve o que já foi salvo
+        print("Prazo do documento esgotado, encerrando o agente.")
+        return {"messages": [AIMessage(content="Prazo de processamento do documento esgotado.")], "status_processamento": "parcial"}
     
     if len(messages) == 1:
         messages_with_prompt = [ HumanMessage(content=system_prompt), messages[0] ]
     else:
         messages_with_prompt = messages
 
-    response = model_with_tools.invoke(messages_with_prompt)
+    try:
+        with prazo_etapa(PRAZO_LLM_SEGUNDOS, prazo_final):
+            response = _invocar_llm(model_with_tools, messages_with_prompt)
+    except PrazoEsgotado as e:
+        print(f"Chamada ao LLM interrompida: {e}")
+        return {"messages": [AIMessage(content=f"Processamento interrompido: {e}.")], "status_processamento": "parcial"}
     return {"messages": [response]}
 
 # NÓ ATUALIZADO: call_tools
 def call_tools(state: AgentState):
     """Executa as ferramentas que o agente decidiu usar E faz o roteamento lógico."""
     print("--- Nó: call_tools (Ação) ---")
+    _emitir_evento({"evento": "no_iniciado", "no": "action"})
     last_message = state["messages"][-1]
     
     if not last_message.tool_calls:
@@ -114,6 +275,11 @@ def call_tools(state: AgentState):
     excel_path = state.get("excel_file_path") 
     app_mode = state["app_mode"] 
     extracted_data_dict = state.get("extracted_data") # Pega o valor atual
+    texto_bruto = state.get("texto_bruto")
+    campos_invalidos = state.get("campos_invalidos")
+    prazo_final = state.get("prazo_final")
+    status_processamento = state.get("status_processamento")
+    hashes_imagem = state.get("hashes_imagem")
 
     for tool_call in last_message.tool_calls:
         tool_name = tool_call["name"]
@@ -125,29 +291,21 @@ def call_tools(state: AgentState):
             
             # Lógica de Roteamento (MODIFICADA para capturar dados)
             if tool_name == "salvar_dados_nota":
-                print(f"Roteamento de salvamento. Modo atual: {app_mode}")
                 dados_pydantic = DadosNotaFiscal(**args['dados_nota'])
-                
-                # --- MUDANÇA CRUCIAL (v3.7): Captura a tupla ---
-                if app_mode == 'single':
-                    resultado_tupla = salvar_dados_em_excel(dados_pydantic) 
-                else: # 'accumulated'
-                    resultado_tupla = acumular_dados_em_excel(dados_pydantic)
-                
-                # Desempacota a tupla
-                resultado_msg, dados_retornados_dict = resultado_tupla
-                
-                # Prepara a resposta e atualiza o estado
-                if not str(resultado_msg).startswith("Erro"):
-                    excel_path = str(resultado_msg) # Atualiza o caminho do Excel
+                with prazo_etapa(PRAZO_LLM_SEGUNDOS, prazo_final):
+                    dados_pydantic, erros_validacao = _validar_e_corrigir(dados_pydantic, texto_bruto)
+                resultado_msg_para_agente, novo_excel_path, dados_retornados_dict = _salvar_conforme_modo(dados_pydantic, app_mode)
+                if dados_retornados_dict is not None:
+                    excel_path = novo_excel_path # Atualiza o caminho do Excel
                     extracted_data_dict = dados_retornados_dict # Atualiza os dados extraídos
-                    if app_mode == 'single':
-                         resultado_msg_para_agente = f"Arquivo salvo com sucesso em: {excel_path}"
-                    else:
-                         resultado_msg_para_agente = f"Dados ACUMULADOS com sucesso em: {excel_path}"
-                else:
-                    resultado_msg_para_agente = str(resultado_msg) # Passa a msg de erro
-                    # Não atualiza extracted_data_dict em caso de erro de salvamento
+                    campos_invalidos = erros_validacao or None
+                    # Só resultados completos e validados são reaproveitados para as próximas fotos da mesma nota
+                    if hashes_imagem and not erros_validacao and status_processamento != "parcial":
+                        _registrar_imagem(state, dados_retornados_dict, novo_excel_path)
+                        hashes_imagem = None
+                    if erros_validacao:
+                        # Só informativo: os dados já foram salvos, o agente não deve repetir o processo
+                        resultado_msg_para_agente += f" Atenção: campos não confirmados pela validação: {erros_validacao}. Não é necessário salvar novamente."
             
             # Ferramentas de extração (lógica normal)
             elif tool_name in ["extrair_dados_xml", "extrair_texto_imagem", "extrair_texto_pdf", "extrair_texto_html"]:
@@ -157,8 +315,17 @@ def call_tools(state: AgentState):
                 if tool_name == "extrair_texto_html": args = {"caminho_do_arquivo_html": state["file_path"]}
                 
                 ferramenta = globals()[tool_name]
-                resultado = ferramenta.func(**args)
+                # Repassa o progresso do OCR (página k/N) para o stream do grafo
+                token_progresso = callback_progresso.set(_emitir_evento)
+                try:
+                    with prazo_etapa(PRAZO_OCR_SEGUNDOS, prazo_final):
+                        resultado = ferramenta.func(**args)
+                finally:
+                    callback_progresso.reset(token_progresso)
                 resultado_msg_para_agente = str(resultado)
+                if MARCADOR_OCR_INTERROMPIDO in resultado_msg_para_agente:
+                    status_processamento = "parcial" # O agente segue só com as páginas lidas
+                texto_bruto = resultado_msg_para_agente # Guardado para a re-extração direcionada
             
             else:
                 resultado_msg_para_agente = f"Erro: Ferramenta '{tool_name}' desconhecida."
@@ -173,25 +340,63 @@ def call_tools(state: AgentState):
     return {
         "messages": tool_messages, 
         "excel_file_path": excel_path, 
-        "extracted_data": extracted_data_dict # Retorna os dados extraídos para o estado
+        "extracted_data": extracted_data_dict, # Retorna os dados extraídos para o estado
+        "texto_bruto": texto_bruto,
+        "campos_invalidos": campos_invalidos,
+        "status_processamento": status_processamento,
+        "hashes_imagem": hashes_imagem
     }
 
 
-# --- 7. Definir a "Lógica" (Sem mudanças) ---
+# --- 7. Definir a "Lógica" ---
+def route_after_dedup(state: AgentState):
+    # Resultado reutilizado: a última mensagem é a resposta do nó; senão segue para os layouts
+    if isinstance(state["messages"][-1], HumanMessage):
+        return "layout"
+    return END
+
+def route_after_layout(state: AgentState):
+    # Se o layout resolveu, a última mensagem é a resposta dele; senão segue para o agente
+    if isinstance(state["messages"][-1], HumanMessage):
+        return "agent"
+    return END
+
 def should_continue(state: AgentState):
     last_message = state["messages"][-1]
     if last_message.tool_calls:
         return "action"
     return END
 
-# --- 8. Montar e Compilar o Gráfico (Sem mudanças) ---
-print("Compilando o workflow do agente (v3.7 - Retorna Dados)...")
+# --- 8. Entrada do Grafo (usada pela API e pelo worker da fila) ---
+def montar_estado_inicial(file_path: str, app_mode: str) -> Dict[str, Any]:
+    prompt_tecnico = f"Processar: {file_path}" # Mesmo pedido do app (a origem, API ou fila, não muda a extração)
+    return {
+        "messages": [HumanMessage(content=prompt_tecnico)],
+        "file_path": file_path,
+        "excel_file_path": None,
+        "app_mode": app_mode,
+        "extracted_data": None,
+        "texto_bruto": None,
+        "campos_invalidos": None
+    }
+
+def montar_config(thread_id: str, prazo_segundos: float) -> Dict[str, Any]:
+    # recursion_limit corta loops agente <-> ferramentas; prazo_segundos é lido pelo primeiro nó do grafo
+    return {"configurable": {"thread_id": thread_id, "prazo_segundos": prazo_segundos}, "recursion_limit": LIMITE_PASSOS_GRAFO}
+
+# --- 9. Montar e Compilar o Gráfico ---
+print("Compilando o workflow do agente (v3.9 - Imagens Repetidas)...")
 workflow = StateGraph(AgentState)
-workflow.add_node("agent", call_model)
-workflow.add_node("action", call_tools)
-workflow.add_edge(START, "agent")
+# perfilar_no: marca a thread de cada nó para o perfilador (só age com uma sessão de perfil ativa)
+workflow.add_node("dedup", perfilar_no("dedup")(check_duplicate))
+workflow.add_node("layout", perfilar_no("layout")(try_layout))
+workflow.add_node("agent", perfilar_no("agent")(call_model))
+workflow.add_node("action", perfilar_no("action")(call_tools))
+workflow.add_edge(START, "dedup")
+workflow.add_conditional_edges("dedup", route_after_dedup, {"layout": "layout", END: END})
+workflow.add_conditional_edges("layout", route_after_layout, {"agent": "agent", END: END})
 workflow.add_conditional_edges("agent", should_continue, {"action": "action", END: END})
 workflow.add_edge("action", "agent")
 memory = MemorySaver()
 app = workflow.compile(checkpointer=memory)
-print("Workflow compilado com sucesso!")
\ No newline at end of file
+print("Workflow compilado com sucesso!")
@@ -0,0 +1,247 @@
+"""
+PERFILADOR por amostragem das requisições (sem dependências, baixo custo).
+
+Uma thread única lê, a cada INTERVALO ms, a pilha (sys._current_frames) das
+threads que estão rodando nós do grafo de uma sessão de perfil ativa. O tempo
+aparece onde realmente foi gasto: convert_from_path, tesseract (esperando o
+subprocesso), BeautifulSoup, pd.read_excel no acumulado, ou esperando o
+modelo (leitura do socket HTTP).
+
+Quando perfilar (via .env):
+- Cabeçalho 'X-Perfil: 1' na requisição (se NF_PERFIL_CABECALHO_ATIVO != 0);
+- Sorteio de uma fração das requisições (NF_PERFIL_TAXA, ex: 0.01 = 1%);
+- Requisições lentas: com NF_PERFIL_LIMIAR_SEGUNDOS > 0, toda requisição é
+  amostrada e o perfil só é gravado se ela passar do limiar.
+
+Os perfis vão para NF_PERFIL_DIR com o hash (SHA-256) do arquivo no nome, em
+dois formatos: '.speedscope.json' (abrir em https://www.speedscope.app) e
+'.folded' (pilhas colapsadas, para flamegraph.pl). 'indice.jsonl' lista todos.
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import threading
+import functools
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# --- Configuração (via .env) ---
+PERFIL_DIR = os.getenv("NF_PERFIL_DIR", os.path.join("dados_saida", "perfis"))
+PERFIL_TAXA = float(os.getenv("NF_PERFIL_TAXA", "0"))
+PERFIL_LIMIAR_SEGUNDOS = float(os.getenv("NF_PERFIL_LIMIAR_SEGUNDOS", "0")) # 0 = desligado
+PERFIL_CABECALHO_ATIVO = os.getenv("NF_PERFIL_CABECALHO_ATIVO", "1") != "0"
+PERFIL_INTERVALO_MS = float(os.getenv("NF_PERFIL_INTERVALO_MS", "10"))
+PERFIL_PROFUNDIDADE_MAX = 128
+
+CABECALHO_PERFIL = "X-Perfil"
+
+# Sessão de perfil da requisição atual (propaga para as threads dos nós do grafo)
+_sessao_atual: ContextVar[Optional["SessaoPerfil"]] = ContextVar("sessao_perfil", default=None)
+
+
+class SessaoPerfil:
+    """Amostras de uma requisição: pilhas colapsadas (tupla de quadros) -> contagem."""
+
+    def __init__(self, nome: str, motivo: str, hash_documento: str = "sem_arquivo"):
+        self.nome = nome
+        self.motivo = motivo # 'cabecalho', 'taxa' ou 'limiar'
+        self.hash_documento = hash_documento
+        # Nome dos arquivos do perfil, já conhecido no início (a API o devolve no cabeçalho X-Perfil)
+        self.nome_base = f"{hash_documento[:16]}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+        self.inicio = time.monotonic()
+        self.duracao_segundos: Optional[float] = None
+        self.pilhas: Counter = Counter()
+        self._threads: Dict[int, str] = {} # id da thread -> rótulo do nó em execução
+        self._trava = threading.Lock()
+
+    def _entrar(self, rotulo: str) -> Optional[str]:
+        ident = threading.get_ident()
+        with self._trava:
+            anterior = self._threads.get(ident)
+            self._threads[ident] = rotulo
+        return anterior
+
+    def _sair(self, anterior: Optional[str]) -> None:
+        ident = threading.get_ident()
+        with self._trava:
+            if anterior is None:
+                self._threads.pop(ident, None)
+            else:
+                self._threads[ident] = anterior
+
+    def threads_ativas(self) -> List[Tuple[int, str]]:
+        with self._trava:
+            return list(self._threads.items())
+
+    def registrar_amostra(self, rotulo: str, quadro) -> None:
+        pilha = []
+        while quadro is not None and len(pilha) < PERFIL_PROFUNDIDADE_MAX:
+            codigo = quadro.f_code
+            if codigo is _CODIGO_NO: # Acima do nó só há o pool de threads do LangGraph
+                break
+            pilha.append((codigo.co_name, codigo.co_filename, codigo.co_firstlineno))
+            quadro = quadro.f_back
+        pilha.append((rotulo, "", 0)) # Raiz: o nó do grafo
+        self.pilhas[tuple(reversed(pilha))] += 1
+
+
+class _Amostrador:
+    """Thread única que amostra as sessões ativas; dorme quando não há nenhuma."""
+
+    def __init__(self, intervalo_segundos: float):
+        self.intervalo_segundos = intervalo_segundos
+        self._sessoes: List[SessaoPerfil] = []
+        self._condicao = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def adicionar(self, sessao: SessaoPerfil) -> None:
+        with self._condicao:
+            self._sessoes.append(sessao)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._rodar, name="perfilador", daemon=True)
+                self._thread.start()
+            self._condicao.notify()
+
+    def remover(self, sessao: SessaoPerfil) -> None:
+        with self._condicao:
+            if sessao in self._sessoes:
+                self._sessoes.remove(sessao)
+
+    def _rodar(self) -> None:
+        while True:
+            with self._condicao:
+                while not self._sessoes:
+                    self._condicao.wait()
+                sessoes = list(self._sessoes)
+            quadros = sys._current_frames()
+            for sessao in sessoes:
+                for ident, rotulo in sessao.threads_ativas():
+                    quadro = quadros.get(ident)
+                    if quadro is not None:
+                        sessao.registrar_amostra(rotulo, quadro)
+            del quadros
+            time.sleep(self.intervalo_segundos)
+
+
+_amostrador = _Amostrador(PERFIL_INTERVALO_MS / 1000)
+
+
+# --- Decisão e ciclo de vida ---
+def motivo_perfil(cabecalho: Optional[str]) -> Optional[str]:
+    """Por que perfilar esta requisição (None = não perfilar)."""
+    if PERFIL_CABECALHO_ATIVO and cabecalho and cabecalho.strip().lower() in ("1", "true", "sim"):
+        return "cabecalho"
+    if PERFIL_TAXA > 0 and random.random() < PERFIL_TAXA:
+        return "taxa"
+    if PERFIL_LIMIAR_SEGUNDOS > 0:
+        return "limiar"
+    return None
+
+@contextmanager
+def sessao_perfil(nome: str, motivo: Optional[str], caminho_arquivo: Optional[str] = None) -> Iterator[Optional[SessaoPerfil]]:
+    """
+    Ativa a amostragem para o código (e os nós do grafo) dentro do bloco e, no fim,
+    grava o perfil se for o caso. motivo=None não faz nada. O hash do arquivo é
+    calculado no início (o upload pode ser apagado dentro do bloco).
+    """
+    if motivo is None:
+        yield None
+        return
+    hash_documento = hash_arquivo(caminho_arquivo) if caminho_arquivo and os.path.exists(caminho_arquivo) else "sem_arquivo"
+    sessao = SessaoPerfil(nome, motivo, hash_documento)
+    token = _sessao_atual.set(sessao)
+    _amostrador.adicionar(sessao)
+    try:
+        yield sessao
+    finally:
+        _amostrador.remover(sessao)
+        _sessao_atual.reset(token)
+        sessao.duracao_segundos = time.monotonic() - sessao.inicio
+        if deve_gravar(sessao):
+            try:
+                gravar_perfil(sessao)
+            except OSError as e: # O perfil nunca derruba a requisição
+                print(f"Erro ao gravar o perfil {sessao.nome_base}: {e}")
+
+def perfilar_no(rotulo: str) -> Callable:
+    """
+    Decorador dos nós do grafo: marca a thread que roda o nó para o amostrador.
+    Mantém a assinatura original (o LangGraph continua passando o 'config' a quem o recebe).
+    """
+    def decorador(funcao: Callable) -> Callable:
+        @functools.wraps(funcao)
+        def envolvido(*args, **kwargs):
+            sessao = _sessao_atual.get()
+            if sessao is None:
+                return funcao(*args, **kwargs)
+            anterior = sessao._entrar(rotulo)
+            try:
+                return funcao(*args, **kwargs)
+            finally:
+                sessao._sair(anterior)
+        return envolvido
+    return decorador
+
+_CODIGO_NO = perfilar_no("")(lambda: None).__code__
+
+
+# --- Gravação ---
+def hash_arquivo(caminho: str) -> str:
+    sha = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+def deve_gravar(sessao: Optional[SessaoPerfil]) -> bool:
+    """Pedidos (cabeçalho/taxa) sempre; os do limiar só se a requisição foi lenta."""
+    if sessao is None:
+        return False
+    return sessao.motivo != "limiar" or (bool(sessao.pilhas) and (sessao.duracao_segundos or 0) >= PERFIL_LIMIAR_SEGUNDOS)
+
+def _speedscope(sessao: SessaoPerfil) -> Dict[str, Any]:
+    quadros: Dict[Tuple[str, str, int], int] = {}
+    amostras, pesos = [], []
+    for pilha, contagem in sessao.pilhas.items():
+        amostras.append([quadros.setdefault(quadro, len(quadros)) for quadro in pilha])
+        pesos.append(contagem * PERFIL_INTERVALO_MS)
+    total = sum(pesos)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": sessao.nome,
+        "exporter": "nf-perfilador",
+        "activeProfileIndex": 0,
+        "shared": {"frames": [{"name": nome, "file": arquivo, "line": linha} if arquivo else {"name": nome}
+                              for nome, arquivo, linha in quadros]},
+        "profiles": [{"type": "sampled", "name": sessao.nome, "unit": "milliseconds",
+                      "startValue": 0, "endValue": total, "samples": amostras, "weights": pesos}],
+    }
+
+def _pilhas_colapsadas(sessao: SessaoPerfil) -> str:
+    linhas = []
+    for pilha, contagem in sessao.pilhas.most_common():
+        quadros = [nome if not arquivo else f"{nome} ({os.path.basename(arquivo)}:{linha})" for nome, arquivo, linha in pilha]
+        linhas.append(f"{';'.join(quadros)} {contagem}")
+    return "\n".join(linhas) + "\n"
+
+def gravar_perfil(sessao: SessaoPerfil, pasta: str = PERFIL_DIR) -> str:
+    """Grava o perfil (speedscope + pilhas colapsadas) e uma linha no índice. Retorna o nome base dos arquivos."""
+    os.makedirs(pasta, exist_ok=True)
+    nome_base = sessao.nome_base
+    with open(os.path.join(pasta, f"{nome_base}.speedscope.json"), "w", encoding="utf-8") as f:
+        json.dump(_speedscope(sessao), f, ensure_ascii=False)
+    with open(os.path.join(pasta, f"{nome_base}.folded"), "w", encoding="utf-8") as f:
+        f.write(_pilhas_colapsadas(sessao))
+    entrada = {"perfil": nome_base, "nome": sessao.nome, "sha256": sessao.hash_documento, "motivo": sessao.motivo,
+               "duracao_segundos": round(sessao.duracao_segundos or 0, 3), "amostras": sum(sessao.pilhas.values()),
+               "gravado_em": datetime.now().isoformat(timespec="seconds")}
+    with open(os.path.join(pasta, "indice.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+    print(f"Perfil gravado: {nome_base} ({entrada['duracao_segundos']}s, {entrada['amostras']} amostras, motivo: {sessao.motivo})")
+    return nome_base
@@ -0,0 +1,83 @@
+"""
+RE-EXTRAÇÃO DIRECIONADA dos campos reprovados pelo validador.
+
+Em vez de repetir o OCR e o loop inteiro do agente, faz UMA chamada pequena ao
+LLM com o texto bruto já extraído, pedindo apenas os campos com erro (e o motivo
+de cada um). O modelo responde por uma ferramenta com só esses campos.
+"""
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.messages import BaseMessage, HumanMessage
+from pydantic.v1 import Field, create_model
+
+from tools.extracao import DadosNotaFiscal
+from tools.validacao import validar_dados
+
+# --- Configuração (via .env) ---
+REEXTRACAO_ATIVA = os.getenv("NF_REEXTRACAO_ATIVA", "1") != "0"
+REEXTRACAO_MAX_CARACTERES = int(os.getenv("NF_REEXTRACAO_MAX_CARACTERES", "12000"))
+
+NOME_FERRAMENTA_CORRECAO = "corrigir_campos_nota"
+
+prompt_correcao = """
+Alguns campos extraídos de uma nota fiscal brasileira foram reprovados na validação.
+Releia o TEXTO BRUTO abaixo e informe o valor correto APENAS destes campos:
+{campos}
+Atenção a dígitos trocados pelo OCR (0/O, 1/I/l, 5/S, 8/B). Se o valor não estiver no texto, deixe-o nulo.
+Responda chamando a ferramenta '{ferramenta}'.
+
+TEXTO BRUTO:
+{texto}
+"""
+
+
+def criar_modelo_correcao(campos: List[str]):
+    """Modelo Pydantic (v1) só com os campos pedidos, com os mesmos tipos e descrições de DadosNotaFiscal."""
+    definicoes = {}
+    for campo in campos:
+        original = DadosNotaFiscal.__fields__[campo]
+        definicoes[campo] = (Optional[original.outer_type_], Field(None, description=original.field_info.description))
+    modelo = create_model(NOME_FERRAMENTA_CORRECAO, **definicoes)
+    modelo.__doc__ = "Valores corrigidos dos campos reprovados na validação."
+    return modelo
+
+
+def reextrair_campos(
+    modelo_llm: Any,
+    texto_bruto: str,
+    dados: DadosNotaFiscal,
+    erros: Dict[str, str],
+    invocar: Callable[[Any, List[BaseMessage]], Any],
+) -> DadosNotaFiscal:
+    """
+    Pede ao LLM só os campos em 'erros' e devolve os dados mesclados.
+    'invocar(modelo, mensagens)' é quem chama o LLM (cache + cliente com limites).
+    Se a correção piorar a validação, mantém os dados originais.
+    """
+    campos = list(erros)
+    descricao_campos = "\n".join(
+        f"- {campo} (valor atual: {getattr(dados, campo)!r}; problema: {motivo})" for campo, motivo in erros.items()
+    )
+    conteudo = prompt_correcao.format(
+        campos=descricao_campos,
+        ferramenta=NOME_FERRAMENTA_CORRECAO,
+        texto=texto_bruto[:REEXTRACAO_MAX_CARACTERES],
+    )
+    modelo_correcao = modelo_llm.bind_tools([criar_modelo_correcao(campos)], tool_choice=NOME_FERRAMENTA_CORRECAO)
+    resposta = invocar(modelo_correcao, [HumanMessage(content=conteudo)])
+
+    chamadas = getattr(resposta, "tool_calls", None) or []
+    if not chamadas:
+        print("Re-extração: o modelo não retornou correções.")
+        return dados
+    corrigidos = {campo: valor for campo, valor in chamadas[0]["args"].items() if campo in erros and valor is not None}
+    if not corrigidos:
+        return dados
+
+    candidato = DadosNotaFiscal(**{**dados.dict(), **corrigidos})
+    if len(validar_dados(candidato)) > len(erros):
+        print("Re-extração: correção reprovada em mais campos que o original, mantendo os dados originais.")
+        return dados
+    print(f"Re-extração: campos corrigidos {sorted(corrigidos)}")
+    return candidato